@@ -23,11 +23,12 @@ from starlette.status import HTTP_401_UNAUTHORIZED
 
 from sqlalchemy import func, case, select, text
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 
 from pydantic import BaseModel
 
 from .db import get_db, engine, SessionLocal
-from .models import Base, User, Thread, Message, Contact, ContactTag, ContactNote, ContactReminder
+from .models import Base, User, Thread, Message, Contact, ContactTag, ContactNote, ContactReminder, InboundJob, InboundJobMessage
 from .schemas import (
     LoginRequest,
     LoginResponse,
@@ -38,10 +39,21 @@ from .schemas import (
 )
 from .auth import create_token, verify_password, hash_password, get_current_user
 
-from .services.llm_service import run_llm
+from .services.llm_service import run_llm, llm_breaker, hedge_stats
+from .services.inbound_buffer import inbound_buffer, merge_turn_text
+from .services import metrics
+from .services.response_cache import response_cache
+from .services.llm_telemetry import telemetry
+from .services.token_budget import token_budget
+from .services import http_clients
+from .services.media_cache import media_cache
+from .services import doc_extract
+from .services.media_worker import media_worker
+from .services.inbound_queue import inbound_queue
 from .providers import twilio as twilio_provider
 from .providers import meta as meta_provider
 from .realtime import hub
+from .phone import normalize_phone
 
 # -----------------------------
 # App & CORS
@@ -106,15 +118,30 @@ async def all_exception_handler(request: Request, exc: Exception):
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    # Circuito aberto não derruba o healthcheck: a API continua respondendo com fallback
+    return {"ok": True, "llm_circuit": llm_breaker.state}
+
+@app.get("/metrics")
+def get_metrics(db: Session = Depends(get_db)):
+    """Contadores e latências em memória (LLM, webhooks, mídia) e estado da fila de entrada."""
+    data = metrics.snapshot()
+    data["llm_circuit"] = llm_breaker.snapshot()
+    data["llm_hedge"] = hedge_stats()
+    data["llm_budget"] = token_budget.snapshot()
+    data["media_cache"] = media_cache.stats()
+    data["media_worker"] = media_worker.snapshot()
+    data["inbound_queue"] = inbound_queue.snapshot(db)
+    return data
 
 # ------- Routers extras -------
 from app.routers import takeover
 from app.routers import tasks
 from app.routers import crm
+from app.routers import llm as llm_router
 app.include_router(takeover.router)
 app.include_router(tasks.router)
 app.include_router(crm.router)
+app.include_router(llm_router.router)
 # ---------------------------------------------
 
 # -----------------------------
@@ -186,6 +213,146 @@ def _fix_messages_is_human(db: Session) -> None:
     """))
     db.commit()
 
+def _fix_threads_llm_usage(db: Session) -> None:
+    """
+    Garante as colunas de consumo de tokens em threads.
+    Idempotente: pode rodar várias vezes.
+    """
+    db.execute(text("ALTER TABLE threads ADD COLUMN IF NOT EXISTS llm_prompt_tokens INTEGER NOT NULL DEFAULT 0;"))
+    db.execute(text("ALTER TABLE threads ADD COLUMN IF NOT EXISTS llm_completion_tokens INTEGER NOT NULL DEFAULT 0;"))
+    db.commit()
+
+def _fix_messages_meta(db: Session) -> None:
+    """
+    Garante a coluna messages.meta (JSONB): referências/estado da mídia recebida.
+    Idempotente: pode rodar várias vezes.
+    """
+    db.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS meta JSONB;"))
+    db.commit()
+
+def _fix_provider_message_ids(db: Session) -> None:
+    """
+    Garante messages.provider_message_id e inbound_jobs.provider_message_id com
+    índice único (retries do webhook). Idempotente: pode rodar várias vezes.
+    """
+    db.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS provider_message_id VARCHAR(128);"))
+    db.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_messages_provider_message_id ON messages (provider_message_id);"))
+    db.execute(text("ALTER TABLE inbound_jobs ADD COLUMN IF NOT EXISTS provider_message_id VARCHAR(128);"))
+    db.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_inbound_jobs_provider_message_id ON inbound_jobs (provider_message_id);"))
+    db.commit()
+
+def _fix_phone_e164(db: Session) -> None:
+    """
+    Garante threads.phone_e164 / contacts.phone_e164 (número normalizado e
+    indexado) e preenche os que faltam. Na primeira vez, junta as threads
+    duplicadas do mesmo número (fica a mais recente, com as mensagens e o
+    contato das outras) antes de criar o índice único.
+    Idempotente: pode rodar várias vezes.
+    """
+    db.execute(text("ALTER TABLE threads ADD COLUMN IF NOT EXISTS phone_e164 VARCHAR(32);"))
+    db.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS phone_e164 VARCHAR(32);"))
+    db.commit()
+    has_unique_index = db.execute(text("SELECT to_regclass('ix_threads_phone_e164') IS NOT NULL;")).scalar()
+
+    # Preenche com a mesma normalização usada no código
+    for table, column in (("threads", "external_user_phone"), ("contacts", "phone")):
+        rows = db.execute(text(
+            f"SELECT id, {column} FROM {table} WHERE phone_e164 IS NULL AND {column} IS NOT NULL;"
+        )).fetchall()
+        updates = [{"id": row[0], "p": normalize_phone(row[1])} for row in rows]
+        updates = [u for u in updates if u["p"]]
+        if not updates:
+            continue
+        if table == "threads" and has_unique_index:
+            # Índice já existe: não duplica um número que outra thread já tem
+            db.execute(text(
+                "UPDATE threads SET phone_e164 = :p WHERE id = :id "
+                "AND NOT EXISTS (SELECT 1 FROM threads o WHERE o.phone_e164 = :p);"
+            ), updates)
+        else:
+            db.execute(text(f"UPDATE {table} SET phone_e164 = :p WHERE id = :id;"), updates)
+    db.commit()
+
+    if not has_unique_index:
+        duplicated = db.execute(text(
+            "SELECT phone_e164 FROM threads WHERE phone_e164 IS NOT NULL "
+            "GROUP BY phone_e164 HAVING COUNT(*) > 1;"
+        )).scalars().all()
+        for phone in duplicated:
+            ids = db.execute(
+                text("SELECT id FROM threads WHERE phone_e164 = :p ORDER BY id DESC;"), {"p": phone}
+            ).scalars().all()
+            _merge_threads(db, ids[0], list(ids[1:]))
+        db.commit()
+        if duplicated:
+            print(f"✅ Unidas threads duplicadas de {len(duplicated)} número(s)")
+        db.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_threads_phone_e164 ON threads (phone_e164);"))
+
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_contacts_phone_e164 ON contacts (phone_e164);"))
+    db.commit()
+
+# Campos do contato herdados na união de threads -> condição de "preenchido"
+# ({} = tabela). Nome genérico ("WhatsApp 1234" / "Contato ...") conta como vazio.
+_CONTACT_MERGE_FIELDS = {
+    "name": "COALESCE({0}.name, '') <> '' AND {0}.name NOT LIKE 'WhatsApp%' AND {0}.name NOT LIKE 'Contato %'",
+    "email": "COALESCE({0}.email, '') <> ''",
+    "phone": "COALESCE({0}.phone, '') <> ''",
+    "phone_e164": "{0}.phone_e164 IS NOT NULL",
+    "company": "COALESCE({0}.company, '') <> ''",
+    "total_orders": "{0}.total_orders > 0",
+    "total_spent": "{0}.total_spent > 0",
+    "average_ticket": "{0}.average_ticket IS NOT NULL",
+    "most_bought_products": "{0}.most_bought_products IS NOT NULL",
+}
+
+def _merge_threads(db: Session, keep_id: int, dup_ids: List[int]) -> None:
+    """Move mensagens, telemetria, consumo e contato das threads `dup_ids` para `keep_id` e remove as duplicadas."""
+    params = {"keep": keep_id, "dups": dup_ids}
+    db.execute(text("UPDATE messages SET thread_id = :keep WHERE thread_id = ANY(:dups);"), params)
+    db.execute(text("UPDATE llm_calls SET thread_id = :keep WHERE thread_id = ANY(:dups);"), params)
+    db.execute(text("""
+        UPDATE threads SET
+            llm_prompt_tokens = llm_prompt_tokens + (SELECT COALESCE(SUM(llm_prompt_tokens), 0) FROM threads WHERE id = ANY(:dups)),
+            llm_completion_tokens = llm_completion_tokens + (SELECT COALESCE(SUM(llm_completion_tokens), 0) FROM threads WHERE id = ANY(:dups))
+        WHERE id = :keep;
+    """), params)
+
+    # Um contato por thread: a mantida fica com o seu (ou o da duplicada mais recente);
+    # tags, notas e lembretes dos outros passam para ele
+    keep_contact = db.execute(text("SELECT id FROM contacts WHERE thread_id = :keep;"), params).scalar()
+    dup_contacts = db.execute(
+        text("SELECT id FROM contacts WHERE thread_id = ANY(:dups) ORDER BY thread_id DESC;"), params
+    ).scalars().all()
+    dup_contacts = list(dup_contacts)
+    if keep_contact is None and dup_contacts:
+        keep_contact = dup_contacts.pop(0)
+        db.execute(text("UPDATE contacts SET thread_id = :keep WHERE id = :c;"), {"keep": keep_id, "c": keep_contact})
+    if dup_contacts:
+        contact_params = {"c": keep_contact, "others": dup_contacts}
+        # Antes de apagar os outros contatos, o mantido herda os dados de CRM que não
+        # tem (do contato da duplicada mais recente que tiver o campo)
+        fill = {
+            column: f"(SELECT d.{column} FROM contacts d WHERE d.id = ANY(:others) AND {cond.format('d')} "
+                    f"ORDER BY d.thread_id DESC LIMIT 1)"
+            for column, cond in _CONTACT_MERGE_FIELDS.items()
+        }
+        db.execute(text(
+            "UPDATE contacts SET "
+            + ", ".join(
+                f"{column} = CASE WHEN {cond.format('contacts')} THEN {column} "
+                f"ELSE COALESCE({fill[column]}, {column}) END"
+                for column, cond in _CONTACT_MERGE_FIELDS.items()
+            )
+            + ", last_interaction_at = GREATEST(last_interaction_at, "
+              "(SELECT MAX(d.last_interaction_at) FROM contacts d WHERE d.id = ANY(:others))) "
+            + "WHERE id = :c;"
+        ), contact_params)
+        for table in ("contact_tags", "contact_notes", "contact_reminders"):
+            db.execute(text(f"UPDATE {table} SET contact_id = :c WHERE contact_id = ANY(:others);"), contact_params)
+        db.execute(text("DELETE FROM contacts WHERE id = ANY(:others);"), contact_params)
+
+    db.execute(text("DELETE FROM threads WHERE id = ANY(:dups);"), params)
+
 def _fix_contacts_table(db: Session) -> None:
     """
     Garante que a tabela contacts tenha todas as colunas necessárias.
@@ -526,7 +693,11 @@ def seed_user_and_migrate():
         # Migrações
         _fix_threads_meta(db)
         _fix_messages_is_human(db)
+        _fix_threads_llm_usage(db)
+        _fix_messages_meta(db)
+        _fix_provider_message_ids(db)
         _fix_contacts_table(db)  # Garante que contacts tenha todas as colunas
+        _fix_phone_e164(db)  # Antes de qualquer consulta ORM em threads/contacts
         _update_existing_contacts(db)  # Atualiza contatos existentes
         
         # seed - cria usuário Admin se não existir
@@ -566,6 +737,24 @@ def seed_user_and_migrate():
     finally:
         db.close()
 
+@app.on_event("startup")
+async def start_background_services():
+    http_clients.start()
+    telemetry.start()
+    media_worker.start()
+    inbound_queue.start({"twilio": _twilio_job, "meta": _meta_job})
+    if not inbound_queue.enabled:
+        # Sem a fila durável, os jobs de mídia em memória se perdem no shutdown
+        _resume_pending_media()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await inbound_queue.stop()
+    await media_worker.stop()
+    await telemetry.stop()
+    await http_clients.close()
+    doc_extract.shutdown()
+
 # Endpoint manual caso queira rodar o fix on-demand
 @app.get("/debug/fix-threads-meta")
 def debug_fix_threads_meta(db: Session = Depends(get_db)):
@@ -793,6 +982,7 @@ def _serialize_thread(t: Thread, db: Session = None) -> dict:
         "origin": getattr(t, "origin", None),
         "lead_level": getattr(t, "lead_level", None),
         "lead_score": getattr(t, "lead_score", None),
+        "llm_usage": token_budget.thread_usage(t),
         "metadata": getattr(t, "meta", None),  # meta -> metadata
         "external_user_phone": getattr(t, "external_user_phone", None),
         "created_at": _iso(getattr(t, "created_at", None)),
@@ -850,25 +1040,89 @@ async def stream_thread(
 # -----------------------------
 # Helpers
 # -----------------------------
-def _normalize_phone(phone: str) -> str:
+def _thread_by_phone(db: Session, phone: str) -> Optional[Thread]:
+    """Thread do número (normalizado), pelo índice único em threads.phone_e164."""
+    phone_e164 = normalize_phone(phone)
+    if not phone_e164:
+        return None
+    return db.query(Thread).filter(Thread.phone_e164 == phone_e164).first()
+
+def _known_provider_ids(db: Session, provider_message_ids: List[Optional[str]], include_queue: bool = True) -> Set[str]:
+    """Ids do provedor já gravados em messages (ou na fila): retries do webhook."""
+    ids = [pid for pid in provider_message_ids if pid]
+    if not ids:
+        return set()
+    known = {pid for (pid,) in db.query(Message.provider_message_id).filter(Message.provider_message_id.in_(ids))}
+    if include_queue:
+        known.update(
+            pid for (pid,) in db.query(InboundJob.provider_message_id).filter(InboundJob.provider_message_id.in_(ids))
+        )
+        known.update(
+            pid
+            for (pid,) in db.query(InboundJobMessage.provider_message_id)
+            .filter(InboundJobMessage.provider_message_id.in_(ids))
+        )
+    return known
+
+def _is_duplicate_inbound(db: Session, provider_message_id: Optional[str]) -> bool:
+    """A mensagem do provedor já foi gravada (ou está na fila)? Retry do webhook."""
+    return bool(provider_message_id) and provider_message_id in _known_provider_ids(db, [provider_message_id])
+
+def _inbound_messages(db: Session, provider_message_ids: List[Optional[str]]) -> Dict[str, Message]:
+    """Mensagens já gravadas para esses ids do provedor (id -> Message)."""
+    ids = [pid for pid in provider_message_ids if pid]
+    if not ids:
+        return {}
+    return {m.provider_message_id: m for m in db.query(Message).filter(Message.provider_message_id.in_(ids))}
+
+def _turn_answered(db: Session, m: Message) -> bool:
+    """A IA já respondeu depois desta mensagem do usuário?"""
+    return (
+        db.query(Message.id)
+        .filter(Message.thread_id == m.thread_id, Message.role == "assistant", Message.id > m.id)
+        .first()
+        is not None
+    )
+
+def _duplicate_inbound(channel: str, provider_message_id: str, thread: Optional[Thread] = None) -> dict:
+    """
+    Resposta rápida para retry: nada é gravado nem processado. `thread` é a
+    conversa do número, se existir: em takeover a IA não responderia, então
+    não conta como chamada evitada.
+    """
+    logging.getLogger(__name__).info(f"[WEBHOOK-{channel.upper()}] Mensagem {provider_message_id} já recebida; ignorando retry")
+    metrics.incr(f"webhook.{channel}.duplicate")
+    if not (thread is not None and getattr(thread, "human_takeover", False)):
+        metrics.incr("llm.duplicate_calls_avoided")
+    return {"status": "ok", "duplicate": True}
+
+def _save_inbound_message(db: Session, m: Message) -> bool:
+    """Grava a mensagem recebida; False se o provider_message_id já existia (retry concorrente)."""
+    db.add(m)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    db.refresh(m)
+    return True
+
+def _insert_thread(db: Session, t: Thread) -> Thread:
     """
-    Normaliza número de telefone para formato E.164 consistente.
-    Remove 'whatsapp:', espaços, e garante que comece com '+'.
-    Exemplos:
-    - 'whatsapp:+556184081114' -> '+556184081114'
-    - '+556184081114' -> '+556184081114'
-    - '556184081114' -> '+556184081114'
+    Grava uma thread nova de um número. Se outro webhook criou a thread do
+    mesmo número no meio tempo (índice único), usa a que já existe.
     """
-    if not phone:
-        return ""
-    # Remove 'whatsapp:' prefix
-    normalized = str(phone).replace("whatsapp:", "").strip()
-    # Remove espaços e caracteres especiais (exceto +)
-    normalized = normalized.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-    # Garante que comece com +
-    if normalized and not normalized.startswith("+"):
-        normalized = "+" + normalized
-    return normalized
+    db.add(t)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = _thread_by_phone(db, t.external_user_phone)
+        if existing is None:
+            raise
+        return existing
+    db.refresh(t)
+    return t
 
 # -----------------------------
 # Threads (sem response_model)
@@ -916,33 +1170,10 @@ def create_thread(
     # Normaliza o telefone se fornecido
     phone = None
     if body.phone:
-        phone = _normalize_phone(body.phone)
+        phone = normalize_phone(body.phone)
         
         # Verifica se já existe uma thread com este telefone
-        # Busca por número exato primeiro
-        existing_thread = (
-            db.query(Thread)
-            .filter(Thread.external_user_phone == phone)
-            .order_by(Thread.id.desc())
-            .first()
-        )
-        
-        # Se não encontrou, busca normalizando todos os números do banco
-        if not existing_thread:
-            all_threads = (
-                db.query(Thread)
-                .filter(Thread.external_user_phone.isnot(None))
-                .all()
-            )
-            for thread in all_threads:
-                if thread.external_user_phone and _normalize_phone(thread.external_user_phone) == phone:
-                    existing_thread = thread
-                    # Atualiza o número no banco para o formato normalizado
-                    if thread.external_user_phone != phone:
-                        thread.external_user_phone = phone
-                        db.commit()
-                        db.refresh(thread)
-                    break
+        existing_thread = _thread_by_phone(db, phone)
         
         # Se encontrou thread existente, retorna erro
         if existing_thread:
@@ -976,7 +1207,19 @@ def create_thread(
         t.meta = meta_data if meta_data else None
     
     db.add(t)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Webhook (ou outro cadastro) criou a thread do número no meio tempo
+        db.rollback()
+        existing_thread = _thread_by_phone(db, phone) if phone else None
+        if existing_thread is None:
+            raise
+        from fastapi import HTTPException
+        raise HTTPException(
+            status_code=400,
+            detail=f"Já existe um contato com este número. Thread ID: {existing_thread.id}"
+        )
     db.refresh(t)
     
     # Cria o contato automaticamente se tiver nome ou telefone
@@ -1026,6 +1269,11 @@ def update_thread_endpoint(
         t.lead_score = int(body.lead_score) if body.lead_score is not None else None
     if body.metadata is not None:
         t.meta = body.metadata
+    if body.lead_level is not None or body.lead_score is not None:
+        # Classificação manual prevalece sobre a qualificação automática do LLM
+        meta = dict(t.meta or {})
+        meta["lead"] = {**(meta.get("lead") or {}), "source": "manual"}
+        t.meta = meta
 
     db.add(t)
     db.commit()
@@ -1066,6 +1314,7 @@ def get_messages(
             role=m.role,
             content=m.content,
             created_at=m.created_at,
+            meta=m.meta,
         )
         for m in msgs
     ]
@@ -1141,7 +1390,7 @@ async def send_message(
     ]
 
     await _broadcast(thread_id, {"type": "assistant.typing.start"})
-    reply = await run_llm(body.content, thread_history=hist, takeover=False)
+    reply = await run_llm(body.content, thread_history=hist, takeover=False, thread_id=thread_id)
     await _broadcast(thread_id, {"type": "assistant.typing.stop"})
 
     if not reply:
@@ -1206,6 +1455,119 @@ async def send_message(
         created_at=m_assist.created_at,
     )
 
+# -----------------------------
+# Resposta automática (webhooks WhatsApp)
+# -----------------------------
+async def _send_whatsapp_reply(channel: str, phone: str, reply: str) -> None:
+    """Envia a resposta da IA pelo mesmo provedor em que a mensagem chegou."""
+    logger = logging.getLogger(__name__)
+
+    if channel == "meta":
+        await meta_provider.send_text(phone, reply)
+        return
+
+    if not phone or not phone.strip():
+        logger.error(f"[WEBHOOK-TWILIO] No phone number to send to (from_ is empty)")
+        return
+
+    # Garante que o número está no formato correto (a função send_text já faz isso, mas vamos garantir)
+    phone_to_send = phone.strip()
+    if not phone_to_send.startswith("+"):
+        logger.warning(f"[WEBHOOK-TWILIO] Phone number doesn't start with +, normalizing: {phone_to_send}")
+        if not phone_to_send.startswith("whatsapp:"):
+            phone_to_send = "+" + phone_to_send.lstrip("+")
+
+    try:
+        logger.info(f"[WEBHOOK-TWILIO] Sending reply to {phone_to_send}: {reply[:50]}...")
+        logger.info(f"[WEBHOOK-TWILIO] Reply length: {len(reply)} chars")
+
+        sid = await asyncio.to_thread(twilio_provider.send_text, phone_to_send, reply, "BOT")
+
+        if sid:
+            logger.info(f"[WEBHOOK-TWILIO] ✅ Message sent successfully. SID: {sid}")
+        else:
+            logger.warning(f"[WEBHOOK-TWILIO] ⚠️ send_text returned empty SID, but no exception was raised")
+
+    except Exception as e:
+        logger.error(f"[WEBHOOK-TWILIO] ❌ Error sending reply to {phone_to_send}: {str(e)}", exc_info=True)
+        logger.error(f"[WEBHOOK-TWILIO] Exception type: {type(e).__name__}")
+        # Não retorna erro para não quebrar o webhook, mas loga o problema
+        # Tenta enviar uma mensagem de erro genérica se possível
+        try:
+            error_msg = "Desculpe, houve um problema técnico. Nossa equipe foi notificada."
+            await asyncio.to_thread(twilio_provider.send_text, phone_to_send, error_msg, "BOT")
+        except:
+            logger.error(f"[WEBHOOK-TWILIO] Failed to send error message too")
+
+
+async def _reply_to_turn(
+    db: Session,
+    t: Thread,
+    user_text: str,
+    hist: List[dict],
+    channel: str,
+    phone: str,
+) -> dict:
+    """
+    Gera a resposta da IA para um turno do usuário, persiste, faz broadcast
+    e envia pelo WhatsApp. Usado pelos webhooks e pelo flush do debounce.
+    """
+    logger = logging.getLogger(__name__)
+    tag = "WEBHOOK-META" if channel == "meta" else "WEBHOOK-TWILIO"
+    logger.info(f"[{tag}] Processing LLM for thread {t.id}, history length: {len(hist)}")
+
+    await _broadcast(t.id, {"type": "assistant.typing.start"})
+    try:
+        reply = await run_llm(user_text, thread_history=hist, takeover=False, thread_id=t.id)
+        logger.info(f"[{tag}] LLM reply generated: {(reply or '')[:100]}...")
+    except Exception as e:
+        logger.error(f"[{tag}] Error generating LLM reply: {str(e)}", exc_info=True)
+        reply = "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente."
+    await _broadcast(t.id, {"type": "assistant.typing.stop"})
+
+    if not reply or not reply.strip():
+        logger.warning(f"[{tag}] Reply is empty, skipping send")
+        return {"status": "ok", "skipped": "empty_reply"}
+
+    m_assist = Message(thread_id=t.id, role="assistant", content=reply)
+    db.add(m_assist)
+    db.commit()
+    db.refresh(m_assist)
+
+    await _broadcast(
+        t.id,
+        {"type": "message.created", "message": {"id": m_assist.id, "role": "assistant", "content": reply}},
+    )
+
+    await _send_whatsapp_reply(channel, phone, reply)
+    return {"status": "ok"}
+
+
+async def _flush_inbound_turn(thread_id: int, items: List[dict]) -> None:
+    """
+    Callback do debounce: responde de uma vez às mensagens acumuladas na janela.
+    Roda fora do request, então abre a própria sessão de banco.
+    """
+    db = SessionLocal()
+    try:
+        t = db.get(Thread, thread_id)
+        if not t or getattr(t, "human_takeover", False):
+            return
+
+        # Histórico até antes do lote; o lote inteiro vira um único turno do usuário
+        first_id = min(i["message_id"] for i in items)
+        hist = [
+            {"role": m.role, "content": m.content}
+            for m in db.query(Message)
+            .filter(Message.thread_id == thread_id, Message.id < first_id)
+            .order_by(Message.id.asc())
+            .all()
+        ]
+        last = items[-1]
+        await _reply_to_turn(db, t, merge_turn_text(items), hist, last["channel"], last["phone"])
+    finally:
+        db.close()
+
 # -----------------------------
 # Webhooks WhatsApp - Meta
 # -----------------------------
@@ -1223,28 +1585,111 @@ def meta_verify(
             return hub_challenge or "OK"
     raise HTTPException(403, "Invalid verify token")
 
+def _meta_inbound_batches(data: dict) -> List[dict]:
+    """
+    Agrupa por remetente todas as mensagens de uma entrega da Meta (ela junta
+    várias entries/changes/messages num POST só sob carga). Devolve, na ordem
+    de chegada, [{"from", "profile_name", "messages": [{"id", "text"}]}].
+    """
+    batches: Dict[str, dict] = {}
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            # Nome do perfil do WhatsApp por wa_id
+            names = {}
+            for contact_info in value.get("contacts") or []:
+                name = (contact_info.get("profile") or {}).get("name") or contact_info.get("name")
+                if contact_info.get("wa_id") and name:
+                    names[contact_info["wa_id"]] = name
+            for msg in value.get("messages") or []:
+                from_ = msg.get("from")  # wa_id
+                if not from_:
+                    continue
+                batch = batches.setdefault(from_, {"from": from_, "profile_name": None, "messages": []})
+                batch["profile_name"] = names.get(from_) or batch["profile_name"]
+                batch["messages"].append({
+                    "id": msg.get("id"),  # wamid: a Meta reenvia o mesmo id nos retries
+                    "text": (msg.get("text", {}) or {}).get("body", "") or "",
+                })
+    return list(batches.values())
+
 @app.post("/webhooks/meta")
 async def meta_webhook(req: Request, db: Session = Depends(get_db)):
-    data = await req.json()
     try:
-        value = data["entry"][0]["changes"][0]["value"]
-        messages = value.get("messages", [])
-        if not messages:
-            return {"status": "ignored"}
-        
-        changes = messages[0]
-        from_ = changes["from"]  # wa_id
-        text_in = (changes.get("text", {}) or {}).get("body", "") or ""
-        
-        # Tenta capturar o nome do perfil do WhatsApp
-        profile_name = None
-        contacts = value.get("contacts", [])
-        if contacts:
-            # O primeiro contato geralmente é o remetente
-            contact_info = contacts[0]
-            profile_name = contact_info.get("profile", {}).get("name") or contact_info.get("name")
+        data = await req.json()
+        batches = _meta_inbound_batches(data)
     except Exception:
         return {"status": "ignored"}
+    if not batches:
+        return {"status": "ignored"}
+
+    # Retries da Meta: descarta as mensagens já recebidas (uma consulta para a entrega toda)
+    known = _known_provider_ids(db, [m["id"] for b in batches for m in b["messages"]])
+    results = []
+    for batch in batches:
+        fresh = [m for m in batch["messages"] if not m["id"] or m["id"] not in known]
+        _meta_duplicates(db, batch["from"], [m["id"] for m in batch["messages"] if m["id"] and m["id"] in known])
+        if not fresh:
+            results.append({"status": "ok", "duplicate": True})
+            continue
+        # Fila durável: um job por remetente; os workers fazem o resto
+        if inbound_queue.enabled:
+            job_id = None
+            # Um retry concorrente pode ter enfileirado parte do lote: tenta de novo com o que falta
+            for _ in range(2):
+                payload = {"from": batch["from"], "profile_name": batch["profile_name"], "messages": fresh}
+                job_id = inbound_queue.enqueue(
+                    db, "meta", normalize_phone(batch["from"]), payload, provider_message_ids=[m["id"] for m in fresh]
+                )
+                if job_id is not None:
+                    break
+                queued = _known_provider_ids(db, [m["id"] for m in fresh])
+                _meta_duplicates(db, batch["from"], [m["id"] for m in fresh if m["id"] in queued])
+                fresh = [m for m in fresh if not m["id"] or m["id"] not in queued]
+                if not fresh:
+                    break
+            results.append({"status": "ok", "queued": True} if job_id is not None else {"status": "ok", "duplicate": True})
+            continue
+        payload = {"from": batch["from"], "profile_name": batch["profile_name"], "messages": fresh}
+        results.append(await _handle_meta_inbound(db, payload))
+
+    if len(results) == 1:
+        return results[0]
+    return {"status": "ok", "senders": len(results), "results": results}
+
+def _meta_duplicates(db: Session, from_: str, provider_message_ids: List[str]) -> None:
+    """Registra os retries descartados de um remetente (a thread decide a métrica de takeover)."""
+    if not provider_message_ids:
+        return
+    t = _thread_by_phone(db, from_)
+    for pid in provider_message_ids:
+        _duplicate_inbound("meta", pid, t)
+
+async def _handle_meta_inbound(db: Session, payload: dict) -> dict:
+    """
+    Processa as mensagens de um remetente recebidas pela Meta numa entrega:
+    thread, contato, mensagens (uma transação só), um único turno para a LLM
+    e envio. Chamado pelo webhook (sem fila) ou pelos workers da inbound_queue.
+    """
+    from_ = payload["from"]
+    profile_name = payload.get("profile_name")
+    # Jobs gravados antes do lote por remetente têm uma mensagem só
+    messages = payload.get("messages") or [{"id": payload.get("message_id"), "text": payload.get("text") or ""}]
+    # Job da fila repetido depois de gravar as mensagens (falha no envio, shutdown):
+    # as já respondidas são descartadas; as sem resposta entram no turno de novo
+    # (as que ainda estão no buffer de debounce já vão ser respondidas)
+    existing = _inbound_messages(db, [m["id"] for m in messages])
+    resumed: List[Message] = []
+    for pid, m_saved in existing.items():
+        if _turn_answered(db, m_saved) or inbound_buffer.contains(m_saved.thread_id, m_saved.id):
+            _duplicate_inbound("meta", pid, m_saved.thread)
+        else:
+            resumed.append(m_saved)
+    messages = [m for m in messages if not m["id"] or m["id"] not in existing]
+    if not messages and not resumed:
+        return {"status": "ok", "duplicate": True}
+    if resumed:
+        metrics.incr("webhook.meta.resumed", len(resumed))
 
     owner_email = os.getenv("INBOX_OWNER_EMAIL", "Admin")
     owner = db.query(User).filter(User.email == owner_email).first()
@@ -1255,32 +1700,12 @@ async def meta_webhook(req: Request, db: Session = Depends(get_db)):
         db.refresh(owner)
 
     # Normaliza o número do Meta também
-    from_ = _normalize_phone(from_)
-    
-    # Busca thread existente - normaliza o número do banco também para comparação
-    t = (
-        db.query(Thread)
-        .filter(Thread.user_id == owner.id, Thread.external_user_phone == from_)
-        .order_by(Thread.id.desc())
-        .first()
-    )
+    from_ = normalize_phone(from_)
     
-    # Se não encontrou, tenta buscar normalizando os números do banco
-    if not t:
-        all_threads = (
-            db.query(Thread)
-            .filter(Thread.user_id == owner.id)
-            .all()
-        )
-        for thread in all_threads:
-            if thread.external_user_phone and _normalize_phone(thread.external_user_phone) == from_:
-                t = thread
-                # Atualiza o número no banco para o formato normalizado
-                if thread.external_user_phone != from_:
-                    thread.external_user_phone = from_
-                    db.commit()
-                    db.refresh(thread)
-                break
+    # Busca thread existente pelo número normalizado (índice único)
+    t = _thread_by_phone(db, from_)
+    if t and t.user_id != owner.id:
+        t.user_id = owner.id
     
     # Prepara o metadata com o nome do perfil se disponível
     meta_data = {}
@@ -1299,9 +1724,7 @@ async def meta_webhook(req: Request, db: Session = Depends(get_db)):
             external_user_phone=from_,
             meta=meta_data if meta_data else None
         )
-        db.add(t)
-        db.commit()
-        db.refresh(t)
+        t = _insert_thread(db, t)
     else:
         # Atualiza o metadata e título se tiver nome do perfil
         if profile_name:
@@ -1322,9 +1745,6 @@ async def meta_webhook(req: Request, db: Session = Depends(get_db)):
             # Atualiza o título se ainda for genérico
             if t.title.startswith("WhatsApp"):
                 t.title = profile_name
-            
-            db.commit()
-            db.refresh(t)
     
     # Atualiza ou cria o contato com o nome do perfil
     from .models import Contact
@@ -1332,52 +1752,88 @@ async def meta_webhook(req: Request, db: Session = Depends(get_db)):
     if contact:
         if profile_name and (not contact.name or contact.name.startswith("WhatsApp") or contact.name.startswith("Contato ")):
             contact.name = profile_name
-            db.commit()
     elif profile_name:
-        # Cria o contato com o nome do perfil
-        contact = Contact(
-            thread_id=t.id,
-            user_id=owner.id,
-            phone=from_,
-            name=profile_name,
-        )
-        db.add(contact)
-        db.commit()
+        # Cria o contato com o nome do perfil (savepoint: um retry concorrente pode já ter criado)
+        try:
+            with db.begin_nested():
+                db.add(Contact(thread_id=t.id, user_id=owner.id, phone=from_, name=profile_name))
+        except IntegrityError:
+            pass
 
-    m_user = Message(thread_id=t.id, role="user", content=text_in)
-    db.add(m_user)
+    # Perfil/título da thread, contato e mensagens do lote num único commit (thread nova
+    # já foi gravada por _insert_thread). As mensagens vão num savepoint: se um retry
+    # concorrente gravou parte do lote, só elas são desfeitas e grava-se o que falta
+    rows = [
+        Message(thread_id=t.id, role="user", content=m["text"], provider_message_id=m["id"] or None)
+        for m in messages
+    ]
+    try:
+        with db.begin_nested():
+            db.add_all(rows)
+    except IntegrityError:
+        known = _known_provider_ids(db, [m["id"] for m in messages], include_queue=False)
+        for m in messages:
+            if m["id"] in known:
+                _duplicate_inbound("meta", m["id"], t)
+        rows = [
+            Message(thread_id=t.id, role="user", content=m["text"], provider_message_id=m["id"] or None)
+            for m in messages
+            if not m["id"] or m["id"] not in known
+        ]
+        try:
+            with db.begin_nested():
+                db.add_all(rows)
+        except IntegrityError:
+            rows = []
     db.commit()
-    db.refresh(m_user)
-
-    await _broadcast(
-        t.id,
-        {"type": "message.created", "message": {"id": m_user.id, "role": "user", "content": text_in}},
-    )
+    if not rows and not resumed:
+        return {"status": "ok", "duplicate": True}
+    for m_user in rows:
+        db.refresh(m_user)
+
+    for m_user in rows:
+        await _broadcast(
+            t.id,
+            {"type": "message.created", "message": {"id": m_user.id, "role": "user", "content": m_user.content}},
+        )
 
     if getattr(t, "human_takeover", False):
         return {"status": "ok", "skipped_llm": True}
 
+    items = [
+        {"message_id": m_user.id, "content": m_user.content, "channel": "meta", "phone": from_}
+        for m_user in sorted(resumed + rows, key=lambda m: m.id)
+    ]
+    # Debounce: acumula mensagens em sequência e responde uma vez só
+    if inbound_buffer.enabled:
+        for item in items:
+            inbound_buffer.submit(t.id, item, _flush_inbound_turn)
+        return {"status": "ok", "buffered": True}
+
+    # O lote inteiro vira um único turno do usuário
     hist = [
         {"role": m.role, "content": m.content}
-        for m in db.query(Message).filter(Message.thread_id == t.id).order_by(Message.id.asc()).all()
+        for m in db.query(Message)
+        .filter(Message.thread_id == t.id, Message.id <= items[-1]["message_id"])
+        .order_by(Message.id.asc())
+        .all()
     ]
 
-    await _broadcast(t.id, {"type": "assistant.typing.start"})
-    reply = await run_llm(text_in, thread_history=hist, takeover=False)
-    await _broadcast(t.id, {"type": "assistant.typing.stop"})
+    return await _reply_to_turn(db, t, merge_turn_text(items), hist, "meta", from_)
 
-    m_assist = Message(thread_id=t.id, role="assistant", content=reply)
-    db.add(m_assist)
-    db.commit()
-    db.refresh(m_assist)
+async def _run_inbound_job(handler, payload: dict, **kwargs) -> None:
+    """Job da inbound_queue: roda o handler do canal com uma sessão própria."""
+    db = SessionLocal()
+    try:
+        await handler(db, payload, **kwargs)
+    finally:
+        db.close()
 
-    await _broadcast(
-        t.id,
-        {"type": "message.created", "message": {"id": m_assist.id, "role": "assistant", "content": reply}},
-    )
+async def _twilio_job(payload: dict) -> None:
+    await _run_inbound_job(_handle_twilio_inbound, payload, inline_media=True)
 
-    await meta_provider.send_text(from_, reply)
-    return {"status": "ok"}
+async def _meta_job(payload: dict) -> None:
+    await _run_inbound_job(_handle_meta_inbound, payload)
 
 # -----------------------------
 # Webhooks WhatsApp - Twilio
@@ -1391,8 +1847,9 @@ async def twilio_webhook(req: Request, db: Session = Depends(get_db)):
     try:
         form = await req.form()
         from_raw = str(form.get("From", ""))
-        from_ = _normalize_phone(from_raw)  # Normaliza o número
+        from_ = normalize_phone(from_raw)  # Normaliza o número
         body = form.get("Body", "") or ""
+        message_sid = str(form.get("MessageSid") or form.get("SmsMessageSid") or "") or None
         
         # Detecta mídia (Twilio envia NumMedia quando há anexos)
         num_media = int(form.get("NumMedia", "0") or "0")
@@ -1404,10 +1861,58 @@ async def twilio_webhook(req: Request, db: Session = Depends(get_db)):
         profile_name = form.get("ProfileName") or form.get("Profile Name") or None
         if profile_name:
             logger.info(f"[WEBHOOK-TWILIO] Profile name: {profile_name}")
+
+        media_items = _twilio_media_items(form, num_media) if has_media else []
     except Exception as e:
         logger.error(f"[WEBHOOK-TWILIO] Error parsing webhook: {str(e)}", exc_info=True)
         return {"status": "error", "message": str(e)}
 
+    payload = {
+        "from_raw": from_raw,
+        "from": from_,
+        "body": body,
+        "profile_name": profile_name,
+        "media_items": media_items,
+        "message_sid": message_sid,
+    }
+    # Retry da Twilio (timeout do webhook): responde 200 sem gravar nem chamar a LLM de novo
+    if _is_duplicate_inbound(db, message_sid):
+        return _duplicate_inbound("twilio", message_sid, _thread_by_phone(db, from_))
+
+    # Fila durável: só grava e responde; os workers fazem o resto
+    if inbound_queue.enabled:
+        job_id = inbound_queue.enqueue(db, "twilio", from_, payload, provider_message_ids=[message_sid])
+        if job_id is None:
+            return _duplicate_inbound("twilio", message_sid, _thread_by_phone(db, from_))
+        logger.info(f"[WEBHOOK-TWILIO] Message from {from_} queued (job {job_id})")
+        return {"status": "ok", "queued": True}
+    return await _handle_twilio_inbound(db, payload)
+
+async def _handle_twilio_inbound(db: Session, payload: dict, inline_media: bool = False) -> dict:
+    """
+    Processa uma mensagem recebida pela Twilio: thread, contato, mídia, LLM e envio.
+    Chamado pelo webhook (sem fila) ou pelos workers da inbound_queue
+    (`inline_media=True`: a mídia é processada aqui mesmo, o job já está fora do request).
+    """
+    logger = logging.getLogger(__name__)
+    from_raw, from_ = payload["from_raw"], payload["from"]
+    body = payload.get("body") or ""
+    profile_name = payload.get("profile_name")
+    media_items = payload.get("media_items") or []
+    message_sid = payload.get("message_sid")
+
+    # Job da fila repetido depois de a mensagem já ter sido gravada (falha na mídia,
+    # no envio ou shutdown): retoma de onde parou em vez de descartar
+    existing = _inbound_messages(db, [message_sid]).get(message_sid)
+    if existing is not None:
+        t = db.get(Thread, existing.thread_id)
+        # No buffer de debounce: já vai ser respondida
+        if t is None or _turn_answered(db, existing) or inbound_buffer.contains(t.id, existing.id):
+            return _duplicate_inbound("twilio", message_sid, t)
+        logger.info(f"[WEBHOOK-TWILIO] Retomando mensagem {existing.id} ({message_sid}) sem resposta")
+        metrics.incr("webhook.twilio.resumed")
+        return await _continue_twilio_message(db, t, existing, body, media_items, from_, inline_media=True)
+
     owner_email = os.getenv("INBOX_OWNER_EMAIL", "Admin")
     owner = db.query(User).filter(User.email == owner_email).first()
     if not owner:
@@ -1416,82 +1921,18 @@ async def twilio_webhook(req: Request, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(owner)
 
-    # Busca thread existente - SEMPRE normaliza os números do banco para comparação
-    # Busca por número exato primeiro (caso já esteja normalizado)
-    t = (
-        db.query(Thread)
-        .filter(Thread.user_id == owner.id, Thread.external_user_phone == from_)
-        .order_by(Thread.id.desc())
-        .first()
-    )
-    
-    # Se não encontrou, busca normalizando TODOS os números do banco
-    if not t:
-        logger.info(f"[WEBHOOK-TWILIO] Buscando thread para número normalizado: '{from_}' (original: '{from_raw}')")
-        all_threads = (
-            db.query(Thread)
-            .filter(Thread.user_id == owner.id, Thread.external_user_phone.isnot(None))
-            .all()
-        )
-        logger.info(f"[WEBHOOK-TWILIO] Encontradas {len(all_threads)} threads do usuário {owner.id} com telefone")
-        
-        for thread in all_threads:
-            if not thread.external_user_phone:
-                continue
-            normalized_db_phone = _normalize_phone(thread.external_user_phone)
-            logger.debug(f"[WEBHOOK-TWILIO] Comparando: DB='{thread.external_user_phone}' (normalizado: '{normalized_db_phone}') vs incoming='{from_}'")
-            
-            if normalized_db_phone == from_:
-                logger.info(f"[WEBHOOK-TWILIO] ✅ Thread encontrada! ID={thread.id}, número DB='{thread.external_user_phone}' (normalizado: '{normalized_db_phone}')")
-                t = thread
-                # Atualiza o número no banco para o formato normalizado (se diferente)
-                if thread.external_user_phone != from_:
-                    logger.info(f"[WEBHOOK-TWILIO] Atualizando número no banco de '{thread.external_user_phone}' para '{from_}'")
-                    thread.external_user_phone = from_
-                    db.commit()
-                    db.refresh(thread)
-                break
-        
-        if not t:
-            logger.warning(f"[WEBHOOK-TWILIO] ⚠️ Nenhuma thread encontrada para número '{from_}' (normalizado de '{from_raw}').")
-            # Última tentativa: busca em TODAS as threads (caso tenha havido migração de usuário)
-            logger.info(f"[WEBHOOK-TWILIO] Buscando em TODAS as threads (última tentativa)...")
-            all_threads_global = (
-                db.query(Thread)
-                .filter(Thread.external_user_phone.isnot(None))
-                .all()
-            )
-            # Coleta todas as threads com o mesmo número (pode haver duplicatas)
-            matching_threads = []
-            for thread in all_threads_global:
-                if thread.external_user_phone and _normalize_phone(thread.external_user_phone) == from_:
-                    matching_threads.append(thread)
-            
-            if matching_threads:
-                # Se houver múltiplas, usa a mais recente (maior ID)
-                matching_threads.sort(key=lambda x: x.id, reverse=True)
-                t = matching_threads[0]
-                
-                # Migra para o usuário correto se necessário
-                if t.user_id != owner.id:
-                    logger.warning(f"[WEBHOOK-TWILIO] ⚠️ Thread encontrada em OUTRO usuário! ID={t.id}, user_id={t.user_id}, migrando para user_id={owner.id}")
-                    t.user_id = owner.id
-                
-                # Normaliza o número se necessário
-                if t.external_user_phone != from_:
-                    logger.info(f"[WEBHOOK-TWILIO] Atualizando número no banco de '{t.external_user_phone}' para '{from_}'")
-                    t.external_user_phone = from_
-                
-                # Se houver threads duplicadas, marca as outras para possível limpeza futura
-                if len(matching_threads) > 1:
-                    logger.warning(f"[WEBHOOK-TWILIO] ⚠️ Encontradas {len(matching_threads)} threads duplicadas para número '{from_}'. Usando thread ID={t.id} (mais recente).")
-                    for dup_thread in matching_threads[1:]:
-                        logger.warning(f"[WEBHOOK-TWILIO] ⚠️ Thread duplicada ID={dup_thread.id} será ignorada (mensagens devem ir para thread {t.id})")
-                
-                db.commit()
-                db.refresh(t)
+    # Busca thread existente pelo número normalizado (índice único em threads.phone_e164)
+    t = _thread_by_phone(db, from_)
+    if t:
+        logger.info(f"[WEBHOOK-TWILIO] ✅ Thread encontrada: ID={t.id}, número='{from_}'")
+        # Migra para o usuário correto se necessário
+        if t.user_id != owner.id:
+            logger.warning(f"[WEBHOOK-TWILIO] ⚠️ Thread encontrada em OUTRO usuário! ID={t.id}, user_id={t.user_id}, migrando para user_id={owner.id}")
+            t.user_id = owner.id
+            db.commit()
+            db.refresh(t)
     else:
-        logger.info(f"[WEBHOOK-TWILIO] ✅ Thread encontrada por busca exata: ID={t.id}, número='{from_}'")
+        logger.info(f"[WEBHOOK-TWILIO] Nenhuma thread para o número '{from_}' (original: '{from_raw}')")
     
     # Prepara o metadata com o nome do perfil se disponível
     meta_data = {}
@@ -1512,9 +1953,7 @@ async def twilio_webhook(req: Request, db: Session = Depends(get_db)):
             external_user_phone=from_,
             meta=meta_data if meta_data else None
         )
-        db.add(t)
-        db.commit()
-        db.refresh(t)
+        t = _insert_thread(db, t)
         logger.warning(f"[WEBHOOK-TWILIO] ⚠️⚠️⚠️ Nova thread criada: ID={t.id}")
     else:
         # Atualiza o metadata e título se tiver nome do perfil
@@ -1558,144 +1997,286 @@ async def twilio_webhook(req: Request, db: Session = Depends(get_db)):
         db.add(contact)
         db.commit()
 
-    # Processa mídia se houver
-    media_context = ""
-    if has_media:
-        # Envia resposta imediata "Estou processando..."
-        processing_msg = "📎 Recebi sua mídia. Estou analisando, um minuto..."
-        try:
-            await asyncio.to_thread(twilio_provider.send_text, from_, processing_msg, "BOT")
-            logger.info(f"[WEBHOOK-TWILIO] Sent processing message to {from_}")
-        except Exception as e:
-            logger.error(f"[WEBHOOK-TWILIO] Error sending processing message: {str(e)}")
-        
-        # Processa cada mídia recebida
-        from .services import media_processor
-        
-        for i in range(num_media):
-            media_url = form.get(f"MediaUrl{i}")
-            content_type = form.get(f"MediaContentType{i}")
-            
-            if not media_url:
-                continue
-            
-            logger.info(f"[WEBHOOK-TWILIO] Processing media {i+1}/{num_media}: {content_type}")
-            
-            # Determina tipo de mídia
-            if content_type and content_type.startswith("audio/"):
-                media_type = "audio"
-            elif content_type and content_type.startswith("image/"):
-                media_type = "image"
-            else:
-                media_type = "document"
-            
-            # Processa mídia
-            result = await media_processor.process_media(
-                media_url=media_url,
-                media_type=media_type,
-                filename=form.get(f"MediaFilename{i}"),
-                mime_type=content_type
-            )
-            
-            if result["success"]:
-                if media_type == "audio":
-                    # Formato que a IA entenderá como transcrição direta
-                    media_context += f"\n[Áudio transcrito]: {result['content']}\n"
-                elif media_type == "image":
-                    # Formato que a IA entenderá como descrição visual direta
-                    media_context += f"\n[Descrição da imagem]: {result['content']}\n"
-                else:
-                    # Formato que a IA entenderá como conteúdo do documento
-                    media_context += f"\n[Conteúdo do documento]: {result['content']}\n"
-            else:
-                media_context += f"\n[Erro ao processar mídia {i+1}]: {result.get('error', 'Erro desconhecido')}\n"
-                logger.error(f"[WEBHOOK-TWILIO] Error processing media: {result.get('error')}")
-    
-    # Combina texto da mensagem com contexto da mídia
-    full_content = body
-    if media_context:
-        full_content = f"{body}\n{media_context}".strip()
-        if not body:
-            full_content = media_context.strip()
-    
-    m_user = Message(thread_id=t.id, role="user", content=full_content)
-    db.add(m_user)
-    db.commit()
-    db.refresh(m_user)
+    # Mídia: grava a mensagem com as referências. Vindo da fila durável, processa
+    # aqui mesmo; no request, entrega ao media_worker e responde já (evita o
+    # timeout/retry da Twilio)
+    if media_items:
+        m_user = Message(
+            thread_id=t.id,
+            role="user",
+            content=body or "[Mídia recebida]",
+            meta={"media": {"status": "pending", "items": media_items}},
+            provider_message_id=message_sid,
+        )
+        if not _save_inbound_message(db, m_user):
+            return _duplicate_inbound("twilio", message_sid, t)
+        await _broadcast(
+            t.id,
+            {"type": "message.created", "message": {"id": m_user.id, "role": "user", "content": m_user.content, "meta": m_user.meta}},
+        )
+        return await _continue_twilio_message(db, t, m_user, body, media_items, from_, inline_media)
+
+    m_user = Message(thread_id=t.id, role="user", content=body, provider_message_id=message_sid)
+    if not _save_inbound_message(db, m_user):
+        return _duplicate_inbound("twilio", message_sid, t)
 
     await _broadcast(
         t.id,
-        {"type": "message.created", "message": {"id": m_user.id, "role": "user", "content": full_content}},
+        {"type": "message.created", "message": {"id": m_user.id, "role": "user", "content": body}},
     )
+    return await _continue_twilio_message(db, t, m_user, body, media_items, from_, inline_media)
+
+async def _continue_twilio_message(
+    db: Session,
+    t: Thread,
+    m_user: Message,
+    body: str,
+    media_items: List[dict],
+    from_: str,
+    inline_media: bool,
+) -> dict:
+    """
+    Depois de gravada a mensagem: mídia pendente (worker ou inline), takeover,
+    debounce e resposta. Também retoma uma mensagem cujo job falhou no meio.
+    """
+    logger = logging.getLogger(__name__)
+    media_status = ((m_user.meta or {}).get("media") or {}).get("status")
+    if media_items and media_status != "done":
+        job = {
+            "thread_id": t.id,
+            "message_id": m_user.id,
+            "body": body,
+            "items": media_items,
+            "channel": "twilio",
+            "phone": from_,
+        }
+        if inline_media:
+            await _process_inbound_media(job)
+            return {"status": "ok", "media": "processed"}
+        if media_worker.submit(job, _process_inbound_media):
+            logger.info(f"[WEBHOOK-TWILIO] {len(media_items)} media item(s) queued for message {m_user.id}")
+            return {"status": "ok", "media": "queued"}
+        # Fila cheia: processa no próprio request (como antes)
+        logger.warning(f"[WEBHOOK-TWILIO] Media queue full, processing message {m_user.id} inline")
+        await _process_inbound_media(job)
+        return {"status": "ok", "media": "processed"}
+
+    full_content = m_user.content
 
     if getattr(t, "human_takeover", False):
         logger.info(f"[WEBHOOK-TWILIO] Thread {t.id} in human takeover, skipping LLM")
         return {"status": "ok", "skipped_llm": True}
 
+    # Debounce: acumula mensagens em sequência e responde uma vez só
+    if inbound_buffer.enabled:
+        pending = inbound_buffer.submit(
+            t.id,
+            {"message_id": m_user.id, "content": full_content, "channel": "twilio", "phone": from_},
+            _flush_inbound_turn,
+        )
+        logger.info(f"[WEBHOOK-TWILIO] Thread {t.id}: mensagem no buffer ({pending} pendente(s))")
+        return {"status": "ok", "buffered": True}
+
     hist = [
         {"role": m.role, "content": m.content}
-        for m in db.query(Message).filter(Message.thread_id == t.id).order_by(Message.id.asc()).all()
+        for m in db.query(Message)
+        .filter(Message.thread_id == t.id, Message.id <= m_user.id)
+        .order_by(Message.id.asc())
+        .all()
     ]
-    logger.info(f"[WEBHOOK-TWILIO] Processing LLM for thread {t.id}, history length: {len(hist)}")
-
-    await _broadcast(t.id, {"type": "assistant.typing.start"})
-    try:
-        reply = await run_llm(full_content, thread_history=hist, takeover=False)
-        logger.info(f"[WEBHOOK-TWILIO] LLM reply generated: {reply[:100]}...")
-    except Exception as e:
-        logger.error(f"[WEBHOOK-TWILIO] Error generating LLM reply: {str(e)}", exc_info=True)
-        reply = "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente."
-    await _broadcast(t.id, {"type": "assistant.typing.stop"})
-
-    m_assist = Message(thread_id=t.id, role="assistant", content=reply)
-    db.add(m_assist)
-    db.commit()
-    db.refresh(m_assist)
 
-    await _broadcast(
-        t.id,
-        {"type": "message.created", "message": {"id": m_assist.id, "role": "assistant", "content": reply}},
-    )
+    return await _reply_to_turn(db, t, full_content, hist, "twilio", from_)
 
-    # Envia resposta via Twilio
-    if not reply or not reply.strip():
-        logger.warning(f"[WEBHOOK-TWILIO] Reply is empty, skipping send")
-        return {"status": "ok", "skipped": "empty_reply"}
-    
-    if not from_ or not from_.strip():
-        logger.error(f"[WEBHOOK-TWILIO] No phone number to send to (from_ is empty)")
-        return {"status": "error", "message": "No phone number"}
-    
-    # Garante que o número está no formato correto (a função send_text já faz isso, mas vamos garantir)
-    phone_to_send = from_.strip()
-    if not phone_to_send.startswith("+"):
-        logger.warning(f"[WEBHOOK-TWILIO] Phone number doesn't start with +, normalizing: {phone_to_send}")
-        if not phone_to_send.startswith("whatsapp:"):
-            phone_to_send = "+" + phone_to_send.lstrip("+")
-    
-    try:
-        logger.info(f"[WEBHOOK-TWILIO] Sending reply to {phone_to_send}: {reply[:50]}...")
-        logger.info(f"[WEBHOOK-TWILIO] Reply length: {len(reply)} chars")
+def _twilio_media_items(form, num_media: int) -> List[dict]:
+    """Anexos do webhook da Twilio no formato de `media_processor.process_media`."""
+    media_items = []
+    for i in range(num_media):
+        media_url = form.get(f"MediaUrl{i}")
+        content_type = form.get(f"MediaContentType{i}")
         
-        sid = await asyncio.to_thread(twilio_provider.send_text, phone_to_send, reply, "BOT")
+        if not media_url:
+            continue
         
-        if sid:
-            logger.info(f"[WEBHOOK-TWILIO] ✅ Message sent successfully. SID: {sid}")
+        # Determina tipo de mídia
+        if content_type and content_type.startswith("audio/"):
+            media_type = "audio"
+        elif content_type and content_type.startswith("image/"):
+            media_type = "image"
         else:
-            logger.warning(f"[WEBHOOK-TWILIO] ⚠️ send_text returned empty SID, but no exception was raised")
-            
-    except Exception as e:
-        logger.error(f"[WEBHOOK-TWILIO] ❌ Error sending reply to {phone_to_send}: {str(e)}", exc_info=True)
-        logger.error(f"[WEBHOOK-TWILIO] Exception type: {type(e).__name__}")
-        # Não retorna erro para não quebrar o webhook, mas loga o problema
-        # Tenta enviar uma mensagem de erro genérica se possível
+            media_type = "document"
+        
+        media_items.append({
+            "media_url": media_url,
+            "media_type": media_type,
+            "filename": form.get(f"MediaFilename{i}"),
+            "mime_type": content_type,
+        })
+    return media_items
+
+def _media_context(media_items: List[dict], results: List[dict]) -> str:
+    """Texto das mídias processadas, no formato que a IA entende."""
+    logger = logging.getLogger(__name__)
+    media_context = ""
+    for i, (item, result) in enumerate(zip(media_items, results)):
+        media_type = item["media_type"]
+        if result["success"]:
+            if media_type == "audio":
+                # Formato que a IA entenderá como transcrição direta
+                media_context += f"\n[Áudio transcrito]: {result['content']}\n"
+            elif media_type == "image":
+                # Formato que a IA entenderá como descrição visual direta
+                media_context += f"\n[Descrição da imagem]: {result['content']}\n"
+            else:
+                # Formato que a IA entenderá como conteúdo do documento
+                media_context += f"\n[Conteúdo do documento]: {result['content']}\n"
+        else:
+            media_context += f"\n[Erro ao processar mídia {i+1}]: {result.get('error', 'Erro desconhecido')}\n"
+            logger.error(f"[MEDIA-WORKER] Error processing media {i+1}: {result.get('error')}")
+    return media_context
+
+# Mensagens com mídia pendente mais antigas que isso não são retomadas no startup
+MEDIA_RESUME_HOURS = float(os.getenv("MEDIA_RESUME_HOURS", "24"))
+
+def _resume_pending_media() -> int:
+    """
+    Reenvia ao media_worker as mensagens recentes com mídia ainda "pending" e
+    sem resposta da IA (job perdido num restart). Devolve quantas retomou.
+    """
+    from datetime import datetime, timedelta
+    logger = logging.getLogger(__name__)
+    cutoff = datetime.utcnow() - timedelta(hours=MEDIA_RESUME_HOURS)
+    resumed = 0
+    db = SessionLocal()
+    try:
+        candidates = (
+            db.query(Message)
+            .filter(Message.role == "user", Message.meta.isnot(None), Message.created_at >= cutoff)
+            .order_by(Message.id.asc())
+            .all()
+        )
+        for m in candidates:
+            media = (m.meta or {}).get("media") or {}
+            if media.get("status") != "pending" or not media.get("items") or _turn_answered(db, m):
+                continue
+            t = db.get(Thread, m.thread_id)
+            if not t or not t.external_user_phone:
+                continue
+            job = {
+                "thread_id": t.id,
+                "message_id": m.id,
+                "body": "" if m.content == "[Mídia recebida]" else m.content,
+                "items": media["items"],
+                "channel": "twilio",
+                "phone": t.external_user_phone,
+                "resumed": True,
+            }
+            if not media_worker.submit(job, _process_inbound_media):
+                logger.warning(f"[MEDIA-WORKER] Fila cheia; mídia pendente da mensagem {m.id} em diante não foi retomada")
+                break
+            resumed += 1
+    finally:
+        db.close()
+    if resumed:
+        metrics.incr("media.worker.resumed", resumed)
+        logger.warning(f"[MEDIA-WORKER] {resumed} mensagem(ns) com mídia pendente retomada(s) no startup")
+    return resumed
+
+async def _process_inbound_media(job: dict) -> None:
+    """
+    Job do media_worker: processa os anexos de uma mensagem recebida, grava o
+    contexto (transcrição/descrição/texto) na mensagem e dispara a resposta.
+    Progresso vai para os assinantes da thread (media.processing / media.progress).
+    Roda fora do request, então abre a própria sessão de banco.
+    """
+    from .services import media_processor
+    logger = logging.getLogger(__name__)
+    thread_id, message_id, phone = job["thread_id"], job["message_id"], job["phone"]
+    media_items = job["items"]
+    total = len(media_items)
+
+    # Envia resposta imediata "Estou processando..." (retomado no startup: já foi enviada)
+    if not job.get("resumed"):
+        processing_msg = "📎 Recebi sua mídia. Estou analisando, um minuto..."
         try:
-            error_msg = "Desculpe, houve um problema técnico. Nossa equipe foi notificada."
-            await asyncio.to_thread(twilio_provider.send_text, phone_to_send, error_msg, "BOT")
-        except:
-            logger.error(f"[WEBHOOK-TWILIO] Failed to send error message too")
-    
-    return {"status": "ok"}
+            await asyncio.to_thread(twilio_provider.send_text, phone, processing_msg, "BOT")
+            logger.info(f"[MEDIA-WORKER] Sent processing message to {phone}")
+        except Exception as e:
+            logger.error(f"[MEDIA-WORKER] Error sending processing message: {str(e)}")
+
+    await _broadcast(thread_id, {"type": "media.processing", "message_id": message_id, "total": total})
+    done = 0
+
+    async def _progress(index: int, result: dict) -> None:
+        nonlocal done
+        done += 1
+        await _broadcast(thread_id, {
+            "type": "media.progress",
+            "message_id": message_id,
+            "index": index,
+            "success": bool(result.get("success")),
+            "done": done,
+            "total": total,
+        })
+
+    logger.info(f"[MEDIA-WORKER] Processing {total} media item(s) for message {message_id}")
+    results = await media_processor.process_media_batch(media_items, on_result=_progress)
+    media_context = _media_context(media_items, results)
+
+    # Combina texto da mensagem com contexto da mídia
+    body = job.get("body") or ""
+    full_content = body
+    if media_context:
+        full_content = f"{body}\n{media_context}".strip()
+        if not body:
+            full_content = media_context.strip()
+
+    db = SessionLocal()
+    try:
+        m_user = db.get(Message, message_id)
+        if not m_user:
+            return
+        meta = dict(m_user.meta or {})
+        meta["media"] = {
+            **(meta.get("media") or {}),
+            "status": "done",
+            "results": [
+                {k: r[k] for k in ("success", "type", "cached", "error") if k in r}
+                for r in results
+            ],
+        }
+        m_user.content = full_content or m_user.content
+        m_user.meta = meta
+        db.commit()
+
+        await _broadcast(
+            thread_id,
+            {"type": "message.updated", "message": {"id": m_user.id, "role": "user", "content": m_user.content, "meta": meta}},
+        )
+
+        t = db.get(Thread, thread_id)
+        if not t or getattr(t, "human_takeover", False):
+            logger.info(f"[MEDIA-WORKER] Thread {thread_id} in human takeover, skipping LLM")
+            return
+
+        # Debounce: entra no lote da thread como qualquer outra mensagem
+        if inbound_buffer.enabled:
+            inbound_buffer.submit(
+                thread_id,
+                {"message_id": m_user.id, "content": m_user.content, "channel": job["channel"], "phone": phone},
+                _flush_inbound_turn,
+            )
+            return
+
+        hist = [
+            {"role": m.role, "content": m.content}
+            for m in db.query(Message)
+            .filter(Message.thread_id == thread_id, Message.id <= message_id)
+            .order_by(Message.id.asc())
+            .all()
+        ]
+        await _reply_to_turn(db, t, m_user.content, hist, job["channel"], phone)
+    finally:
+        db.close()
 
 # -----------------------------
 # Stats (dashboard)
@@ -1958,6 +2539,9 @@ async def wc_update_webhook(
         # Não espera o processo terminar (executa em background)
         # O processo continuará rodando mesmo após a resposta
         
+        # Catálogo vai mudar: respostas em cache podem ficar desatualizadas
+        response_cache.purge(reason="wc_update")
+        
         return {
             "status": "accepted",
             "message": "Atualização de dados iniciada em background"
@@ -1993,6 +2577,7 @@ async def manual_update_wc_data(
         )
         
         if result.returncode == 0:
+            response_cache.purge(reason="wc_update")
             return {
                 "status": "success",
                 "message": "Dados atualizados com sucesso",
@@ -2,11 +2,13 @@
 from __future__ import annotations
 
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, ForeignKey, Text, func
+    Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, Index, func
 )
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship, validates
 from sqlalchemy.types import JSON
 
+from .phone import normalize_phone
+
 Base = declarative_base()
 
 
@@ -32,17 +34,28 @@ class Thread(Base):
 
     human_takeover = Column(Boolean, default=False, nullable=False)
     external_user_phone = Column(String(64), nullable=True)
+    # Número normalizado (E.164), preenchido a partir de external_user_phone: uma thread por número
+    phone_e164 = Column(String(32), nullable=True, unique=True, index=True)
 
     origin = Column(String(64), nullable=True)
     lead_level = Column(String(32), nullable=True)
     lead_score = Column(Integer, nullable=True)
 
+    # Consumo acumulado de tokens do LLM nesta conversa (ver services/token_budget.py)
+    llm_prompt_tokens = Column(Integer, default=0, server_default="0", nullable=False)
+    llm_completion_tokens = Column(Integer, default=0, server_default="0", nullable=False)
+
     # ⚠️ Coluna real no banco: "meta"
     meta = Column(JSON, name="meta", nullable=True)
 
     user = relationship("User", back_populates="threads")
     messages = relationship("Message", back_populates="thread", cascade="all, delete-orphan")
 
+    @validates("external_user_phone")
+    def _sync_phone_e164(self, key, value):
+        self.phone_e164 = normalize_phone(value) or None
+        return value
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -53,6 +66,9 @@ class Message(Base):
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
     is_human = Column(Boolean, default=False, nullable=False)  # Para mensagens enviadas por humanos
+    meta = Column(JSON, nullable=True)  # mídia recebida: {"media": {"status", "items", "results"}}
+    # Id da mensagem no provedor (Twilio MessageSid / Meta messages[].id): retries do webhook não duplicam
+    provider_message_id = Column(String(128), nullable=True, unique=True, index=True)
 
     thread = relationship("Thread", back_populates="messages")
 
@@ -70,6 +86,7 @@ class Contact(Base):
     name = Column(String(255), nullable=True)
     email = Column(String(255), nullable=True, index=True)
     phone = Column(String(64), nullable=True, index=True)
+    phone_e164 = Column(String(32), nullable=True, index=True)  # normalizado a partir de phone
     company = Column(String(255), nullable=True)
     
     # Métricas calculadas (cache)
@@ -87,6 +104,11 @@ class Contact(Base):
     notes = relationship("ContactNote", back_populates="contact", cascade="all, delete-orphan", order_by="ContactNote.created_at.desc()")
     reminders = relationship("ContactReminder", back_populates="contact", cascade="all, delete-orphan")
 
+    @validates("phone")
+    def _sync_phone_e164(self, key, value):
+        self.phone_e164 = normalize_phone(value) or None
+        return value
+
 
 class ContactTag(Base):
     """Tags personalizadas para contatos"""
@@ -126,3 +148,81 @@ class ContactReminder(Base):
     created_at = Column(DateTime, server_default=func.now())
 
     contact = relationship("Contact", back_populates="reminders")
+
+
+# ================== Telemetria LLM ==================
+class LLMCall(Base):
+    """Uma linha por invocação de run_llm: tokens, tools, retries e latência"""
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True)
+    # Sem FK: a telemetria sobrevive à exclusão da thread
+    thread_id = Column(Integer, nullable=True, index=True)
+    model = Column(String(64), nullable=True)
+    route = Column(String(16), nullable=True)      # full | light | template | cache
+    outcome = Column(String(32), nullable=True)    # ok | forced_final | deadline_exceeded | error | circuit_open | budget_exceeded
+
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    cached_tokens = Column(Integer, default=0, nullable=False)
+
+    tool_rounds = Column(Integer, default=0, nullable=False)
+    tool_calls = Column(JSON, nullable=True)       # [{"name": "lookup_product", "args": {...}, "round": 1, "ms": 12}]  # + "deduped": true se repetida
+    retries = Column(Integer, default=0, nullable=False)
+    latency_ms = Column(Integer, nullable=False)
+
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+
+# ================== Cache de análise de mídia ==================
+class MediaAnalysis(Base):
+    """Resultado de transcrição/visão por conteúdo (sha256 dos bytes) + tipo + modelo"""
+    __tablename__ = "media_analysis_cache"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "media_type", "model", name="uq_media_analysis_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    media_type = Column(String(16), nullable=False)   # audio | image | document
+    model = Column(String(64), nullable=False)
+    result_type = Column(String(32), nullable=True)   # transcription | description | extraction
+    content = Column(Text, nullable=False)
+    size_bytes = Column(Integer, nullable=True)
+
+    hits = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now(), index=True)
+
+
+# ================== Fila de mensagens recebidas ==================
+class InboundJob(Base):
+    """Mensagem recebida pelo webhook, aguardando processamento (ver services/inbound_queue.py)"""
+    __tablename__ = "inbound_jobs"
+    __table_args__ = (
+        Index("ix_inbound_jobs_claim", "status", "available_at"),
+        Index("ix_inbound_jobs_key_status", "thread_key", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    channel = Column(String(16), nullable=False)      # twilio | meta
+    thread_key = Column(String(64), nullable=False)   # telefone normalizado: ordem por conversa
+    payload = Column(JSON, nullable=False)
+    provider_message_id = Column(String(128), nullable=True, unique=True, index=True)
+    status = Column(String(16), nullable=False, default="queued", server_default="queued")  # queued | running | done | dead
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    last_error = Column(Text, nullable=True)
+
+    available_at = Column(DateTime, nullable=False, server_default=func.now())
+    locked_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class InboundJobMessage(Base):
+    """Id do provedor de cada mensagem de um job da inbound_queue (o job da Meta leva várias)"""
+    __tablename__ = "inbound_job_messages"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("inbound_jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    provider_message_id = Column(String(128), nullable=False, unique=True, index=True)
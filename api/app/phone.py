@@ -0,0 +1,28 @@
+# api/app/phone.py
+"""
+Normalização de telefones (WhatsApp) para E.164.
+
+É a forma gravada em `threads.phone_e164` / `contacts.phone_e164` (colunas
+indexadas): a busca da thread de um número é uma consulta direta por índice.
+"""
+
+
+def normalize_phone(phone: str) -> str:
+    """
+    Normaliza número de telefone para formato E.164 consistente.
+    Remove 'whatsapp:', espaços, e garante que comece com '+'.
+    Exemplos:
+    - 'whatsapp:+556184081114' -> '+556184081114'
+    - '+556184081114' -> '+556184081114'
+    - '556184081114' -> '+556184081114'
+    """
+    if not phone:
+        return ""
+    # Remove 'whatsapp:' prefix
+    normalized = str(phone).replace("whatsapp:", "").strip()
+    # Remove espaços e caracteres especiais (exceto +)
+    normalized = normalized.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
+    # Garante que comece com +
+    if normalized and not normalized.startswith("+"):
+        normalized = "+" + normalized
+    return normalized
@@ -1,4 +1,5 @@
-import os, httpx
+import os
+from ..services.http_clients import meta_client
 GRAPH_BASE = "https://graph.facebook.com/v20.0"
 ACCESS_TOKEN = os.getenv("META_ACCESS_TOKEN")
 PHONE_NUMBER_ID = os.getenv("META_PHONE_NUMBER_ID")
@@ -12,7 +13,6 @@ async def send_text(to: str, text: str):
         "text": {"body": text},
     }
     headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, json=payload, headers=headers)
-        r.raise_for_status()
-        return r.json()
+    r = await meta_client().post(url, json=payload, headers=headers)
+    r.raise_for_status()
+    return r.json()
@@ -0,0 +1,218 @@
+# app/routers/llm.py
+from datetime import datetime, timedelta
+from typing import Dict, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db import get_db
+from app.auth import get_current_user
+from app.models import User, LLMCall
+from app.services.response_cache import response_cache
+from app.services.llm_telemetry import estimate_cost
+
+router = APIRouter(prefix="/llm", tags=["llm"])
+
+
+def _ts(value: float) -> str:
+    return datetime.fromtimestamp(value).isoformat()
+
+
+# ===== Cache de respostas (FAQ) =====
+@router.get("/cache")
+def list_cache(user: User = Depends(get_current_user)):
+    """Lista as respostas em cache (mais usadas primeiro)."""
+    entries = sorted(response_cache.list_entries(), key=lambda e: e["hits"], reverse=True)
+    return {
+        "enabled": response_cache.enabled,
+        "ttl_seconds": response_cache.ttl,
+        "count": len(entries),
+        "entries": [
+            {
+                "key": e["key"],
+                "question": e["question"],
+                "rag_docs": e["rag_docs"],
+                "reply": e["reply"],
+                "hits": e["hits"],
+                "created_at": _ts(e["created_at"]),
+                "expires_at": _ts(e["expires_at"]),
+            }
+            for e in entries
+        ],
+    }
+
+
+@router.delete("/cache")
+def purge_cache(user: User = Depends(get_current_user)):
+    """Remove todas as respostas em cache."""
+    return {"ok": True, "removed": response_cache.purge(reason=f"purge por {user.email}")}
+
+
+@router.delete("/cache/{key}")
+def purge_cache_entry(key: str, user: User = Depends(get_current_user)):
+    """Remove uma resposta específica do cache."""
+    removed = response_cache.purge(key, reason=f"purge por {user.email}")
+    if not removed:
+        raise HTTPException(404, "Cache entry not found")
+    return {"ok": True, "removed": removed}
+
+
+# ===== Telemetria =====
+def _day_str(day) -> str:
+    return day.date().isoformat() if hasattr(day, "date") else str(day)[:10]
+
+
+@router.get("/stats/daily")
+def llm_stats_daily(
+    days: int = Query(30, ge=1, le=365),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Por dia: chamadas, latência p50/p95, tokens e custo estimado (USD)."""
+    since = datetime.now() - timedelta(days=days)
+    day = func.date_trunc("day", LLMCall.created_at)
+
+    # Percentis por dia (não dá para combinar percentis entre modelos depois)
+    latency_rows = (
+        db.query(
+            day.label("day"),
+            func.count(LLMCall.id),
+            func.percentile_cont(0.5).within_group(LLMCall.latency_ms.asc()),
+            func.percentile_cont(0.95).within_group(LLMCall.latency_ms.asc()),
+            func.avg(LLMCall.tool_rounds),
+        )
+        .filter(LLMCall.created_at >= since)
+        .group_by(day)
+        .order_by(day.asc())
+        .all()
+    )
+    result: Dict[str, dict] = {}
+    for d, calls, p50, p95, avg_tool_rounds in latency_rows:
+        result[_day_str(d)] = {
+            "date": _day_str(d),
+            "calls": int(calls or 0),
+            "latency_p50_ms": round(float(p50), 1) if p50 is not None else None,
+            "latency_p95_ms": round(float(p95), 1) if p95 is not None else None,
+            "avg_tool_rounds": round(float(avg_tool_rounds or 0), 2),
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "cost_usd": 0.0,
+        }
+
+    # Tokens e custo por dia/modelo (o preço depende do modelo)
+    token_rows = (
+        db.query(
+            day.label("day"),
+            LLMCall.model,
+            func.sum(LLMCall.prompt_tokens),
+            func.sum(LLMCall.completion_tokens),
+            func.sum(LLMCall.cached_tokens),
+        )
+        .filter(LLMCall.created_at >= since)
+        .group_by(day, LLMCall.model)
+        .all()
+    )
+    for d, model, prompt, completion, cached in token_rows:
+        item = result.get(_day_str(d))
+        if item is None:
+            continue
+        prompt, completion, cached = int(prompt or 0), int(completion or 0), int(cached or 0)
+        item["prompt_tokens"] += prompt
+        item["completion_tokens"] += completion
+        item["cached_tokens"] += cached
+        item["cost_usd"] += estimate_cost(model, prompt, completion, cached)
+
+    for item in result.values():
+        item["cost_usd"] = round(item["cost_usd"], 4)
+    return list(result.values())
+
+
+@router.get("/stats/threads")
+def llm_stats_threads(
+    days: int = Query(7, ge=1, le=365),
+    order_by: Literal["cost", "latency", "tokens"] = "cost",
+    limit: int = Query(20, ge=1, le=200),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Conversas mais caras/lentas no período."""
+    since = datetime.now() - timedelta(days=days)
+    rows = (
+        db.query(
+            LLMCall.thread_id,
+            LLMCall.model,
+            func.count(LLMCall.id),
+            func.sum(LLMCall.prompt_tokens),
+            func.sum(LLMCall.completion_tokens),
+            func.sum(LLMCall.cached_tokens),
+            func.sum(LLMCall.latency_ms),
+            func.max(LLMCall.latency_ms),
+            func.sum(LLMCall.tool_rounds),
+        )
+        .filter(LLMCall.created_at >= since, LLMCall.thread_id.isnot(None))
+        .group_by(LLMCall.thread_id, LLMCall.model)
+        .all()
+    )
+    threads: Dict[int, dict] = {}
+    for thread_id, model, calls, prompt, completion, cached, total_ms, max_ms, tool_rounds in rows:
+        item = threads.setdefault(thread_id, {
+            "thread_id": thread_id,
+            "calls": 0,
+            "tokens": 0,
+            "cost_usd": 0.0,
+            "total_latency_ms": 0,
+            "max_latency_ms": 0,
+            "tool_rounds": 0,
+        })
+        prompt, completion, cached = int(prompt or 0), int(completion or 0), int(cached or 0)
+        item["calls"] += int(calls or 0)
+        item["tokens"] += prompt + completion
+        item["cost_usd"] += estimate_cost(model, prompt, completion, cached)
+        item["total_latency_ms"] += int(total_ms or 0)
+        item["max_latency_ms"] = max(item["max_latency_ms"], int(max_ms or 0))
+        item["tool_rounds"] += int(tool_rounds or 0)
+
+    for item in threads.values():
+        item["avg_latency_ms"] = round(item["total_latency_ms"] / item["calls"], 1) if item["calls"] else None
+        item["cost_usd"] = round(item["cost_usd"], 4)
+
+    sort_key = {
+        "cost": lambda i: i["cost_usd"],
+        "latency": lambda i: i["avg_latency_ms"] or 0,
+        "tokens": lambda i: i["tokens"],
+    }[order_by]
+    return sorted(threads.values(), key=sort_key, reverse=True)[:limit]
+
+
+@router.get("/calls")
+def list_llm_calls(
+    thread_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Chamadas mais recentes (opcionalmente de uma thread)."""
+    q = db.query(LLMCall)
+    if thread_id is not None:
+        q = q.filter(LLMCall.thread_id == thread_id)
+    rows = q.order_by(LLMCall.id.desc()).limit(limit).all()
+    return [
+        {
+            "id": r.id,
+            "thread_id": r.thread_id,
+            "model": r.model,
+            "route": r.route,
+            "outcome": r.outcome,
+            "prompt_tokens": r.prompt_tokens,
+            "completion_tokens": r.completion_tokens,
+            "cached_tokens": r.cached_tokens,
+            "tool_rounds": r.tool_rounds,
+            "tool_calls": r.tool_calls,
+            "retries": r.retries,
+            "latency_ms": r.latency_ms,
+            "cost_usd": round(estimate_cost(r.model, r.prompt_tokens, r.completion_tokens, r.cached_tokens), 6),
+            "created_at": r.created_at.isoformat() if r.created_at else None,
+        }
+        for r in rows
+    ]
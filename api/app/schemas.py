@@ -26,6 +26,7 @@ class MessageRead(BaseModel):
     role: str
     content: str
     created_at: datetime
+    meta: Optional[Dict[str, Any]] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -0,0 +1,188 @@
+# api/app/services/audio_split.py
+"""
+Divisão de áudios longos em segmentos para transcrição em paralelo.
+
+Notas de voz de 5–10 minutos iam ao Whisper num upload só, e o cliente
+esperava a transcrição inteira. Com `ffmpeg` instalado, áudios acima de
+`MEDIA_AUDIO_SPLIT_SECONDS` são cortados em trechos de ~`MEDIA_AUDIO_SEGMENT_SECONDS`,
+preferindo os silêncios (`silencedetect`) e com `MEDIA_AUDIO_SEGMENT_OVERLAP`
+segundos de sobreposição para não perder palavras no corte. Cada trecho sai
+em Ogg/Opus mono 16 kHz (upload pequeno); até `MEDIA_AUDIO_SEGMENT_CONCURRENCY`
+trechos são extraídos/transcritos ao mesmo tempo.
+
+Sem ffmpeg/ffprobe, ou se algo falhar, quem chama segue com uma chamada só.
+`stitch` junta os textos removendo as palavras repetidas pela sobreposição.
+"""
+import os
+import re
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import BinaryIO, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = os.getenv("MEDIA_FFMPEG_PATH") or shutil.which("ffmpeg")
+FFPROBE = os.getenv("MEDIA_FFPROBE_PATH") or shutil.which("ffprobe")
+FFMPEG_AVAILABLE = bool(FFMPEG and FFPROBE)
+
+SPLIT_SECONDS = float(os.getenv("MEDIA_AUDIO_SPLIT_SECONDS", "120"))  # abaixo disso: chamada única
+SEGMENT_SECONDS = float(os.getenv("MEDIA_AUDIO_SEGMENT_SECONDS", "60"))
+SEGMENT_OVERLAP = float(os.getenv("MEDIA_AUDIO_SEGMENT_OVERLAP", "1.0"))
+SEGMENT_CONCURRENCY = int(os.getenv("MEDIA_AUDIO_SEGMENT_CONCURRENCY", "4"))  # ffmpeg e Whisper simultâneos
+SILENCE_NOISE_DB = float(os.getenv("MEDIA_AUDIO_SILENCE_DB", "-35"))
+SILENCE_MIN_SECONDS = float(os.getenv("MEDIA_AUDIO_SILENCE_MIN", "0.4"))
+FFMPEG_TIMEOUT = float(os.getenv("MEDIA_FFMPEG_TIMEOUT", "60"))  # segundos por comando
+
+# Áudios pequenos nem passam pelo ffprobe (~30 s de Opus de nota de voz)
+_PROBE_MIN_BYTES = 64 * 1024
+# Sobreposição máxima, em palavras, procurada ao juntar dois trechos
+_STITCH_MAX_WORDS = 12
+
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+
+class AudioSplitError(Exception):
+    pass
+
+
+async def _run(*args: str) -> Tuple[bytes, bytes]:
+    """Roda ffmpeg/ffprobe sem bloquear o event loop; devolve (stdout, stderr)."""
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), FFMPEG_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise AudioSplitError(f"{os.path.basename(args[0])} excedeu {FFMPEG_TIMEOUT:.0f}s")
+    if proc.returncode != 0:
+        raise AudioSplitError(err.decode("utf-8", "ignore")[-300:])
+    return out, err
+
+
+async def probe_duration(path: str) -> float:
+    out, _ = await _run(
+        FFPROBE, "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", path,
+    )
+    try:
+        return float(out.decode().strip())
+    except ValueError:
+        raise AudioSplitError("duração desconhecida")
+
+
+def parse_silences(stderr: str) -> List[float]:
+    """Pontos de corte (meio de cada silêncio) a partir da saída do silencedetect."""
+    points = []
+    start = None
+    for kind, value in _SILENCE_RE.findall(stderr):
+        if kind == "start":
+            start = max(0.0, float(value))
+        elif start is not None:
+            points.append((start + float(value)) / 2.0)
+            start = None
+    return points
+
+
+async def detect_silences(path: str) -> List[float]:
+    _, err = await _run(
+        FFMPEG, "-hide_banner", "-nostats", "-i", path,
+        "-af", f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_SECONDS}",
+        "-f", "null", "-",
+    )
+    return parse_silences(err.decode("utf-8", "ignore"))
+
+
+def plan_segments(duration: float, silences: List[float]) -> List[Tuple[float, float]]:
+    """
+    Limites (início, fim) de cada trecho, já com a sobreposição. Cada corte cai
+    no silêncio mais próximo de SEGMENT_SECONDS após o corte anterior (entre
+    metade e 1,5× o alvo); sem silêncio nessa janela, corta no alvo.
+    """
+    cuts = []
+    position = 0.0
+    while duration - position > SEGMENT_SECONDS * 1.5:
+        target = position + SEGMENT_SECONDS
+        window = [s for s in silences if position + SEGMENT_SECONDS * 0.5 <= s <= position + SEGMENT_SECONDS * 1.5]
+        cut = min(window, key=lambda s: abs(s - target)) if window else target
+        cuts.append(cut)
+        position = cut
+    bounds = [0.0] + cuts + [duration]
+    return [
+        (max(0.0, start - SEGMENT_OVERLAP), min(duration, end + SEGMENT_OVERLAP))
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+async def extract_segment(path: str, start: float, end: float) -> bytes:
+    out, _ = await _run(
+        FFMPEG, "-hide_banner", "-nostats", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+        "-i", path, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k",
+        "-f", "ogg", "pipe:1",
+    )
+    return out
+
+
+def _spool_to_path(f: BinaryIO, suffix: str) -> str:
+    f.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(f, tmp, 1024 * 1024)
+        return tmp.name
+
+
+async def split_audio(f: BinaryIO, size: int, suffix: str) -> Optional[List[bytes]]:
+    """
+    Trechos (Ogg/Opus) do áudio se ele for longo o bastante para dividir;
+    None para chamada única (curto, sem ffmpeg ou falha ao dividir).
+    """
+    if not FFMPEG_AVAILABLE or size < _PROBE_MIN_BYTES:
+        return None
+    path = await asyncio.to_thread(_spool_to_path, f, suffix)
+    try:
+        duration = await probe_duration(path)
+        if duration < SPLIT_SECONDS:
+            return None
+        silences = await detect_silences(path)
+        segments = plan_segments(duration, silences)
+        if len(segments) < 2:
+            return None
+        sem = asyncio.Semaphore(max(1, SEGMENT_CONCURRENCY))
+
+        async def _extract(start: float, end: float) -> bytes:
+            async with sem:
+                return await extract_segment(path, start, end)
+
+        chunks = await asyncio.gather(*(_extract(start, end) for start, end in segments))
+        print(f"[AUDIO] {duration:.0f}s divididos em {len(chunks)} trechos ({len(silences)} silêncios)")
+        return list(chunks)
+    except (AudioSplitError, OSError) as e:
+        logger.warning(f"[AUDIO] Não foi possível dividir o áudio, usando chamada única: {e}")
+        return None
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _norm_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def stitch(texts: List[str]) -> str:
+    """Junta as transcrições removendo as palavras repetidas pela sobreposição."""
+    words: List[str] = []
+    for text in texts:
+        incoming = text.split()
+        if words and incoming:
+            tail = [_norm_word(w) for w in words[-_STITCH_MAX_WORDS:]]
+            head = [_norm_word(w) for w in incoming[:_STITCH_MAX_WORDS]]
+            for k in range(min(len(tail), len(head)), 0, -1):
+                if tail[-k:] == head[:k]:
+                    incoming = incoming[k:]
+                    break
+        words.extend(incoming)
+    return " ".join(words)
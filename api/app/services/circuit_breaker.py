@@ -0,0 +1,140 @@
+# api/app/services/circuit_breaker.py
+"""
+Circuit breaker simples para provedores externos (ex: OpenAI).
+
+Estados:
+- closed: chamadas passam; erros e chamadas lentas entram numa janela deslizante.
+  Se a taxa de falhas passar do limite (com um mínimo de chamadas), abre.
+- open: chamadas são recusadas na hora (quem chama devolve o fallback) até
+  `open_seconds` passarem.
+- half_open: deixa passar até `half_open_probes` chamadas de teste. Se todas
+  derem certo, fecha; qualquer falha reabre.
+"""
+import time
+import threading
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from . import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60.0,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        slow_call_ms: float = 20000.0,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 3,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_ms = slow_call_ms
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self._events: Deque[Tuple[float, bool, float]] = deque()  # (ts, falhou, latência ms)
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    # ---------- API ----------
+    def allow(self) -> bool:
+        """True se a chamada pode seguir; False se o circuito está aberto."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - (self.opened_at or now) < self.open_seconds:
+                    metrics.incr(f"circuit.{self.name}.rejected")
+                    return False
+                self._transition(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    metrics.incr(f"circuit.{self.name}.rejected")
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record(self, ok: bool, latency_ms: float) -> None:
+        """Registra o resultado de uma chamada autorizada por `allow()`."""
+        failed = (not ok) or latency_ms > self.slow_call_ms
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed:
+                    self._transition(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._transition(CLOSED)
+                return
+
+            if self.state == OPEN:
+                # Chamada iniciada antes de abrir; não altera o estado
+                return
+
+            self._events.append((now, failed, latency_ms))
+            self._prune(now)
+            calls = len(self._events)
+            failures = sum(1 for _, f, _ in self._events if f)
+            if calls >= self.min_calls and failures / calls >= self.error_rate:
+                self._transition(OPEN)
+
+    def release(self) -> None:
+        """
+        Devolve a vaga de uma chamada autorizada que não terminou (cancelada por
+        hedge, deadline ou shutdown) sem contar sucesso nem falha. Sem isso um
+        probe cancelado prenderia o circuito em half_open.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = len(self._events)
+            failures = sum(1 for _, f, _ in self._events if f)
+            latencies = [lat for _, _, lat in self._events]
+            open_for = None
+            if self.state == OPEN and self.opened_at is not None:
+                open_for = round(time.monotonic() - self.opened_at, 1)
+        p95 = metrics.percentile(latencies, 95)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "window_error_rate": round(failures / calls, 3) if calls else 0.0,
+            "window_p95_ms": round(p95, 1) if p95 is not None else None,
+            "open_for_seconds": open_for,
+        }
+
+    # ---------- internos (chamar com o lock) ----------
+    def _prune(self, now: float) -> None:
+        while self._events and now - self._events[0][0] > self.window_seconds:
+            self._events.popleft()
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        print(f"[CIRCUIT:{self.name}] {self.state} -> {state}")
+        metrics.incr(f"circuit.{self.name}.to_{state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self.opened_at = None
+            self._events.clear()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
@@ -0,0 +1,283 @@
+# api/app/services/doc_extract.py
+"""
+Extração local de texto de documentos (PDF, DOCX, texto puro).
+
+Antes, PDF ia inteiro para o Vision como data URI (lento, caro e muitas vezes
+recusado) e DOCX recebia uma resposta pronta. Aqui:
+
+- PDF: texto de cada página com PyPDF2. Páginas extraídas em paralelo num pool
+  de processos (`MEDIA_PDF_WORKERS`; PyPDF2 é Python puro, threads não
+  paralelizam), em blocos de `MEDIA_PDF_PAGES_PER_TASK` páginas consumidos em
+  ordem. Páginas sem texto (escaneadas) são devolvidas à parte, com a maior
+  imagem embutida das primeiras `image_pages` (lida no mesmo worker, sem
+  reabrir o PDF no processo da API), para o Vision.
+- DOCX: `word/document.xml` lido em streaming (zipfile + iterparse), sem
+  dependência extra.
+- Texto: decodificado como UTF-8.
+
+Tudo respeita o orçamento de `MEDIA_DOC_MAX_CHARS` caracteres: ao atingir o
+limite, a leitura para (as páginas seguintes nem são extraídas) e o resultado
+vem marcado como truncado.
+"""
+import os
+import asyncio
+import logging
+import tempfile
+import threading
+import zipfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from . import metrics
+
+try:
+    import PyPDF2
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DOC_MAX_CHARS = int(os.getenv("MEDIA_DOC_MAX_CHARS", "20000"))
+PDF_WORKERS = int(os.getenv("MEDIA_PDF_WORKERS", "2"))  # 0 = sem pool de processos
+PDF_PAGES_PER_TASK = int(os.getenv("MEDIA_PDF_PAGES_PER_TASK", "8"))
+PDF_MIN_PAGE_CHARS = int(os.getenv("MEDIA_PDF_MIN_PAGE_CHARS", "20"))  # abaixo disso a página é "sem texto"
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+TEXT_MIMES = ("application/json", "application/xml")
+_DOCX_MAX_XML_BYTES = 50 * 1024 * 1024  # document.xml descompactado (proteção contra zip bomb)
+_PDF_IMAGE_MAX_BYTES = 10 * 1024 * 1024  # imagem embutida maior que isso não vai ao Vision
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def is_docx(mime_type: str, filename: Optional[str]) -> bool:
+    return mime_type == DOCX_MIME or (
+        mime_type in ("application/zip", "application/octet-stream")
+        and (filename or "").lower().endswith(".docx")
+    )
+
+
+def is_text(mime_type: str) -> bool:
+    return mime_type.startswith("text/") or mime_type in TEXT_MIMES
+
+
+# ---------------------------------------------------------------------------
+# PDF
+# ---------------------------------------------------------------------------
+
+def _open_pdf(path: str) -> "PyPDF2.PdfReader":
+    reader = PyPDF2.PdfReader(path)
+    if reader.is_encrypted and not reader.decrypt(""):
+        raise ValueError("PDF protegido por senha")
+    return reader
+
+
+def _pdf_page_count(path: str) -> int:
+    return len(_open_pdf(path).pages)
+
+
+def _page_image(page: "PyPDF2.PageObject") -> Optional[Tuple[str, bytes]]:
+    """Maior imagem embutida da página (escaneadas costumam ser uma imagem só)."""
+    try:
+        images = [img for img in page.images if len(img.data) <= _PDF_IMAGE_MAX_BYTES]
+    except Exception as e:
+        logger.warning(f"[DOC] Falha ao ler imagens da página: {e}")
+        return None
+    if not images:
+        return None
+    best = max(images, key=lambda img: len(img.data))
+    return best.name, best.data
+
+
+def _extract_page_range(
+    path: str, start: int, end: int, max_images: int = 0
+) -> List[Tuple[str, Optional[Tuple[str, bytes]]]]:
+    """
+    (texto, imagem) das páginas [start, end); imagem só para páginas sem texto,
+    no máximo `max_images`. Roda nos processos do pool (ou em thread).
+    """
+    reader = _open_pdf(path)
+    pages = []
+    for i in range(start, end):
+        try:
+            text = (reader.pages[i].extract_text() or "").strip()
+        except Exception:
+            text = ""
+        image = None
+        if len(text) < PDF_MIN_PAGE_CHARS and max_images > 0:
+            image = _page_image(reader.pages[i])
+            if image:
+                max_images -= 1
+        pages.append((text, image))
+    return pages
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if PDF_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o processo da API tem threads, fork não é seguro
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def shutdown() -> None:
+    """Encerra o pool de processos (shutdown da API)."""
+    _reset_pool()
+
+
+def _spool_to_path(f: BinaryIO) -> str:
+    """PyPDF2 nos workers precisa de um caminho; copia o arquivo para um temporário nomeado."""
+    f.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            tmp.write(chunk)
+        return tmp.name
+
+
+async def extract_pdf(f: BinaryIO, max_chars: int = DOC_MAX_CHARS, image_pages: int = 0) -> Dict[str, Any]:
+    """
+    Extrai o texto do PDF página a página até `max_chars`.
+    Devolve {"pages": total, "texts": [(página, texto)], "empty_pages": [páginas
+    sem texto], "images": [(página, nome, bytes)] das primeiras `image_pages`
+    páginas sem texto, "read_pages": páginas lidas, "truncated": bool}.
+    """
+    path = await asyncio.to_thread(_spool_to_path, f)
+    try:
+        total = await asyncio.to_thread(_pdf_page_count, path)
+        ranges = [(s, min(s + PDF_PAGES_PER_TASK, total)) for s in range(0, total, PDF_PAGES_PER_TASK)]
+        pool = _get_pool() if len(ranges) > 1 else None
+        in_flight = PDF_WORKERS if pool else 1
+        loop = asyncio.get_running_loop()
+
+        def submit(start: int, end: int):
+            if pool is not None:
+                return loop.run_in_executor(pool, _extract_page_range, path, start, end, image_pages)
+            return asyncio.ensure_future(asyncio.to_thread(_extract_page_range, path, start, end, image_pages))
+
+        texts: List[Tuple[int, str]] = []
+        empty_pages: List[int] = []
+        images: List[Tuple[int, str, bytes]] = []
+        chars = 0
+        read_pages = 0
+        truncated = False
+        pending: deque = deque()
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            # Mantém no máximo `in_flight` blocos em andamento, consumidos em ordem
+            while next_range < len(ranges) and len(pending) < in_flight:
+                start, end = ranges[next_range]
+                pending.append((start, end, submit(start, end)))
+                next_range += 1
+            start, end, fut = pending.popleft()
+            try:
+                page_texts = await fut
+            except BrokenProcessPool:
+                logger.warning("[DOC] Pool de processos quebrou; extraindo em thread")
+                _reset_pool()
+                pool = None
+                page_texts = await asyncio.to_thread(_extract_page_range, path, start, end, image_pages)
+
+            for offset, (text, image) in enumerate(page_texts):
+                page = start + offset + 1
+                read_pages += 1
+                if len(text) < PDF_MIN_PAGE_CHARS:
+                    empty_pages.append(page)
+                    if image and len(images) < image_pages:
+                        images.append((page, image[0], image[1]))
+                    continue
+                if chars + len(text) > max_chars:
+                    text = text[: max(0, max_chars - chars)]
+                    truncated = True
+                if text:
+                    texts.append((page, text))
+                    chars += len(text)
+                if truncated:
+                    break
+            if truncated:
+                for _, _, other in pending:
+                    other.cancel()
+                break
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    metrics.incr("media.doc.pdf_pages", read_pages)
+    metrics.incr("media.doc.pdf_empty_pages", len(empty_pages))
+    return {
+        "pages": total,
+        "texts": texts,
+        "empty_pages": empty_pages,
+        "images": images,
+        "read_pages": read_pages,
+        "truncated": truncated or read_pages < total,
+    }
+
+
+# ---------------------------------------------------------------------------
+# DOCX e texto
+# ---------------------------------------------------------------------------
+
+def extract_docx(f: BinaryIO, max_chars: int = DOC_MAX_CHARS) -> Tuple[str, bool]:
+    """Parágrafos do DOCX (inclusive de tabelas), até `max_chars`. Devolve (texto, truncado)."""
+    f.seek(0)
+    with zipfile.ZipFile(f) as z:
+        info = z.getinfo("word/document.xml")
+        if info.file_size > _DOCX_MAX_XML_BYTES:
+            raise ValueError("Documento Word grande demais")
+        lines: List[str] = []
+        chars = 0
+        with z.open(info) as xml:
+            for _, elem in ET.iterparse(xml, events=("end",)):
+                if elem.tag != _W + "p":
+                    continue
+                parts = []
+                for node in elem.iter():
+                    if node.tag == _W + "t" and node.text:
+                        parts.append(node.text)
+                    elif node.tag == _W + "tab":
+                        parts.append("\t")
+                    elif node.tag in (_W + "br", _W + "cr"):
+                        parts.append("\n")
+                elem.clear()
+                line = "".join(parts).strip()
+                if not line:
+                    continue
+                if chars + len(line) > max_chars:
+                    lines.append(line[: max(0, max_chars - chars)])
+                    return "\n".join(lines), True
+                lines.append(line)
+                chars += len(line) + 1
+    return "\n".join(lines), False
+
+
+def extract_text(f: BinaryIO, max_chars: int = DOC_MAX_CHARS) -> Tuple[str, bool]:
+    """Texto puro (UTF-8), lendo só o necessário para `max_chars`. Devolve (texto, truncado)."""
+    f.seek(0)
+    raw = f.read(max_chars * 4 + 4)  # UTF-8: até 4 bytes por caractere
+    more = bool(f.read(1))
+    text = raw.decode("utf-8-sig", errors="ignore")
+    truncated = more or len(text) > max_chars
+    return text[:max_chars], truncated
@@ -0,0 +1,98 @@
+# api/app/services/http_clients.py
+"""
+Clientes HTTP compartilhados durante toda a vida do processo.
+
+Um `httpx.AsyncClient` por destino, com pool de conexões e keep-alive: o
+download de mídia (Twilio/CDN) e o envio pela Graph API da Meta reaproveitam
+conexões TCP/TLS em vez de abrir uma nova a cada chamada.
+
+- Criados no startup (`start`) e fechados no shutdown (`close`); se usados
+  antes disso (scripts), são criados sob demanda.
+- HTTP/2 opcional: `HTTP2_ENABLED=true` e o pacote `h2` instalado.
+"""
+import os
+import logging
+from typing import Dict
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))  # segundos
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+MEDIA = "media"
+META = "meta"
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _http2() -> bool:
+    if HTTP2_ENABLED and not H2_AVAILABLE:
+        logger.warning("[HTTP] HTTP2_ENABLED=true mas o pacote h2 não está instalado; usando HTTP/1.1")
+    return HTTP2_ENABLED and H2_AVAILABLE
+
+
+def _build(name: str) -> httpx.AsyncClient:
+    if name == MEDIA:
+        # Twilio responde com redirect para uma URL assinada do CDN
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            follow_redirects=True,
+            max_redirects=10,
+            limits=_limits(),
+            http2=_http2(),
+        )
+    if name == META:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=_limits(),
+            http2=_http2(),
+        )
+    raise ValueError(f"Cliente HTTP desconhecido: {name}")
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _build(name)
+    return client
+
+
+def media_client() -> httpx.AsyncClient:
+    return get_client(MEDIA)
+
+
+def meta_client() -> httpx.AsyncClient:
+    return get_client(META)
+
+
+def start() -> None:
+    for name in (MEDIA, META):
+        get_client(name)
+    print(f"[HTTP] Clientes compartilhados prontos (http2={_http2()}, max_connections={MAX_CONNECTIONS})")
+
+
+async def close() -> None:
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"[HTTP] Erro ao fechar cliente {name}: {e}")
+    _clients.clear()
@@ -0,0 +1,110 @@
+# api/app/services/inbound_buffer.py
+"""
+Debounce/coalescência de mensagens recebidas por thread.
+
+No WhatsApp é comum o cliente quebrar uma pergunta em várias mensagens
+seguidas ("oi" / "tudo bem?" / "quanto custa o cartão?"). Em vez de disparar
+uma chamada à LLM por mensagem, o webhook entrega cada mensagem (já com o
+contexto de mídia processado) para este buffer, que espera a janela fechar
+e chama o callback UMA vez com o turno completo.
+
+- Uma mensagem nova dentro da janela cancela a chamada agendada (que ainda
+  não começou) e reinicia a contagem.
+- `INBOUND_DEBOUNCE_MAX_WAIT` limita o atraso total desde a primeira
+  mensagem, para o cliente que não para de digitar não ficar sem resposta.
+- Depois que o callback começou, mensagens novas abrem um lote novo, que só
+  é processado quando o anterior terminar (ordem por thread preservada).
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .keyed_lock import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# Janela de debounce em segundos (0 = desligado, cada mensagem gera uma resposta)
+DEBOUNCE_SECONDS = float(os.getenv("INBOUND_DEBOUNCE_SECONDS", "0"))
+# Atraso máximo desde a primeira mensagem do lote
+DEBOUNCE_MAX_WAIT = float(os.getenv("INBOUND_DEBOUNCE_MAX_WAIT", "8"))
+
+FlushCallback = Callable[[int, List[Dict[str, Any]]], Awaitable[None]]
+
+
+class _PendingTurn:
+    def __init__(self):
+        self.items: List[Dict[str, Any]] = []
+        self.first_at = time.monotonic()
+        self.timer: Optional[asyncio.Task] = None
+
+
+class InboundBuffer:
+    def __init__(self, window: float, max_wait: float):
+        self.window = window
+        self.max_wait = max_wait
+        # thread_id -> lote aguardando a janela fechar
+        self.pending: Dict[int, _PendingTurn] = {}
+        # thread_id -> lote cujo callback está rodando
+        self.flushing: Dict[int, _PendingTurn] = {}
+        # thread_id -> lock que serializa os flushes da mesma thread
+        self.locks = KeyedLocks()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def contains(self, thread_id: int, message_id: int) -> bool:
+        """A mensagem já está num lote desta thread (aguardando ou em processamento)?"""
+        turns = (self.pending.get(thread_id), self.flushing.get(thread_id))
+        return any(turn and any(i.get("message_id") == message_id for i in turn.items) for turn in turns)
+
+    def submit(self, thread_id: int, item: Dict[str, Any], on_flush: FlushCallback) -> int:
+        """
+        Adiciona uma mensagem ao lote da thread e (re)agenda o flush.
+        Retorna quantas mensagens o lote pendente tem agora.
+        """
+        turn = self.pending.get(thread_id)
+        if turn is None:
+            turn = _PendingTurn()
+            self.pending[thread_id] = turn
+        turn.items.append(item)
+
+        # Chegou mensagem antes da chamada começar: cancela e reagenda
+        if turn.timer and not turn.timer.done():
+            turn.timer.cancel()
+
+        elapsed = time.monotonic() - turn.first_at
+        delay = max(0.0, min(self.window, self.max_wait - elapsed))
+        turn.timer = asyncio.create_task(self._fire(thread_id, turn, delay, on_flush))
+        return len(turn.items)
+
+    async def _fire(self, thread_id: int, turn: _PendingTurn, delay: float, on_flush: FlushCallback) -> None:
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+
+        # Janela fechou: desanexa o lote; o que chegar agora abre um lote novo
+        if self.pending.get(thread_id) is turn:
+            self.pending.pop(thread_id, None)
+
+        async with self.locks.hold(thread_id):
+            self.flushing[thread_id] = turn
+            try:
+                logger.info(f"[INBOUND-BUFFER] thread={thread_id} flush de {len(turn.items)} mensagem(ns)")
+                await on_flush(thread_id, turn.items)
+            except Exception:
+                logger.exception(f"[INBOUND-BUFFER] Erro ao processar lote da thread {thread_id}")
+            finally:
+                self.flushing.pop(thread_id, None)
+
+
+def merge_turn_text(items: List[Dict[str, Any]]) -> str:
+    """Junta o conteúdo das mensagens do lote num único turno do usuário."""
+    parts = [(i.get("content") or "").strip() for i in items]
+    return "\n".join(p for p in parts if p)
+
+
+inbound_buffer = InboundBuffer(DEBOUNCE_SECONDS, DEBOUNCE_MAX_WAIT)
@@ -0,0 +1,344 @@
+# api/app/services/inbound_queue.py
+"""
+Fila durável de mensagens recebidas (tabela `inbound_jobs`, Postgres).
+
+O webhook só valida o payload, grava um job e responde; um pool de
+`INBOUND_WORKERS` workers processa a fila (thread, contato, mídia, LLM e
+envio). Um pico de mensagens vira fila, não um pico de chamadas à OpenAI e
+de conexões no banco.
+
+- Claim com `FOR UPDATE SKIP LOCKED`: vários workers (e vários processos)
+  sem pegar o mesmo job.
+- Ordem por conversa (`thread_key` = telefone normalizado): um job só é
+  pego se não houver outro da mesma conversa rodando ou mais antigo na fila.
+- Falha: nova tentativa com backoff exponencial (`INBOUND_RETRY_BASE`);
+  depois de `INBOUND_MAX_ATTEMPTS` o job vai para `dead` (fica na tabela com
+  o último erro).
+- Enquanto o job roda, o worker renova `locked_at` (heartbeat a cada
+  `INBOUND_JOB_TIMEOUT / 3` s): um handler lento mas vivo nunca é pego de novo.
+- Job "running" sem heartbeat há mais de `INBOUND_JOB_TIMEOUT` s (processo
+  morreu) volta para a fila; se já usou as `INBOUND_MAX_ATTEMPTS` tentativas
+  (um job que derruba o worker), vai para `dead`. Jobs concluídos são
+  apagados após `INBOUND_RETENTION_HOURS`.
+
+Ligado por padrão só com Postgres (`INBOUND_QUEUE_ENABLED`); no SQLite de
+desenvolvimento o webhook processa no próprio request, como antes.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import metrics
+from ..db import DB_URL, SessionLocal
+from ..models import InboundJob, InboundJobMessage
+
+logger = logging.getLogger(__name__)
+
+_IS_POSTGRES = DB_URL.startswith("postgresql")
+INBOUND_QUEUE_ENABLED = os.getenv(
+    "INBOUND_QUEUE_ENABLED", "true" if _IS_POSTGRES else "false"
+).lower() in ("1", "true", "yes")
+INBOUND_WORKERS = int(os.getenv("INBOUND_WORKERS", "4"))
+INBOUND_MAX_ATTEMPTS = int(os.getenv("INBOUND_MAX_ATTEMPTS", "5"))
+INBOUND_RETRY_BASE = float(os.getenv("INBOUND_RETRY_BASE", "2"))  # segundos, dobra a cada tentativa
+INBOUND_RETRY_MAX = 300.0
+INBOUND_POLL_INTERVAL = float(os.getenv("INBOUND_POLL_INTERVAL", "1.0"))
+INBOUND_JOB_TIMEOUT = float(os.getenv("INBOUND_JOB_TIMEOUT", "600"))
+INBOUND_RETENTION_HOURS = float(os.getenv("INBOUND_RETENTION_HOURS", "24"))
+_MAINTENANCE_INTERVAL = 60.0
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_CLAIM_SQL = text("""
+    UPDATE inbound_jobs
+    SET status = 'running', locked_at = now(), attempts = attempts + 1
+    WHERE id = (
+        SELECT j.id FROM inbound_jobs j
+        WHERE j.status = 'queued' AND j.available_at <= now()
+          AND NOT EXISTS (
+              SELECT 1 FROM inbound_jobs r
+              WHERE r.thread_key = j.thread_key AND r.status = 'running'
+          )
+          AND NOT EXISTS (
+              SELECT 1 FROM inbound_jobs e
+              WHERE e.thread_key = j.thread_key AND e.status = 'queued' AND e.id < j.id
+          )
+        ORDER BY j.id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, channel, thread_key, payload, attempts,
+              EXTRACT(EPOCH FROM (now() - created_at)) AS waited_s
+""")
+
+
+def _claim() -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        row = db.execute(_CLAIM_SQL).mappings().first()
+        db.commit()
+        return dict(row) if row else None
+    finally:
+        db.close()
+
+
+def _finish(job_id: int) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(
+            text("UPDATE inbound_jobs SET status = 'done', finished_at = now(), last_error = NULL WHERE id = :id"),
+            {"id": job_id},
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _fail(job_id: int, attempts: int, error: str) -> str:
+    """Reagenda com backoff ou manda para `dead`. Devolve o novo status."""
+    db = SessionLocal()
+    try:
+        if attempts >= INBOUND_MAX_ATTEMPTS:
+            db.execute(
+                text("UPDATE inbound_jobs SET status = 'dead', finished_at = now(), last_error = :err WHERE id = :id"),
+                {"id": job_id, "err": error},
+            )
+            status = "dead"
+        else:
+            delay = min(INBOUND_RETRY_MAX, INBOUND_RETRY_BASE * (2 ** (attempts - 1)))
+            db.execute(
+                text(
+                    "UPDATE inbound_jobs SET status = 'queued', locked_at = NULL, last_error = :err, "
+                    "available_at = now() + make_interval(secs => :delay) WHERE id = :id"
+                ),
+                {"id": job_id, "err": error, "delay": delay},
+            )
+            status = "queued"
+        db.commit()
+        return status
+    finally:
+        db.close()
+
+
+def _requeue(job_ids: List[int]) -> None:
+    """Devolve à fila jobs interrompidos no shutdown (a tentativa não conta)."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            text(
+                "UPDATE inbound_jobs SET status = 'queued', locked_at = NULL, attempts = GREATEST(attempts - 1, 0) "
+                "WHERE id = ANY(:ids) AND status = 'running'"
+            ),
+            {"ids": job_ids},
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _heartbeat(job_ids: List[int]) -> None:
+    """Renova `locked_at` dos jobs que este processo está rodando."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            text("UPDATE inbound_jobs SET locked_at = now() WHERE id = ANY(:ids) AND status = 'running'"),
+            {"ids": job_ids},
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _maintenance() -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        # Sem heartbeat = o processo que rodava o job morreu. Tentativas esgotadas:
+        # provavelmente é o próprio job que derruba o worker, então não volta à fila
+        dead = db.execute(
+            text(
+                "UPDATE inbound_jobs SET status = 'dead', finished_at = now(), locked_at = NULL, "
+                "last_error = 'worker parou durante o job (sem heartbeat) em ' || attempts || ' tentativa(s)' "
+                "WHERE status = 'running' AND locked_at < now() - make_interval(secs => :timeout) "
+                "AND attempts >= :max_attempts"
+            ),
+            {"timeout": INBOUND_JOB_TIMEOUT, "max_attempts": INBOUND_MAX_ATTEMPTS},
+        ).rowcount
+        stale = db.execute(
+            text(
+                "UPDATE inbound_jobs SET status = 'queued', locked_at = NULL "
+                "WHERE status = 'running' AND locked_at < now() - make_interval(secs => :timeout)"
+            ),
+            {"timeout": INBOUND_JOB_TIMEOUT},
+        ).rowcount
+        purged = db.execute(
+            text(
+                "DELETE FROM inbound_jobs "
+                "WHERE status = 'done' AND finished_at < now() - make_interval(hours => :hours)"
+            ),
+            {"hours": int(INBOUND_RETENTION_HOURS)},
+        ).rowcount
+        db.commit()
+        return {"stale": stale or 0, "dead": dead or 0, "purged": purged or 0}
+    finally:
+        db.close()
+
+
+class InboundQueue:
+    def __init__(self, enabled: bool, workers: int):
+        self.enabled = enabled
+        self.workers = max(1, workers)
+        self.handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._running: Set[int] = set()
+
+    def enqueue(
+        self,
+        db: Session,
+        channel: str,
+        thread_key: str,
+        payload: Dict[str, Any],
+        provider_message_ids: Sequence[Optional[str]] = (),
+    ) -> Optional[int]:
+        """
+        Grava o job (no request do webhook) e acorda um worker.
+        Os ids do provedor de todas as mensagens do job vão para `inbound_job_messages`;
+        None se algum deles já está em outro job (retry do provedor).
+        """
+        ids = list(dict.fromkeys(pid for pid in provider_message_ids if pid))
+        job = InboundJob(
+            channel=channel,
+            thread_key=thread_key or "-",
+            payload=payload,
+            provider_message_id=ids[0] if ids else None,
+        )
+        db.add(job)
+        try:
+            db.flush()
+            db.add_all(InboundJobMessage(job_id=job.id, provider_message_id=pid) for pid in ids)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        metrics.incr("inbound.queue.enqueued")
+        if self._wake is not None:
+            self._wake.set()
+        return job.id
+
+    def start(self, handlers: Dict[str, JobHandler]) -> None:
+        if not self.enabled or self._tasks:
+            return
+        self.handlers = handlers
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance_loop()))
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+        logger.info(f"[INBOUND-QUEUE] {self.workers} worker(s) iniciados")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._running:
+            try:
+                await asyncio.to_thread(_requeue, list(self._running))
+            except Exception as e:
+                logger.error(f"[INBOUND-QUEUE] Falha ao devolver jobs à fila: {e}")
+            self._running.clear()
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(_claim)
+            except Exception as e:
+                logger.error(f"[INBOUND-QUEUE] Falha ao buscar job: {e}")
+                await asyncio.sleep(INBOUND_POLL_INTERVAL)
+                continue
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), INBOUND_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        metrics.observe("inbound.queue.wait_ms", float(job.get("waited_s") or 0) * 1000.0)
+        handler = self.handlers.get(job["channel"])
+        self._running.add(job_id)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise RuntimeError(f"canal sem handler: {job['channel']}")
+            await handler(job["payload"])
+        except asyncio.CancelledError:
+            raise  # shutdown: stop() devolve o job à fila
+        except Exception as e:
+            self._running.discard(job_id)
+            error = f"{type(e).__name__}: {e}"
+            try:
+                status = await asyncio.to_thread(_fail, job_id, job["attempts"], error[:2000])
+            except Exception as db_error:
+                logger.error(f"[INBOUND-QUEUE] Falha ao registrar erro do job {job_id}: {db_error}")
+                return
+            metrics.incr("inbound.queue.dead" if status == "dead" else "inbound.queue.retried")
+            logger.error(
+                f"[INBOUND-QUEUE] Job {job_id} ({job['channel']}) falhou na tentativa {job['attempts']}: {error}"
+                + (" -> dead letter" if status == "dead" else ""),
+                exc_info=True,
+            )
+            return
+        self._running.discard(job_id)
+        metrics.observe("inbound.queue.process_ms", (time.perf_counter() - started) * 1000.0)
+        try:
+            await asyncio.to_thread(_finish, job_id)
+            metrics.incr("inbound.queue.done")
+        except Exception as e:
+            logger.error(f"[INBOUND-QUEUE] Falha ao concluir job {job_id}: {e}")
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(INBOUND_JOB_TIMEOUT / 3)
+            if not self._running:
+                continue
+            try:
+                await asyncio.to_thread(_heartbeat, list(self._running))
+            except Exception as e:
+                logger.error(f"[INBOUND-QUEUE] Falha no heartbeat: {e}")
+
+    async def _maintenance_loop(self) -> None:
+        while True:
+            try:
+                result = await asyncio.to_thread(_maintenance)
+                if result["stale"]:
+                    metrics.incr("inbound.queue.stale_requeued", result["stale"])
+                    logger.warning(f"[INBOUND-QUEUE] {result['stale']} job(s) travados voltaram para a fila")
+                if result["dead"]:
+                    metrics.incr("inbound.queue.dead", result["dead"])
+                    logger.error(f"[INBOUND-QUEUE] {result['dead']} job(s) travados sem tentativas restantes -> dead letter")
+            except Exception as e:
+                logger.error(f"[INBOUND-QUEUE] Falha na manutenção: {e}")
+            await asyncio.sleep(_MAINTENANCE_INTERVAL)
+
+    def snapshot(self, db: Session) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"enabled": self.enabled, "workers": self.workers if self._tasks else 0, "in_progress": len(self._running)}
+        if not self.enabled:
+            return data
+        counts = dict(
+            db.query(InboundJob.status, func.count(InboundJob.id)).group_by(InboundJob.status).all()
+        )
+        data.update({status: int(counts.get(status, 0)) for status in ("queued", "running", "done", "dead")})
+        return data
+
+
+inbound_queue = InboundQueue(INBOUND_QUEUE_ENABLED, INBOUND_WORKERS)
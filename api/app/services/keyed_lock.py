@@ -0,0 +1,37 @@
+# api/app/services/keyed_lock.py
+"""
+Locks asyncio por chave (ex.: thread_id) que são descartados quando ninguém
+mais usa.
+
+Conta quem segura ou espera o lock de cada chave; o lock só sai do dicionário
+quando essa contagem zera. Olhar `lock.locked()` não basta: entre o release de
+um flush e o acquire do próximo que estava esperando, o lock aparece livre, e
+descartá-lo ali deixaria a próxima tarefa criar um lock novo e rodar em
+paralelo com a que ainda ia entrar.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, Tuple
+
+
+class KeyedLocks:
+    def __init__(self):
+        # chave -> (lock, quantas tarefas seguram ou esperam o lock)
+        self._locks: Dict[Hashable, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key) or (asyncio.Lock(), 0)
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users <= 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    def __len__(self) -> int:
+        return len(self._locks)
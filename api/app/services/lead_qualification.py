@@ -0,0 +1,126 @@
+# api/app/services/lead_qualification.py
+"""
+Qualificação de lead "de carona" na própria resposta do LLM (sem chamada extra).
+
+- Opt-in: `LLM_LEAD_QUALIFICATION=true`.
+- Na rota completa, o system prompt pede que a resposta termine com
+  `<lead>{"level": "...", "score": N, "interest": "...", "intent": "..."}</lead>`.
+- `extract_lead_tag` remove o bloco antes de a resposta ir para o cliente/banco
+  (inclusive um bloco cortado no fim) e valida os campos.
+- `save_lead` grava em `Thread.lead_level`/`lead_score` e em `meta["lead"]`.
+  Temperatura definida manualmente (PATCH /threads) não é sobrescrita.
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from . import metrics
+from ..db import SessionLocal
+from ..models import Thread
+
+logger = logging.getLogger(__name__)
+
+LEAD_QUALIFICATION_ENABLED = os.getenv("LLM_LEAD_QUALIFICATION", "false").lower() in ("1", "true", "yes")
+
+LEAD_LEVELS = ("frio", "morno", "quente")
+LEAD_INTENTS = ("comprar", "orcamento", "duvida", "suporte", "outro")
+
+LEAD_INSTRUCTION = (
+    "\n\n--- QUALIFICAÇÃO DO LEAD (INTERNO) ---\n"
+    "Ao final de TODA resposta, em uma linha separada, acrescente exatamente:\n"
+    '<lead>{"level": "frio|morno|quente", "score": 0-100, '
+    '"interest": "produto de interesse ou vazio", '
+    '"intent": "comprar|orcamento|duvida|suporte|outro"}</lead>\n'
+    "Esse bloco é removido antes do envio; nunca mencione isso ao cliente."
+)
+
+_TAG_RE = re.compile(r"<lead>(.*?)</lead>", re.DOTALL | re.IGNORECASE)
+# Bloco aberto e não fechado (resposta cortada por max_tokens)
+_OPEN_TAG_RE = re.compile(r"<lead>.*\Z", re.DOTALL | re.IGNORECASE)
+
+# Mantém referência às gravações em andamento (create_task sem referência pode ser coletado)
+_pending: Set[asyncio.Task] = set()
+
+
+def _validate(raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    level = str(raw.get("level") or "").strip().lower()
+    if level not in LEAD_LEVELS:
+        return None
+    try:
+        score = max(0, min(100, int(raw.get("score"))))
+    except (TypeError, ValueError):
+        score = None
+    intent = str(raw.get("intent") or "").strip().lower()
+    return {
+        "level": level,
+        "score": score,
+        "interest": str(raw.get("interest") or "").strip()[:120] or None,
+        "intent": intent if intent in LEAD_INTENTS else ("outro" if intent else None),
+    }
+
+
+def extract_lead_tag(reply: Optional[str]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Separa a resposta do bloco `<lead>`; devolve (resposta limpa, dados validados ou None)."""
+    if not reply:
+        return reply, None
+
+    lead = None
+    match = _TAG_RE.search(reply)
+    if match:
+        try:
+            raw = json.loads(match.group(1).strip())
+            lead = _validate(raw) if isinstance(raw, dict) else None
+        except ValueError:
+            lead = None
+        metrics.incr("llm.lead.extracted" if lead else "llm.lead.invalid")
+    else:
+        metrics.incr("llm.lead.missing")
+
+    clean = _OPEN_TAG_RE.sub("", _TAG_RE.sub("", reply)).strip()
+    return clean, lead
+
+
+def save_lead(thread_id: int, lead: Dict[str, Any]) -> None:
+    db = SessionLocal()
+    try:
+        t = db.get(Thread, thread_id)
+        if not t:
+            return
+        meta = dict(t.meta or {})
+        previous = meta.get("lead") or {}
+        manual = previous.get("source") == "manual"
+        if not manual:
+            t.lead_level = lead["level"]
+            if lead["score"] is not None:
+                t.lead_score = lead["score"]
+        meta["lead"] = {
+            **previous,
+            "interest": lead["interest"] or previous.get("interest"),
+            "intent": lead["intent"] or previous.get("intent"),
+            "llm_level": lead["level"],
+            "llm_score": lead["score"],
+            "source": "manual" if manual else "llm",
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        t.meta = meta  # reatribui para o SQLAlchemy detectar a mudança no JSON
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _save_lead_async(thread_id: int, lead: Dict[str, Any]) -> None:
+    try:
+        await asyncio.to_thread(save_lead, thread_id, lead)
+    except Exception as e:
+        logger.error(f"[LEAD] Falha ao gravar qualificação da thread {thread_id}: {e}")
+
+
+def record_lead(thread_id: int, lead: Dict[str, Any]) -> None:
+    """Agenda a gravação sem atrasar a resposta."""
+    task = asyncio.create_task(_save_lead_async(thread_id, lead))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
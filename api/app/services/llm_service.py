@@ -3,10 +3,12 @@ import os
 import asyncio
 import math
 import json
+import time
+import hashlib
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 try:
     import PyPDF2
@@ -14,6 +16,25 @@ try:
 except ImportError:
     PDF_AVAILABLE = False
 
+from . import metrics
+from .circuit_breaker import CircuitBreaker
+from .response_cache import response_cache
+from .llm_telemetry import telemetry
+from .token_budget import token_budget, BUDGET_OK, BUDGET_HARD, BUDGET_SOFT, SOFT_MAX_HISTORY
+from .lead_qualification import (
+    LEAD_QUALIFICATION_ENABLED,
+    LEAD_INSTRUCTION,
+    extract_lead_tag,
+    record_lead,
+)
+from .turn_router import (
+    ROUTE_FULL,
+    ROUTE_LIGHT,
+    ROUTE_TEMPLATE,
+    classify_turn,
+    template_reply,
+)
+
 # Importa funções de consulta ao WooCommerce
 from .wc_data import (
     lookup_product,
@@ -23,6 +44,8 @@ from .wc_data import (
     get_product_variations,
     get_product_description,
     build_product_link,
+    product_memo,
+    WC_DATA_FILE,
 )
 
 # -----------------------------
@@ -45,6 +68,38 @@ MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
 RETRY_BASE = float(os.getenv("OPENAI_RETRY_BASE", "0.6"))  # backoff exponencial
 MAX_HISTORY = int(os.getenv("OPENAI_MAX_HISTORY", "20"))   # msgs (user/assistant/system)
 
+# Deadline total por invocação de run_llm (todas as tentativas + tools)
+LLM_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "45"))  # segundos
+# Abaixo deste tempo restante as tools são desligadas (força resposta final)
+FINAL_ANSWER_RESERVE = float(os.getenv("OPENAI_FINAL_ANSWER_RESERVE", "10"))
+# Tempo mínimo para valer a pena iniciar uma nova chamada
+MIN_ATTEMPT_TIMEOUT = float(os.getenv("OPENAI_MIN_ATTEMPT_TIMEOUT", "2"))
+TOOL_TIMEOUT = float(os.getenv("OPENAI_TOOL_TIMEOUT", "5"))  # por execução de tool
+
+# Circuit breaker do provedor (falhas e chamadas lentas numa janela deslizante)
+llm_breaker = CircuitBreaker(
+    "openai",
+    window_seconds=float(os.getenv("OPENAI_CB_WINDOW", "60")),
+    min_calls=int(os.getenv("OPENAI_CB_MIN_CALLS", "10")),
+    error_rate=float(os.getenv("OPENAI_CB_ERROR_RATE", "0.5")),
+    slow_call_ms=float(os.getenv("OPENAI_CB_SLOW_CALL_MS", "20000")),
+    open_seconds=float(os.getenv("OPENAI_CB_OPEN_SECONDS", "30")),
+    half_open_probes=int(os.getenv("OPENAI_CB_HALF_OPEN_PROBES", "3")),
+)
+
+# Rota leve (turnos triviais): modelo, prompt e histórico reduzidos, sem tools
+LIGHT_MODEL = os.getenv("LLM_LIGHT_MODEL", MODEL)
+LIGHT_MAX_HISTORY = int(os.getenv("LLM_LIGHT_MAX_HISTORY", "6"))
+LIGHT_PROMPT = (os.getenv("LLM_LIGHT_PROMPT", "") or "").replace("\\n", "\n").strip() or (
+    "Você é a assistente de atendimento da empresa no WhatsApp. "
+    "Responda em português do Brasil, de forma curta, simpática e natural (1 a 2 frases). "
+    "A mensagem do cliente é só um cumprimento, agradecimento ou confirmação: responda de acordo "
+    "e, se fizer sentido, pergunte se pode ajudar em algo mais. "
+    "Nunca invente preços, prazos ou informações de produtos."
+)
+
+FALLBACK_REPLY = "Desculpe, tive um problema para gerar a resposta agora. Pode tentar novamente?"
+
 def _load_agent_instructions() -> str:
     s = os.getenv("AGENT_INSTRUCTIONS", "") or ""
     path = os.getenv("AGENT_INSTRUCTIONS_FILE") or DEFAULT_PROMPT_FILE
@@ -67,8 +122,25 @@ def _load_agent_instructions() -> str:
 
 AGENT_INSTRUCTIONS = _load_agent_instructions()
 
-# Cliente OpenAI
-client = OpenAI(api_key=API_KEY)
+# Cliente OpenAI (assíncrono: permite cancelar a requisição perdedora do hedge).
+# max_retries=0 porque os retries são feitos em _call_openai_with_retries,
+# dentro do deadline da invocação.
+client = AsyncOpenAI(api_key=API_KEY, max_retries=0)
+
+# Hedge: segundo pedido para um modelo/endpoint secundário quando o primário
+# demora mais que o percentil recente da própria latência
+HEDGE_MODEL = os.getenv("OPENAI_HEDGE_MODEL", "").strip()
+HEDGE_BASE_URL = os.getenv("OPENAI_HEDGE_BASE_URL", "").strip() or None
+HEDGE_API_KEY = os.getenv("OPENAI_HEDGE_API_KEY", "").strip() or API_KEY
+HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("OPENAI_HEDGE_DEFAULT_DELAY_MS", "4000"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("OPENAI_HEDGE_MIN_DELAY_MS", "1500"))
+
+hedge_client = (
+    AsyncOpenAI(api_key=HEDGE_API_KEY, base_url=HEDGE_BASE_URL, max_retries=0)
+    if HEDGE_MODEL else None
+)
 
 
 # -----------------------------
@@ -404,39 +476,275 @@ def _execute_function(function_name: str, arguments: Dict[str, Any]) -> Any:
         return {"error": str(e)}
 
 
-async def _call_openai_with_retries(messages: List[Dict[str, Any]], use_functions: bool = True) -> str:
+class _LLMRun:
+    """
+    Estado de uma invocação de `run_llm`: deadline único (compartilhado por
+    todas as tentativas, retries e rodadas de tools) e contadores.
+    """
+
+    def __init__(self, budget: float = LLM_DEADLINE, thread_id: Optional[int] = None):
+        self.started = time.monotonic()
+        self.deadline = self.started + budget
+        self.thread_id = thread_id
+        self.retries = 0
+        self.tool_rounds = 0
+        self.forced_final = False
+        self.outcome = "ok"  # ok | forced_final | deadline_exceeded | error | circuit_open | budget_exceeded
+        self.route = ROUTE_FULL
+        # Contabilidade (telemetria)
+        self.model: Optional[str] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.tool_calls: List[Dict[str, Any]] = []
+        # Memo das tools nesta invocação: chamadas idênticas e produtos já resolvidos
+        self.tool_results: Dict[str, Any] = {}
+        self.products: Dict[str, Any] = {}
+        self.tools_deduped = 0
+
+    def add_usage(self, resp: Any) -> None:
+        """Soma o `usage` de uma resposta de completion."""
+        self.model = getattr(resp, "model", None) or self.model
+        usage = getattr(resp, "usage", None)
+        if not usage:
+            return
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_tokens += (getattr(details, "cached_tokens", 0) or 0) if details else 0
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000.0
+
+
+def _tool_key(function_name: str, arguments: Dict[str, Any]) -> str:
+    return f"{function_name}:{json.dumps(arguments, sort_keys=True, ensure_ascii=False)}"
+
+
+def _execute_function_memo(function_name: str, arguments: Dict[str, Any], products: Dict[str, Any]) -> Any:
+    with product_memo(products):
+        return _execute_function(function_name, arguments)
+
+
+async def _execute_tool(function_name: str, arguments: Dict[str, Any], run: _LLMRun) -> Any:
+    """
+    Executa a tool em thread separada, respeitando o tempo restante do deadline.
+    Chamada idêntica a uma anterior da mesma invocação devolve o resultado já obtido.
+    """
+    key = _tool_key(function_name, arguments)
+    if key in run.tool_results:
+        run.tools_deduped += 1
+        metrics.incr("llm.tools.deduped")
+        run.tool_calls.append({
+            "name": function_name,
+            "args": arguments,
+            "round": run.tool_rounds,
+            "ms": 0,
+            "deduped": True,
+        })
+        return run.tool_results[key]
+
+    remaining = run.remaining()
+    if remaining <= 0:
+        return {"error": "Tempo esgotado antes de consultar o catálogo"}
+    started = time.monotonic()
+    try:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(_execute_function_memo, function_name, arguments, run.products),
+            timeout=min(TOOL_TIMEOUT, remaining),
+        )
+        run.tool_results[key] = result
+        return result
+    except asyncio.TimeoutError:
+        return {"error": "Tempo limite excedido ao consultar o catálogo"}
+    finally:
+        run.tool_calls.append({
+            "name": function_name,
+            "args": arguments,
+            "round": run.tool_rounds,
+            "ms": int((time.monotonic() - started) * 1000),
+        })
+
+
+def _hedge_delay_ms() -> float:
+    """Quanto esperar o primário antes de disparar o hedge (percentil dinâmico)."""
+    recent = metrics.samples("llm.completion.primary_ms")
+    if len(recent) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY_MS
+    return max(HEDGE_MIN_DELAY_MS, metrics.percentile(recent, HEDGE_PERCENTILE))
+
+
+def _estimate_hedge_saving_ms(won_at_ms: float) -> Optional[float]:
+    """
+    Estimativa do tempo economizado quando o hedge vence: média das latências
+    recentes do primário que passaram de `won_at_ms`, menos `won_at_ms`.
+    """
+    slower = [v for v in metrics.samples("llm.completion.primary_ms") if v > won_at_ms]
+    if not slower:
+        return None
+    return sum(slower) / len(slower) - won_at_ms
+
+
+async def _create_completion(kwargs: Dict[str, Any], model: str = MODEL, hedge: bool = True) -> Any:
+    """
+    Uma chamada de chat completion. Se `OPENAI_HEDGE_MODEL` estiver configurado
+    e o primário não responder dentro do percentil recente, dispara o mesmo
+    pedido no secundário; a primeira resposta válida vence e a outra é cancelada.
+    O hedge (e a série de latência dele) vale só para o modelo principal na
+    rota completa (`hedge=True`).
+    """
+    metrics.incr("llm.completion.calls")
+    started = time.monotonic()
+
+    def _elapsed_ms() -> float:
+        return (time.monotonic() - started) * 1000.0
+
+    primary = asyncio.create_task(client.chat.completions.create(model=model, **kwargs))
+    tasks = [primary]
+    try:
+        if not hedge or model != MODEL:
+            return await primary
+
+        delay_ms = _hedge_delay_ms()
+        if hedge_client is None or delay_ms / 1000.0 >= kwargs["timeout"]:
+            resp = await primary
+            metrics.observe("llm.completion.primary_ms", _elapsed_ms())
+            return resp
+
+        done, _ = await asyncio.wait({primary}, timeout=delay_ms / 1000.0)
+        if primary in done:
+            resp = primary.result()
+            metrics.observe("llm.completion.primary_ms", _elapsed_ms())
+            return resp
+
+        metrics.incr("llm.hedge.fired")
+        hedge_kwargs = dict(kwargs)
+        hedge_kwargs["timeout"] = max(1.0, kwargs["timeout"] - delay_ms / 1000.0)
+        hedge_task = asyncio.create_task(hedge_client.chat.completions.create(model=HEDGE_MODEL, **hedge_kwargs))
+        tasks.append(hedge_task)
+
+        pending = {primary, hedge_task}
+        errors: List[BaseException] = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    continue
+                won_at = _elapsed_ms()
+                if task is primary:
+                    metrics.incr("llm.hedge.won_by_primary")
+                    metrics.observe("llm.completion.primary_ms", won_at)
+                else:
+                    metrics.incr("llm.hedge.won_by_hedge")
+                    # Primário cancelado: a latência dele foi no mínimo `won_at`
+                    # (amostra censurada, mantém a cauda na janela do percentil)
+                    saving = _estimate_hedge_saving_ms(won_at)
+                    metrics.observe("llm.completion.primary_ms", won_at)
+                    if saving is not None:
+                        metrics.observe("llm.hedge.saved_ms", saving)
+                    print(f"[LLM] 🏁 Hedge ({HEDGE_MODEL}) venceu em {won_at:.0f}ms")
+                return task.result()
+        raise errors[0]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def hedge_stats() -> dict:
+    """Resumo do hedge para /metrics."""
+    calls = metrics.counter("llm.completion.calls")
+    fired = metrics.counter("llm.hedge.fired")
+    saved = metrics.samples("llm.hedge.saved_ms")
+    return {
+        "enabled": hedge_client is not None,
+        "model": HEDGE_MODEL or None,
+        "threshold_ms": round(_hedge_delay_ms(), 1),
+        "hedge_rate": round(fired / calls, 4) if calls else 0.0,
+        "won_by_hedge": metrics.counter("llm.hedge.won_by_hedge"),
+        "won_by_primary": metrics.counter("llm.hedge.won_by_primary"),
+        "saved_ms_avg": round(sum(saved) / len(saved), 1) if saved else None,
+    }
+
+
+async def _call_openai_with_retries(
+    messages: List[Dict[str, Any]],
+    use_functions: bool = True,
+    run: Optional[_LLMRun] = None,
+    model: str = MODEL,
+) -> str:
     """
     Chamada ao OpenAI com retries, backoff exponencial e function calling.
-    Executa a chamada síncrona em thread separada para não bloquear o loop.
+    Usa o cliente assíncrono (com hedge opcional, ver `_create_completion`).
+
+    Todas as tentativas e rodadas de tools dividem o mesmo deadline (`run`):
+    cada chamada usa no máximo o tempo restante, e quando sobra pouco as tools
+    são desligadas para forçar a resposta final.
     """
+    run = run or _LLMRun()
     max_function_iterations = 5  # Limite de iterações de function calling
     function_iterations = 0
     attempt = 0
 
     while True:
         attempt += 1
-        last_err: Optional[BaseException] = None
-        
-        try:
-            def _sync_call() -> Any:
-                kwargs = {
-                    "model": MODEL,
-                    "messages": messages,
-                    "timeout": REQUEST_TIMEOUT,
-                }
-                
-                if use_functions and function_iterations < max_function_iterations:
-                    kwargs["tools"] = FUNCTIONS
-                    kwargs["tool_choice"] = "auto"
-                
-                return client.chat.completions.create(**kwargs)
 
-            resp = await asyncio.to_thread(_sync_call)
+        remaining = run.remaining()
+        if remaining < MIN_ATTEMPT_TIMEOUT:
+            run.outcome = "deadline_exceeded"
+            break
+
+        tools_allowed = (
+            use_functions
+            and function_iterations < max_function_iterations
+            and remaining > FINAL_ANSWER_RESERVE
+        )
+        if use_functions and function_iterations < max_function_iterations and not tools_allowed:
+            if not run.forced_final:
+                print(f"[LLM] ⏱️  Restam {remaining:.1f}s: desligando tools para forçar resposta final")
+            run.forced_final = True
+
+        attempt_timeout = min(REQUEST_TIMEOUT, remaining)
+
+        # Provedor degradado: devolve o fallback na hora em vez de esperar retries
+        if not llm_breaker.allow():
+            run.outcome = "circuit_open"
+            break
+
+        call_started = time.monotonic()
+        try:
+            kwargs: Dict[str, Any] = {
+                "messages": messages,
+                "timeout": attempt_timeout,
+            }
+            if tools_allowed:
+                kwargs["tools"] = FUNCTIONS
+                kwargs["tool_choice"] = "auto"
+            elif use_functions:
+                # Mantém as definições (o histórico pode ter tool calls), mas proíbe novas chamadas
+                kwargs["tools"] = FUNCTIONS
+                kwargs["tool_choice"] = "none"
+
+            try:
+                resp = await _create_completion(kwargs, model=model, hedge=run.route == ROUTE_FULL)
+            except asyncio.CancelledError:
+                llm_breaker.release()
+                raise
+            except Exception:
+                llm_breaker.record(False, (time.monotonic() - call_started) * 1000.0)
+                raise
+            llm_breaker.record(True, (time.monotonic() - call_started) * 1000.0)
+            run.add_usage(resp)
             message = resp.choices[0].message
             
             # Verifica se há function calls
-            if message.tool_calls and function_iterations < max_function_iterations:
+            if message.tool_calls and tools_allowed:
                 function_iterations += 1
+                run.tool_rounds += 1
                 attempt = 0  # Reseta contador de retries para nova chamada
                 
                 # Adiciona a mensagem do assistente com tool calls
@@ -464,7 +772,7 @@ async def _call_openai_with_retries(messages: List[Dict[str, Any]], use_function
                     except:
                         arguments = {}
                     
-                    result = _execute_function(function_name, arguments)
+                    result = await _execute_tool(function_name, arguments, run)
                     
                     # Adiciona resultado como tool message
                     messages.append({
@@ -480,46 +788,71 @@ async def _call_openai_with_retries(messages: List[Dict[str, Any]], use_function
             content = (message.content or "").strip()
             if not content and message.tool_calls:
                 content = "Desculpe, não consegui obter as informações solicitadas. Pode reformular sua pergunta?"
+            if run.forced_final:
+                run.outcome = "forced_final"
             return content
             
         except Exception as e:
-            last_err = e
+            print(f"[LLM] ⚠️  Falha na tentativa {attempt}: {type(e).__name__}: {e}")
             if attempt >= MAX_RETRIES:
+                run.outcome = "error"
                 break
             # Backoff exponencial com jitter leve
             delay = (RETRY_BASE ** attempt) + (attempt * 0.05)
+            # Não vale esperar se depois do backoff não sobra tempo para outra tentativa
+            if run.remaining() - delay < MIN_ATTEMPT_TIMEOUT:
+                run.outcome = "deadline_exceeded"
+                break
+            run.retries += 1
             await asyncio.sleep(delay)
 
     # Fallback amigável
-    return "Desculpe, tive um problema para gerar a resposta agora. Pode tentar novamente?"
-
-
-# -----------------------------
-# LLM
-# -----------------------------
-async def run_llm(
+    return FALLBACK_REPLY
+
+
+def _record_run(run: _LLMRun) -> None:
+    """Registra o desfecho (deadline, erro, circuito) e a latência total da invocação."""
+    metrics.incr(f"llm.outcome.{run.outcome}")
+    metrics.observe("llm.run_llm.latency_ms", run.elapsed_ms())
+    metrics.incr(f"llm.route.{run.route}")
+    metrics.observe(f"llm.route.{run.route}.latency_ms", run.elapsed_ms())
+    print(f"[ROUTER] rota={run.route} latência={run.elapsed_ms():.0f}ms")
+    token_budget.record(run.thread_id, run.prompt_tokens, run.completion_tokens)
+    telemetry.record({
+        "thread_id": run.thread_id,
+        "model": run.model,
+        "route": run.route,
+        "outcome": run.outcome,
+        "prompt_tokens": run.prompt_tokens,
+        "completion_tokens": run.completion_tokens,
+        "cached_tokens": run.cached_tokens,
+        "tool_rounds": run.tool_rounds,
+        "tool_calls": run.tool_calls or None,
+        "retries": run.retries,
+        "latency_ms": int(run.elapsed_ms()),
+    })
+    if run.outcome != "ok":
+        print(
+            f"[LLM] Desfecho: {run.outcome} em {run.elapsed_ms():.0f}ms "
+            f"(retries={run.retries}, tool_rounds={run.tool_rounds})"
+        )
+    if run.tools_deduped:
+        print(f"[LLM] {run.tools_deduped} tool call(s) repetida(s) evitada(s)")
+
+
+def _build_full_messages(
     message: str,
-    thread_history: Optional[List[Dict[str, str]]] = None,
-    takeover: bool = False,
-) -> Optional[str]:
-    """
-    Gera uma resposta da LLM usando:
-      - system prompt carregado do .env/arquivo
-      - histórico (limite configurável)
-      - mensagem do usuário
-
-    Se `takeover=True`, não gera resposta (modo humano assumiu) e retorna None.
-    """
-    # 🔒 Bloqueio de takeover: nunca responder se humano assumiu
-    if takeover:
-        return None
-
+    thread_history: Optional[List[Dict[str, str]]],
+    max_history: int = MAX_HISTORY,
+    use_rag: bool = True,
+) -> List[Dict[str, Any]]:
+    """Pipeline completo: prompt do agente + contexto RAG + histórico + mensagem."""
     # Monta a lista de mensagens no formato da API
-    messages: List[Dict[str, str]] = []
+    messages: List[Dict[str, Any]] = []
     
     # Carrega contexto RAG relevante
     print(f"[RAG] Processando mensagem: {message[:100]}...")
-    rag_context = _get_rag_context(message, thread_history)
+    rag_context = _get_rag_context(message, thread_history) if use_rag else ""
     
     # Monta system prompt com instruções base + contexto RAG
     system_content = AGENT_INSTRUCTIONS
@@ -536,12 +869,133 @@ async def run_llm(
     if system_content:
         messages.append({"role": "system", "content": system_content})
 
-    history = _coerce_history(thread_history, max_history=MAX_HISTORY)
+    history = _coerce_history(thread_history, max_history=max_history)
     messages.extend(history)
 
     user_msg = (message or "").strip()
     messages.append({"role": "user", "content": user_msg})
+    return messages
+
+
+def _build_light_messages(message: str, thread_history: Optional[List[Dict[str, str]]]) -> List[Dict[str, Any]]:
+    """Rota leve: prompt curto, poucas mensagens de histórico, sem RAG."""
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": LIGHT_PROMPT}]
+    messages.extend(_coerce_history(thread_history, max_history=LIGHT_MAX_HISTORY))
+    messages.append({"role": "user", "content": (message or "").strip()})
+    return messages
+
+
+def _content_version() -> str:
+    """
+    Versão do conteúdo que influencia as respostas: prompt do agente, arquivos
+    RAG e arquivo do catálogo (nome, tamanho e mtime). Usada pelo cache de respostas.
+    """
+    parts = [hashlib.sha256(AGENT_INSTRUCTIONS.encode("utf-8")).hexdigest()]
+    paths = sorted(RAG_DOCS_DIR.glob("*")) if RAG_DOCS_DIR.exists() else []
+    paths.append(Path(WC_DATA_FILE))
+    for path in paths:
+        try:
+            st = path.stat()
+            parts.append(f"{path.name}:{st.st_size}:{int(st.st_mtime)}")
+        except OSError:
+            parts.append(f"{path.name}:missing")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _is_first_turn(message: str, thread_history: Optional[List[Dict[str, str]]]) -> bool:
+    """True se não há histórico além da própria mensagem atual."""
+    prior = _coerce_history(thread_history, max_history=0)
+    current = (message or "").strip()
+    while prior and prior[-1]["role"] == "user" and prior[-1]["content"] == current:
+        prior.pop()
+    return not prior
+
 
-    # Chamar OpenAI com robustez (timeout + retries + function calling)
-    content = await _call_openai_with_retries(messages, use_functions=True)
+# -----------------------------
+# LLM
+# -----------------------------
+async def run_llm(
+    message: str,
+    thread_history: Optional[List[Dict[str, str]]] = None,
+    takeover: bool = False,
+    thread_id: Optional[int] = None,
+) -> Optional[str]:
+    """
+    Gera uma resposta da LLM usando:
+      - system prompt carregado do .env/arquivo
+      - histórico (limite configurável)
+      - mensagem do usuário
+
+    Se `takeover=True`, não gera resposta (modo humano assumiu) e retorna None.
+    Também retorna None se o orçamento de tokens da conversa estourou o limite
+    hard (a conversa passa para atendimento humano); no limite hard do dia
+    devolve o aviso fixo `LLM_BUDGET_DAILY_FALLBACK` (uma vez por conversa).
+    `thread_id` é usado para telemetria/contabilidade e, com
+    `LLM_LEAD_QUALIFICATION`, para gravar a qualificação do lead na thread.
+    """
+    # 🔒 Bloqueio de takeover: nunca responder se humano assumiu
+    if takeover:
+        return None
+
+    run = _LLMRun(thread_id=thread_id)
+
+    # Orçamento de tokens: soft = contexto reduzido; hard = passa para humano
+    budget = BUDGET_OK
+    if token_budget.enabled:
+        budget, budget_reason = await asyncio.to_thread(token_budget.check, thread_id)
+        if budget == BUDGET_HARD:
+            run.outcome = "budget_exceeded"
+            _record_run(run)
+            # Só o limite da conversa vira takeover; o do dia avisa o cliente e
+            # pula a LLM até virar o dia
+            if thread_id is not None and budget_reason.startswith("thread_"):
+                await token_budget.block(thread_id, budget_reason)
+                return None
+            return token_budget.daily_fallback(thread_id)
+        if budget == BUDGET_SOFT:
+            metrics.incr("llm.budget.soft")
+            print(f"[BUDGET] ⚠️  Limite soft ({budget_reason}): histórico curto e sem RAG")
+
+    route, reason = classify_turn(message, thread_history)
+    run.route = route
+    print(f"[ROUTER] rota={route} motivo={reason}")
+
+    if route == ROUTE_TEMPLATE:
+        content = template_reply(reason)
+    elif route == ROUTE_LIGHT:
+        messages = _build_light_messages(message, thread_history)
+        content = await _call_openai_with_retries(messages, use_functions=False, run=run, model=LIGHT_MODEL)
+    else:
+        # Cache de FAQ: só no primeiro turno, quando a resposta depende só da pergunta
+        cache_key = None
+        if response_cache.enabled and _is_first_turn(message, thread_history):
+            rag_docs = _detect_relevant_rag_docs(message)
+            cache_key = response_cache.make_key(message, rag_docs, _content_version())
+            cached = response_cache.get(cache_key)
+            if cached:
+                print(f"[CACHE] ✅ Resposta em cache para: {message[:60]}")
+                run.route = "cache"
+                _record_run(run)
+                return cached
+
+        if budget == BUDGET_SOFT:
+            messages = _build_full_messages(message, thread_history, max_history=SOFT_MAX_HISTORY, use_rag=False)
+        else:
+            messages = _build_full_messages(message, thread_history)
+        qualify_lead = LEAD_QUALIFICATION_ENABLED and thread_id is not None and messages[0]["role"] == "system"
+        if qualify_lead:
+            messages[0]["content"] += LEAD_INSTRUCTION
+        # Chamar OpenAI com robustez (deadline + retries + function calling)
+        content = await _call_openai_with_retries(messages, use_functions=True, run=run)
+
+        if qualify_lead and run.outcome in ("ok", "forced_final"):
+            content, lead = extract_lead_tag(content)
+            if lead:
+                record_lead(thread_id, lead)
+
+        # Resposta com contexto reduzido (limite soft) não entra no cache
+        if cache_key and content and run.outcome == "ok" and budget == BUDGET_OK:
+            response_cache.put(cache_key, message, content, rag_docs)
+
+    _record_run(run)
     return content
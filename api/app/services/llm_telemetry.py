@@ -0,0 +1,151 @@
+# api/app/services/llm_telemetry.py
+"""
+Telemetria por chamada de run_llm, gravada de forma assíncrona e em lotes
+na tabela `llm_calls` (o caminho de resposta nunca espera o banco).
+
+- `telemetry.record(row)` só enfileira (O(1), sem I/O).
+- Um task de fundo junta até `LLM_TELEMETRY_BATCH` linhas ou espera
+  `LLM_TELEMETRY_FLUSH_SECONDS` e grava tudo num único INSERT, em thread
+  separada.
+- Fila cheia (banco fora do ar por muito tempo) descarta a linha e conta em
+  `llm.telemetry.dropped`.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from . import metrics
+from ..db import SessionLocal
+from ..models import LLMCall
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("LLM_TELEMETRY_BATCH", "50"))
+FLUSH_SECONDS = float(os.getenv("LLM_TELEMETRY_FLUSH_SECONDS", "2"))
+QUEUE_MAX = int(os.getenv("LLM_TELEMETRY_QUEUE_MAX", "10000"))
+
+# Preço em USD por 1M de tokens: (entrada, entrada em cache, saída).
+# Pode ser sobrescrito com LLM_PRICES='{"gpt-4o-mini": [0.15, 0.075, 0.6]}'
+MODEL_PRICES: Dict[str, List[float]] = {
+    "gpt-4o-mini": [0.15, 0.075, 0.60],
+    "gpt-4o": [2.50, 1.25, 10.00],
+}
+try:
+    MODEL_PRICES.update(json.loads(os.getenv("LLM_PRICES", "") or "{}"))
+except ValueError:
+    logger.warning("[TELEMETRY] LLM_PRICES inválido, usando preços padrão")
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Custo estimado em USD (0 para modelos sem preço cadastrado)."""
+    prices = None
+    if model:
+        # "gpt-4o-mini-2024-07-18" usa o preço de "gpt-4o-mini"
+        for name in sorted(MODEL_PRICES, key=len, reverse=True):
+            if model.startswith(name):
+                prices = MODEL_PRICES[name]
+                break
+    if not prices:
+        return 0.0
+    price_in, price_cached, price_out = prices
+    uncached = max(0, (prompt_tokens or 0) - (cached_tokens or 0))
+    return (
+        uncached * price_in
+        + (cached_tokens or 0) * price_cached
+        + (completion_tokens or 0) * price_out
+    ) / 1_000_000
+
+
+def _write_batch(rows: List[Dict[str, Any]]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(insert(LLMCall), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+class TelemetryWriter:
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Lote em montagem pelo `_run` (já fora da fila); stop() grava se o task for cancelado
+        self._batch: List[Dict[str, Any]] = []
+
+    def start(self) -> None:
+        if self._task and not self._task.done():
+            return
+        self.queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Para o task e grava o lote em montagem e tudo o que ainda estiver na fila."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        rows, self._batch = self._batch, []
+        await self._flush(rows)
+        while self.queue and not self.queue.empty():
+            await self._flush(self._drain())
+
+    def record(self, row: Dict[str, Any]) -> None:
+        if self._task is None:
+            self.start()
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            metrics.incr("llm.telemetry.dropped")
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        rows = []
+        while not self.queue.empty() and len(rows) < BATCH_SIZE:
+            rows.append(self.queue.get_nowait())
+        return rows
+
+    async def _run(self) -> None:
+        while True:
+            self._batch.append(await self.queue.get())
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + FLUSH_SECONDS
+            while len(self._batch) < BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                # asyncio.wait em vez de wait_for: no 3.11 o wait_for pode engolir o
+                # cancelamento do stop() quando o get() termina ao mesmo tempo
+                getter = asyncio.ensure_future(self.queue.get())
+                got = False
+                try:
+                    await asyncio.wait({getter}, timeout=timeout)
+                finally:
+                    if not getter.done():
+                        getter.cancel()  # o item fica na fila
+                    elif not getter.cancelled():
+                        self._batch.append(getter.result())  # mesmo se o task foi cancelado
+                        got = True
+                if not got:
+                    break
+            # Sai do lote antes de gravar: cancelado no meio do INSERT, o stop() não grava de novo
+            rows, self._batch = self._batch, []
+            await self._flush(rows)
+
+    async def _flush(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        try:
+            await asyncio.to_thread(_write_batch, rows)
+            metrics.incr("llm.telemetry.written", len(rows))
+        except Exception as e:
+            metrics.incr("llm.telemetry.failed", len(rows))
+            logger.error(f"[TELEMETRY] Falha ao gravar {len(rows)} linha(s): {e}")
+
+
+telemetry = TelemetryWriter()
@@ -0,0 +1,168 @@
+# api/app/services/media_cache.py
+"""
+Cache persistente de análise de mídia (tabela `media_analysis_cache`).
+
+Clientes reenviam o mesmo panfleto, logo ou print de preço várias vezes; o
+resultado da transcrição/visão é guardado por sha256 do conteúdo + tipo de
+mídia + modelo e devolvido na hora quando o mesmo arquivo chega de novo.
+
+- `MEDIA_CACHE_ENABLED` (padrão: true).
+- Remoção: entradas sem uso há mais de `MEDIA_CACHE_TTL_DAYS` e, acima de
+  `MEDIA_CACHE_MAX_ENTRIES`, as usadas há mais tempo. Roda no máximo a cada
+  `MEDIA_CACHE_EVICT_INTERVAL` segundos, depois de uma gravação.
+- Acertos/erros em `media.cache.*` (ver `stats()` e GET /metrics).
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics
+from ..db import SessionLocal
+from ..models import MediaAnalysis
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_ENABLED = os.getenv("MEDIA_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+MEDIA_CACHE_TTL_DAYS = float(os.getenv("MEDIA_CACHE_TTL_DAYS", "30"))
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "5000"))
+MEDIA_CACHE_EVICT_INTERVAL = float(os.getenv("MEDIA_CACHE_EVICT_INTERVAL", "3600"))
+
+
+def _get(content_hash: str, media_type: str, model: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(MediaAnalysis)
+            .filter(
+                MediaAnalysis.content_hash == content_hash,
+                MediaAnalysis.media_type == media_type,
+                MediaAnalysis.model == model,
+            )
+            .first()
+        )
+        if not row:
+            return None
+        row.hits = (row.hits or 0) + 1
+        row.last_used_at = datetime.utcnow()
+        db.commit()
+        return {"content": row.content, "type": row.result_type}
+    finally:
+        db.close()
+
+
+def _put(content_hash: str, media_type: str, model: str, result_type: Optional[str], content: str, size: int) -> None:
+    db = SessionLocal()
+    try:
+        db.add(MediaAnalysis(
+            content_hash=content_hash,
+            media_type=media_type,
+            model=model,
+            result_type=result_type,
+            content=content,
+            size_bytes=size,
+        ))
+        db.commit()
+    except IntegrityError:
+        # Mesmo arquivo processado em paralelo: a outra gravação já vale
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _evict() -> int:
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=MEDIA_CACHE_TTL_DAYS)
+        removed = (
+            db.query(MediaAnalysis)
+            .filter(MediaAnalysis.last_used_at < cutoff)
+            .delete(synchronize_session=False)
+        )
+        total = db.query(func.count(MediaAnalysis.id)).scalar() or 0
+        if total > MEDIA_CACHE_MAX_ENTRIES:
+            # Mantém as usadas mais recentemente
+            keep_from = (
+                db.query(MediaAnalysis.last_used_at)
+                .order_by(MediaAnalysis.last_used_at.desc())
+                .offset(MEDIA_CACHE_MAX_ENTRIES - 1)
+                .limit(1)
+                .scalar()
+            )
+            if keep_from is not None:
+                removed += (
+                    db.query(MediaAnalysis)
+                    .filter(MediaAnalysis.last_used_at < keep_from)
+                    .delete(synchronize_session=False)
+                )
+        db.commit()
+        return removed
+    finally:
+        db.close()
+
+
+class MediaCache:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._last_evict = 0.0
+        self._lock = threading.Lock()
+
+    async def get(self, content_hash: str, media_type: str, model: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        try:
+            hit = await asyncio.to_thread(_get, content_hash, media_type, model)
+        except Exception as e:
+            logger.error(f"[MEDIA-CACHE] Falha na leitura: {e}")
+            return None
+        metrics.incr("media.cache.hit" if hit else "media.cache.miss")
+        return hit
+
+    async def put(self, content_hash: str, media_type: str, model: str, result_type: Optional[str], content: str, size: int) -> None:
+        if not self.enabled or not content:
+            return
+        try:
+            await asyncio.to_thread(_put, content_hash, media_type, model, result_type, content, size)
+            metrics.incr("media.cache.store")
+        except Exception as e:
+            logger.error(f"[MEDIA-CACHE] Falha na gravação: {e}")
+            return
+        await self._maybe_evict()
+
+    async def _maybe_evict(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_evict < MEDIA_CACHE_EVICT_INTERVAL:
+                return
+            self._last_evict = now
+        try:
+            removed = await asyncio.to_thread(_evict)
+        except Exception as e:
+            logger.error(f"[MEDIA-CACHE] Falha na limpeza: {e}")
+            return
+        if removed:
+            metrics.incr("media.cache.evicted", removed)
+            print(f"[MEDIA-CACHE] {removed} entrada(s) removida(s)")
+
+    def stats(self) -> Dict[str, Any]:
+        """Acertos/erros desde o início do processo."""
+        hits = metrics.counter("media.cache.hit")
+        misses = metrics.counter("media.cache.miss")
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "stored": int(metrics.counter("media.cache.store")),
+            "evicted": int(metrics.counter("media.cache.evicted")),
+        }
+
+
+media_cache = MediaCache(MEDIA_CACHE_ENABLED)
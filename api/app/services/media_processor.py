@@ -2,90 +2,312 @@
 Serviço para processar mídia recebida via WhatsApp:
 - Áudio: transcrição com Whisper
 - Imagens: descrição com GPT-4 Vision
-- Documentos: extração de texto/descrição com GPT-4 Vision
+- Documentos: texto extraído localmente (PDF, DOCX, texto); Vision só para
+  imagens e páginas escaneadas
 """
 import os
+import json
+import base64
+import asyncio
+import hashlib
+import time
 import httpx
 import tempfile
-from typing import Optional, Dict, Any
-from openai import OpenAI
+from typing import Optional, Dict, Any, BinaryIO, List, Callable, Awaitable
+import openai
+from openai import AsyncOpenAI
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from . import metrics
+from .http_clients import media_client
+from .media_cache import media_cache
+from .image_prep import prepare_image
+from . import doc_extract
+from . import audio_split
 
+# Transcrição/visão: cliente assíncrono (não trava o event loop durante a chamada).
+# Retries feitos aqui (e não no SDK) para rebobinar o arquivo a cada tentativa.
+TRANSCRIBE_MODEL = os.getenv("MEDIA_TRANSCRIBE_MODEL", "whisper-1")
+VISION_MODEL = os.getenv("MEDIA_VISION_MODEL", "gpt-4o")
+MEDIA_OPENAI_TIMEOUT = float(os.getenv("MEDIA_OPENAI_TIMEOUT", "60"))  # segundos por tentativa
+MEDIA_OPENAI_MAX_RETRIES = int(os.getenv("MEDIA_OPENAI_MAX_RETRIES", "2"))
+MEDIA_OPENAI_RETRY_BASE = float(os.getenv("MEDIA_OPENAI_RETRY_BASE", "1.0"))  # backoff exponencial
 
-async def download_media(url: str, auth: tuple = None) -> bytes:
-    """Baixa mídia do Twilio (requer autenticação e segue redirects)"""
-    # httpx segue redirects automaticamente, mas vamos garantir
-    async with httpx.AsyncClient(timeout=60.0, follow_redirects=True, max_redirects=10) as http_client:
-        # Twilio requer autenticação Basic Auth na URL inicial
-        # O redirect vai para uma URL assinada do CDN que não precisa de auth
-        try:
-            if auth:
-                response = await http_client.get(url, auth=auth)
-            else:
-                # Tenta com credenciais do Twilio se disponíveis
-                twilio_sid = os.getenv("TWILIO_ACCOUNT_SID")
-                twilio_token = os.getenv("TWILIO_AUTH_TOKEN")
-                if twilio_sid and twilio_token:
-                    # Primeira requisição precisa de auth, redirect não precisa
-                    response = await http_client.get(url, auth=(twilio_sid, twilio_token))
-                else:
-                    response = await http_client.get(url)
-            
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=MEDIA_OPENAI_TIMEOUT, max_retries=0)
+
+_RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Limites de download: acima de MEDIA_MAX_BYTES a mídia é recusada; até
+# MEDIA_SPOOL_BYTES fica em memória, acima disso o arquivo temporário vai para disco.
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(16 * 1024 * 1024)))  # limite do WhatsApp
+MEDIA_SPOOL_BYTES = int(os.getenv("MEDIA_SPOOL_BYTES", str(1024 * 1024)))
+# Vários anexos na mesma mensagem: quantos processar ao mesmo tempo e tempo total máximo
+MEDIA_CONCURRENCY = int(os.getenv("MEDIA_CONCURRENCY", "3"))
+MEDIA_BATCH_TIMEOUT = float(os.getenv("MEDIA_BATCH_TIMEOUT", "90"))  # segundos
+
+# PDF: páginas sem texto (escaneadas) descritas pelo Vision, no máximo este número
+PDF_VISION_PAGES = int(os.getenv("MEDIA_PDF_VISION_PAGES", "3"))
+
+# Várias imagens na mesma mensagem: uma chamada ao Vision para até
+# MEDIA_VISION_BATCH_MAX_IMAGES imagens (e MEDIA_VISION_BATCH_MAX_BYTES de base64)
+VISION_BATCH_ENABLED = os.getenv("MEDIA_VISION_BATCH", "true").lower() in ("1", "true", "yes")
+VISION_BATCH_MAX_IMAGES = int(os.getenv("MEDIA_VISION_BATCH_MAX_IMAGES", "4"))
+VISION_BATCH_MAX_BYTES = int(os.getenv("MEDIA_VISION_BATCH_MAX_BYTES", str(10 * 1024 * 1024)))
+VISION_BATCH_MAX_TOKENS = int(os.getenv("MEDIA_VISION_BATCH_MAX_TOKENS", "3000"))
+_CHUNK_SIZE = 64 * 1024
+_B64_CHUNK_SIZE = 3 * 64 * 1024  # múltiplo de 3: base64 por partes sem padding no meio
+_SNIFF_BYTES = 64
+
+_EXTENSIONS = {
+    "audio/ogg": ".ogg",
+    "audio/mpeg": ".mp3",
+    "audio/mp4": ".m4a",
+    "audio/wav": ".wav",
+    "audio/amr": ".amr",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "application/pdf": ".pdf",
+}
+
+
+class MediaTooLargeError(Exception):
+    pass
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """Tipo MIME pelos primeiros bytes (assinatura do formato), ou None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    if head.startswith(b"OggS"):
+        return "audio/ogg"
+    if head.startswith(b"#!AMR"):
+        return "audio/amr"
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "audio/mpeg"
+    if head[4:8] == b"ftyp":
+        return "audio/mp4" if head[8:11] == b"M4A" else "video/mp4"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"  # DOCX/XLSX também são zip
+    return None
+
+
+class MediaFile:
+    """
+    Mídia baixada em um SpooledTemporaryFile (memória até MEDIA_SPOOL_BYTES,
+    depois disco). Usar com `with` para liberar o arquivo.
+    """
+
+    def __init__(self, content_type: Optional[str] = None):
+        self.file = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_BYTES)
+        self.size = 0
+        self.head = b""
+        self.content_type = content_type
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > MEDIA_MAX_BYTES:
+            raise MediaTooLargeError(f"Arquivo muito grande (máximo {MEDIA_MAX_BYTES // (1024 * 1024)} MB)")
+        if len(self.head) < _SNIFF_BYTES:
+            self.head += chunk[:_SNIFF_BYTES - len(self.head)]
+        self._hash.update(chunk)
+        self.file.write(chunk)
+
+    @property
+    def sha256(self) -> str:
+        """Hash do conteúdo (calculado durante o download)."""
+        return self._hash.hexdigest()
+
+    @property
+    def sniffed_type(self) -> Optional[str]:
+        return sniff_mime(self.head)
+
+    @property
+    def mime_type(self) -> str:
+        return self.sniffed_type or self.content_type or "application/octet-stream"
+
+    def rewind(self) -> BinaryIO:
+        self.file.seek(0)
+        return self.file
+
+    def read(self) -> bytes:
+        return self.rewind().read()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "MediaFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _filename_for(media: MediaFile, filename: Optional[str], default: str) -> str:
+    """Nome com extensão coerente com o conteúdo (a API usa a extensão para detectar o formato)."""
+    ext = _EXTENSIONS.get(media.mime_type)
+    if filename and (not ext or filename.lower().endswith(ext)):
+        return filename
+    stem = os.path.splitext(filename or default)[0]
+    return stem + (ext or os.path.splitext(default)[1])
+
+
+def _data_uri(media: MediaFile, mime_type: str) -> str:
+    """
+    Data URI (base64) lido do arquivo por partes: os bytes brutos nunca ficam
+    inteiros em memória; no pico existem as partes e a string final.
+    """
+    f = media.rewind()
+    parts = [f"data:{mime_type};base64,"]
+    while True:
+        chunk = f.read(_B64_CHUNK_SIZE)
+        if not chunk:
+            break
+        parts.append(base64.b64encode(chunk).decode("ascii"))
+    return "".join(parts)
+
+
+async def _stream_to_file(http_client: httpx.AsyncClient, url: str, auth: Optional[tuple]) -> MediaFile:
+    media = MediaFile()
+    try:
+        async with http_client.stream("GET", url, auth=auth) as response:
             response.raise_for_status()
-            return response.content
-        except httpx.HTTPStatusError as e:
-            # Se for redirect, tenta seguir manualmente
-            if e.response.status_code in (301, 302, 303, 307, 308):
-                redirect_url = e.response.headers.get("Location")
-                if redirect_url:
-                    # URL do redirect não precisa de autenticação
-                    response = await http_client.get(redirect_url)
-                    response.raise_for_status()
-                    return response.content
-            raise
+            declared = int(response.headers.get("Content-Length") or 0)
+            if declared > MEDIA_MAX_BYTES:
+                raise MediaTooLargeError(f"Arquivo muito grande (máximo {MEDIA_MAX_BYTES // (1024 * 1024)} MB)")
+            media.content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip() or None
+            async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+                media.write(chunk)
+        media.rewind()
+        return media
+    except BaseException:
+        media.close()
+        raise
 
 
-async def transcribe_audio(audio_bytes: bytes, filename: str = "audio.ogg") -> str:
+async def download_media(url: str, auth: tuple = None) -> MediaFile:
     """
-    Transcreve áudio usando Whisper API da OpenAI.
-    Retorna o texto transcrito.
+    Baixa mídia do Twilio (requer autenticação e segue redirects) em streaming
+    para um arquivo temporário, com limite de tamanho (MEDIA_MAX_BYTES).
     """
+    # Cliente compartilhado (keep-alive); httpx segue redirects automaticamente, mas vamos garantir
+    http_client = media_client()
+    # Twilio requer autenticação Basic Auth na URL inicial
+    # O redirect vai para uma URL assinada do CDN que não precisa de auth
+    if not auth:
+        # Tenta com credenciais do Twilio se disponíveis
+        twilio_sid = os.getenv("TWILIO_ACCOUNT_SID")
+        twilio_token = os.getenv("TWILIO_AUTH_TOKEN")
+        if twilio_sid and twilio_token:
+            auth = (twilio_sid, twilio_token)
     try:
-        # Cria arquivo temporário
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp_file:
-            tmp_file.write(audio_bytes)
-            tmp_path = tmp_file.name
-        
+        return await _stream_to_file(http_client, url, auth)
+    except httpx.HTTPStatusError as e:
+        # Se for redirect, tenta seguir manualmente
+        if e.response.status_code in (301, 302, 303, 307, 308):
+            redirect_url = e.response.headers.get("Location")
+            if redirect_url:
+                # URL do redirect não precisa de autenticação
+                return await _stream_to_file(http_client, redirect_url, None)
+        raise
+
+
+async def _call_with_retries(name: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Executa `call` com retries e backoff exponencial para erros transitórios."""
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            # Transcreve com Whisper
-            with open(tmp_path, "rb") as audio_file:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="pt"  # Português
-                )
-            return transcript.text
-        finally:
-            # Remove arquivo temporário
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-    except Exception as e:
-        raise Exception(f"Erro ao transcrever áudio: {str(e)}")
+            return await call()
+        except _RETRYABLE_ERRORS as e:
+            if attempt > MEDIA_OPENAI_MAX_RETRIES:
+                metrics.incr(f"media.{name}.failed")
+                raise
+            metrics.incr(f"media.{name}.retries")
+            delay = MEDIA_OPENAI_RETRY_BASE * (2 ** (attempt - 1))
+            print(f"[MEDIA] ⚠️  {name}: tentativa {attempt} falhou ({type(e).__name__}); nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
 
 
-async def describe_image(image_bytes: bytes, filename: str = "image.jpg") -> str:
+async def transcribe_audio(media: MediaFile, filename: str = "audio.ogg") -> str:
     """
-    Descreve imagem usando GPT-4 Vision.
-    Retorna descrição detalhada da imagem.
+    Transcreve áudio usando Whisper API da OpenAI.
+    Áudios curtos vão direto, sem cópia intermediária; longos (com ffmpeg)
+    são divididos nos silêncios e os trechos transcritos em paralelo.
+    Retorna o texto transcrito.
     """
     try:
-        import base64
-        
-        # Converte para base64
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # Determina o tipo MIME baseado na extensão
+        upload_name = _filename_for(media, filename, "audio.ogg")
+        segments = await audio_split.split_audio(media.rewind(), media.size, os.path.splitext(upload_name)[1])
+        if segments:
+            return await _transcribe_segments(segments)
+        transcript = await _call_with_retries(
+            "transcription",
+            lambda: client.audio.transcriptions.create(
+                model=TRANSCRIBE_MODEL,
+                file=(upload_name, media.rewind()),  # rebobina a cada tentativa
+                language="pt"  # Português
+            ),
+        )
+        return transcript.text
+    except Exception as e:
+        raise Exception(f"Erro ao transcrever áudio: {str(e)}")
+
+
+async def _transcribe_segments(segments: List[bytes]) -> str:
+    sem = asyncio.Semaphore(max(1, audio_split.SEGMENT_CONCURRENCY))
+
+    async def _one(index: int, data: bytes) -> str:
+        async with sem:
+            transcript = await _call_with_retries(
+                "transcription",
+                lambda: client.audio.transcriptions.create(
+                    model=TRANSCRIBE_MODEL,
+                    file=(f"trecho{index}.ogg", data),
+                    language="pt"
+                ),
+            )
+            return transcript.text
+
+    started = time.perf_counter()
+    texts = await asyncio.gather(*(_one(i, data) for i, data in enumerate(segments)))
+    metrics.incr("media.transcription.segments", len(segments))
+    metrics.observe("media.transcription.segmented_ms", (time.perf_counter() - started) * 1000.0)
+    return audio_split.stitch(list(texts))
+
+
+_DESCRIBE_PROMPT = "Descreva detalhadamente esta imagem. Inclua todos os elementos visíveis, textos, cores, objetos, pessoas, cenário e qualquer informação relevante. Se for um documento, descreva o conteúdo textual e visual."
+
+_DESCRIBE_MANY_PROMPT = (
+    "Você receberá {count} imagens, numeradas de 1 a {count} na ordem em que aparecem. "
+    "Descreva cada uma detalhadamente, separadamente: elementos visíveis, textos, cores, objetos, "
+    "pessoas, cenário e qualquer informação relevante. Se for um documento, descreva o conteúdo "
+    "textual e visual. Responda somente com JSON no formato "
+    '{{"images": [{{"index": 1, "description": "..."}}]}}, com exatamente {count} itens.'
+)
+
+
+async def _image_part(media: MediaFile, filename: str) -> Dict[str, Any]:
+    """Bloco `image_url` da mensagem (imagem reduzida quando possível)."""
+    # Tipo pelo conteúdo; se não reconhecer, pela extensão
+    mime_type = media.sniffed_type
+    if not mime_type or not mime_type.startswith("image/"):
         mime_type = "image/jpeg"
         if filename.lower().endswith('.png'):
             mime_type = "image/png"
@@ -93,60 +315,240 @@ async def describe_image(image_bytes: bytes, filename: str = "image.jpg") -> str
             mime_type = "image/gif"
         elif filename.lower().endswith('.webp'):
             mime_type = "image/webp"
-        
-        # Usa GPT-4 Vision para descrever
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Descreva detalhadamente esta imagem. Inclua todos os elementos visíveis, textos, cores, objetos, pessoas, cenário e qualquer informação relevante. Se for um documento, descreva o conteúdo textual e visual."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{image_base64}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1000
+
+    # Reduz/regrava antes de enviar (fora do event loop: decodificar custa CPU).
+    # Sem Pillow ou se a imagem não decodificar, segue a original.
+    detail = "auto"
+    prepared = await asyncio.to_thread(prepare_image, media.rewind(), media.size)
+    if prepared:
+        mime_type = prepared["mime_type"]
+        detail = prepared["detail"]
+        url = f"data:{mime_type};base64,{base64.b64encode(prepared['data']).decode('ascii')}"
+    else:
+        # Converte para base64 (fora do event loop: arquivos grandes custam CPU)
+        url = await asyncio.to_thread(_data_uri, media, mime_type)
+
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": url,
+            "detail": detail,
+        }
+    }
+
+
+async def _vision_describe(parts: List[Dict[str, Any]]) -> List[str]:
+    """
+    Uma chamada ao Vision para uma ou mais imagens; devolve uma descrição por
+    imagem, na ordem. Com várias imagens, pede JSON com a descrição de cada uma
+    e falha (ValueError) se a resposta não trouxer exatamente uma por imagem.
+    """
+    if len(parts) == 1:
+        content = [{"type": "text", "text": _DESCRIBE_PROMPT}, parts[0]]
+        messages = [{"role": "user", "content": content}]
+        response = await _call_with_retries(
+            "vision",
+            lambda: client.chat.completions.create(model=VISION_MODEL, messages=messages, max_tokens=1000),
         )
-        
-        return response.choices[0].message.content
+        return [response.choices[0].message.content]
+
+    content = [{"type": "text", "text": _DESCRIBE_MANY_PROMPT.format(count=len(parts))}]
+    for index, part in enumerate(parts, start=1):
+        content.append({"type": "text", "text": f"Imagem {index}:"})
+        content.append(part)
+    messages = [{"role": "user", "content": content}]
+    max_tokens = min(VISION_BATCH_MAX_TOKENS, 1000 * len(parts))
+    response = await _call_with_retries(
+        "vision",
+        lambda: client.chat.completions.create(
+            model=VISION_MODEL,
+            messages=messages,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"},
+        ),
+    )
+    data = json.loads(response.choices[0].message.content or "{}")
+    by_index = {}
+    for entry in data.get("images") or []:
+        if isinstance(entry, dict) and isinstance(entry.get("description"), str):
+            try:
+                by_index[int(entry.get("index"))] = entry["description"].strip()
+            except (TypeError, ValueError):
+                continue
+    descriptions = [by_index.get(i) for i in range(1, len(parts) + 1)]
+    if not all(descriptions):
+        raise ValueError(f"resposta com {len(by_index)} de {len(parts)} descrições")
+    return descriptions
+
+
+async def describe_image(media: MediaFile, filename: str = "image.jpg") -> str:
+    """
+    Descreve imagem usando GPT-4 Vision.
+    Retorna descrição detalhada da imagem.
+    """
+    try:
+        part = await _image_part(media, filename)
+        return (await _vision_describe([part]))[0]
     except Exception as e:
         raise Exception(f"Erro ao descrever imagem: {str(e)}")
 
 
-async def process_document(document_bytes: bytes, filename: str, mime_type: str) -> str:
+def _group_parts(parts: List[Dict[str, Any]]) -> List[List[int]]:
+    """Índices agrupados respeitando MEDIA_VISION_BATCH_MAX_IMAGES e MEDIA_VISION_BATCH_MAX_BYTES."""
+    groups: List[List[int]] = []
+    current: List[int] = []
+    current_bytes = 0
+    for i, part in enumerate(parts):
+        size = len(part["image_url"]["url"])
+        if current and (len(current) >= VISION_BATCH_MAX_IMAGES or current_bytes + size > VISION_BATCH_MAX_BYTES):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(i)
+        current_bytes += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def describe_images(
+    medias: List[MediaFile],
+    filenames: List[str],
+    sem: Optional[asyncio.Semaphore] = None,
+    on_result: Optional[Callable[[int, Dict[str, Any]], Awaitable[None]]] = None,
+) -> List[Dict[str, Any]]:
     """
-    Processa documentos (PDF, DOCX, etc).
-    Para PDFs e imagens, usa GPT-4 Vision.
-    Para outros formatos, tenta extrair texto.
+    Descreve várias imagens da mesma mensagem com o mínimo de chamadas: agrupa
+    em requisições com várias imagens (dentro dos limites) e, se a resposta
+    agrupada falhar, descreve as imagens daquele grupo uma a uma.
+    Devolve um resultado por imagem, na ordem ({"success", "content"|"error"}).
+    Cada chamada ao Vision ocupa uma vaga de `sem`; `on_result(índice, resultado)`
+    é chamado assim que o grupo da imagem termina (um grupo lento não segura os outros).
     """
-    # Se for PDF ou imagem, usa GPT-4 Vision
-    if mime_type.startswith("image/") or mime_type == "application/pdf":
-        return await describe_image(document_bytes, filename)
-    
-    # Para outros formatos, tenta extrair texto básico
-    # (pode ser expandido com bibliotecas específicas)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(medias)
+    parts: List[Optional[Dict[str, Any]]] = [None] * len(medias)
+
+    async def _set(i: int, result: Dict[str, Any]) -> None:
+        results[i] = result
+        if on_result is not None:
+            await on_result(i, result)
+
+    for i, (media, filename) in enumerate(zip(medias, filenames)):
+        try:
+            parts[i] = await _image_part(media, filename)
+        except Exception as e:
+            await _set(i, {"success": False, "error": f"Erro ao descrever imagem: {str(e)}"})
+    ready = [i for i, part in enumerate(parts) if part is not None]
+
+    async def _vision(group_parts: List[Dict[str, Any]]) -> List[str]:
+        if sem is None:
+            return await _vision_describe(group_parts)
+        async with sem:
+            return await _vision_describe(group_parts)
+
+    async def _describe_group(group: List[int]) -> None:
+        if len(group) > 1:
+            try:
+                descriptions = await _vision([parts[i] for i in group])
+                metrics.incr("media.vision.batched_images", len(group))
+                for i, description in zip(group, descriptions):
+                    await _set(i, {"success": True, "content": description})
+                return
+            except Exception as e:
+                metrics.incr("media.vision.batch_fallback")
+                print(f"[MEDIA] ⚠️  Vision em grupo falhou ({e}); descrevendo {len(group)} imagens separadamente")
+        for i in group:
+            try:
+                await _set(i, {"success": True, "content": (await _vision([parts[i]]))[0]})
+            except Exception as e:
+                await _set(i, {"success": False, "error": f"Erro ao descrever imagem: {str(e)}"})
+
+    groups = [[ready[j] for j in group] for group in _group_parts([parts[i] for i in ready])]
+    await asyncio.gather(*(_describe_group(group) for group in groups))
+    return results
+
+
+async def process_document(media: MediaFile, filename: str, mime_type: str) -> str:
+    """
+    Processa documentos (PDF, DOCX, texto, imagem enviada como documento).
+    Texto extraído localmente (doc_extract); o Vision só entra para imagens e
+    para páginas de PDF sem texto (escaneadas).
+    """
+    # O conteúdo manda: um "documento" que na verdade é PDF/foto segue o tipo real
+    sniffed = media.sniffed_type or ""
+    if sniffed == "application/pdf" or sniffed.startswith("image/"):
+        mime_type = sniffed
+
+    if mime_type.startswith("image/"):
+        return await describe_image(media, filename)
+
     try:
-        if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            # DOCX - requer python-docx (não implementado ainda)
-            return "Documento Word recebido. Por favor, descreva o conteúdo ou envie como PDF/imagem."
-        elif mime_type == "text/plain":
-            # Texto simples
-            return document_bytes.decode('utf-8', errors='ignore')
-        else:
-            return f"Documento recebido ({mime_type}). Por favor, descreva o conteúdo ou envie como PDF/imagem."
+        if mime_type == "application/pdf":
+            if not doc_extract.PDF_AVAILABLE:
+                # Sem PyPDF2: comportamento antigo (PDF direto no Vision)
+                return await describe_image(media, filename)
+            return await _process_pdf(media, filename)
+        if doc_extract.is_docx(mime_type, filename):
+            text, truncated = await asyncio.to_thread(doc_extract.extract_docx, media.rewind())
+            if not text:
+                return "Documento Word recebido, mas sem texto legível."
+            return _document_text("Documento Word", text, truncated)
+        if doc_extract.is_text(mime_type):
+            text, truncated = await asyncio.to_thread(doc_extract.extract_text, media.rewind())
+            return _document_text("Arquivo de texto", text, truncated)
+        return f"Documento recebido ({mime_type}). Por favor, descreva o conteúdo ou envie como PDF/imagem."
     except Exception as e:
         return f"Erro ao processar documento: {str(e)}"
 
 
+def _document_text(label: str, text: str, truncated: bool) -> str:
+    note = "\n[... documento truncado]" if truncated else ""
+    return f"{label}:\n{text}{note}"
+
+
+async def _process_pdf(media: MediaFile, filename: str) -> str:
+    started = time.perf_counter()
+    # Páginas escaneadas: a imagem embutida vem junto (até MEDIA_PDF_VISION_PAGES)
+    result = await doc_extract.extract_pdf(media.rewind(), image_pages=PDF_VISION_PAGES)
+    sections = [(page, f"[Página {page}]\n{text}") for page, text in result["texts"]]
+
+    # Mesmo com o texto truncado: as imagens são só de páginas lidas e, sem elas,
+    # um PDF escaneado longo chegaria à IA sem nenhum conteúdo
+    images = result["images"]
+    if images:
+        descriptions = await asyncio.gather(
+            *(_describe_bytes(data, name) for _, name, data in images),
+            return_exceptions=True,
+        )
+        for (page, _, _), description in zip(images, descriptions):
+            if isinstance(description, Exception):
+                print(f"[DOC] Vision falhou na página {page}: {description}")
+                continue
+            sections.append((page, f"[Página {page} (imagem)]\n{description}"))
+        metrics.incr("media.doc.pdf_vision_pages", len(images))
+        sections.sort(key=lambda section: section[0])
+
+    metrics.observe("media.doc.pdf_ms", (time.perf_counter() - started) * 1000.0)
+    print(
+        f"[DOC] PDF {filename}: {result['pages']} página(s), {len(result['texts'])} com texto, "
+        f"{len(result['empty_pages'])} sem texto, {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+    if not sections:
+        return f"Documento PDF recebido ({result['pages']} página(s)), mas sem texto legível."
+    header = f"Documento PDF ({result['pages']} página(s))"
+    if result["truncated"]:
+        header += f", lidas {result['read_pages']} por limite de tamanho"
+    return _document_text(header, "\n\n".join(text for _, text in sections), result["truncated"])
+
+
+async def _describe_bytes(data: bytes, name: str) -> str:
+    page_media = MediaFile()
+    try:
+        page_media.write(data)
+        return await describe_image(page_media, name or "pagina.jpg")
+    finally:
+        page_media.close()
+
+
 async def process_media(
     media_url: str,
     media_type: str,  # "audio", "image", "document"
@@ -167,44 +569,217 @@ async def process_media(
         - success: bool
         - content: str (texto transcrito/descrito)
         - error: str (se houver erro)
+        - cached: True se veio do cache de análise (mesmo arquivo já processado)
     """
     try:
-        # Baixa a mídia
-        media_bytes = await download_media(media_url)
-        
-        if media_type == "audio":
-            content = await transcribe_audio(media_bytes, filename or "audio.ogg")
-            return {
-                "success": True,
-                "content": content,
-                "type": "transcription"
-            }
-        elif media_type == "image":
-            content = await describe_image(media_bytes, filename or "image.jpg")
-            return {
-                "success": True,
-                "content": content,
-                "type": "description"
-            }
-        elif media_type == "document":
-            content = await process_document(
-                media_bytes,
-                filename or "document",
-                mime_type or "application/octet-stream"
-            )
-            return {
-                "success": True,
-                "content": content,
-                "type": "extraction"
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Tipo de mídia não suportado: {media_type}"
-            }
+        # Baixa a mídia (streaming para arquivo temporário, com limite de tamanho)
+        media = await download_media(media_url)
     except Exception as e:
+        # Inclui MediaTooLargeError (mensagem já explica o limite)
         return {
             "success": False,
             "error": str(e)
         }
 
+    try:
+        # Mesmo arquivo (mesmos bytes) já analisado com o mesmo modelo: devolve na hora
+        model = _analysis_model(media, media_type, mime_type)
+        if model:
+            cached = await media_cache.get(media.sha256, media_type, model)
+            if cached:
+                print(f"[MEDIA-CACHE] ✅ {media_type} {media.sha256[:12]} ({media.size} bytes)")
+                return {"success": True, "content": cached["content"], "type": cached["type"], "cached": True}
+
+        result = await _analyze(media, media_type, filename, mime_type)
+        if model and result.get("success"):
+            await media_cache.put(media.sha256, media_type, model, result.get("type"), result.get("content"), media.size)
+        return result
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    finally:
+        media.close()
+
+
+def _analysis_model(media: MediaFile, media_type: str, mime_type: Optional[str]) -> Optional[str]:
+    """Modelo que vai analisar a mídia (chave do cache); None se não usa modelo."""
+    if media_type == "audio":
+        return TRANSCRIBE_MODEL
+    if media_type == "image":
+        return VISION_MODEL
+    if media_type == "document":
+        effective = media.sniffed_type or mime_type or ""
+        if effective.startswith("image/"):
+            return VISION_MODEL
+        if effective == "application/pdf" and doc_extract.PDF_AVAILABLE:
+            # Texto local + Vision nas páginas escaneadas (chave distinta do PDF inteiro no Vision)
+            return f"pdf-text+{VISION_MODEL}"
+        if effective == "application/pdf":
+            return VISION_MODEL
+    return None
+
+
+async def _analyze(media: MediaFile, media_type: str, filename: Optional[str], mime_type: Optional[str]) -> Dict[str, Any]:
+    if media_type == "audio":
+        content = await transcribe_audio(media, filename or "audio.ogg")
+        return {
+            "success": True,
+            "content": content,
+            "type": "transcription"
+        }
+    elif media_type == "image":
+        content = await describe_image(media, filename or "image.jpg")
+        return {
+            "success": True,
+            "content": content,
+            "type": "description"
+        }
+    elif media_type == "document":
+        content = await process_document(
+            media,
+            filename or "document",
+            mime_type or "application/octet-stream"
+        )
+        return {
+            "success": True,
+            "content": content,
+            "type": "extraction"
+        }
+    else:
+        return {
+            "success": False,
+            "error": f"Tipo de mídia não suportado: {media_type}"
+        }
+
+
+async def _process_image_group(
+    items: List[Dict[str, Any]],
+    sem: asyncio.Semaphore,
+    on_result: Callable[[int, Dict[str, Any]], Awaitable[None]],
+) -> None:
+    """
+    Imagens da mesma mensagem: baixa/consulta o cache uma a uma e descreve as
+    que faltam juntas. Cada resultado sai por `on_result(índice, resultado)`
+    assim que fica pronto.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    medias: List[Optional[MediaFile]] = [None] * len(items)
+
+    async def _set(i: int, result: Dict[str, Any]) -> None:
+        results[i] = result
+        await on_result(i, result)
+
+    async def _fetch(i: int, item: Dict[str, Any]) -> None:
+        async with sem:
+            try:
+                media = await download_media(item["media_url"])
+            except Exception as e:
+                await _set(i, {"success": False, "error": str(e)})
+                return
+            medias[i] = media
+            cached = await media_cache.get(media.sha256, "image", VISION_MODEL)
+        if cached:
+            print(f"[MEDIA-CACHE] ✅ image {media.sha256[:12]} ({media.size} bytes)")
+            await _set(i, {"success": True, "content": cached["content"], "type": cached["type"], "cached": True})
+
+    try:
+        await asyncio.gather(*(_fetch(i, item) for i, item in enumerate(items)))
+        todo = [i for i, result in enumerate(results) if result is None]
+        if todo:
+
+            async def _described(position: int, result: Dict[str, Any]) -> None:
+                i = todo[position]
+                if result["success"]:
+                    result["type"] = "description"
+                    await media_cache.put(medias[i].sha256, "image", VISION_MODEL, "description", result["content"], medias[i].size)
+                await _set(i, result)
+
+            await describe_images(
+                [medias[i] for i in todo],
+                [items[i].get("filename") or "image.jpg" for i in todo],
+                sem=sem,
+                on_result=_described,
+            )
+    finally:
+        for media in medias:
+            if media is not None:
+                media.close()
+
+
+async def process_media_batch(
+    items: List[Dict[str, Any]],
+    concurrency: int = MEDIA_CONCURRENCY,
+    timeout: float = MEDIA_BATCH_TIMEOUT,
+    on_result: Optional[Callable[[int, Dict[str, Any]], Awaitable[None]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Processa vários anexos em paralelo (no máximo `concurrency` por vez) e
+    devolve os resultados na ordem original. Cada item tem os argumentos de
+    `process_media`; item que falha ou não termina dentro de `timeout`
+    (tempo total do lote) vira {"success": False, "error": ...} sem afetar os demais.
+    Duas ou mais imagens vão juntas para o Vision (ver `describe_images`); no
+    tempo limite só perdem o resultado as imagens de grupos ainda em andamento.
+    `on_result(índice, resultado)` é chamado a cada item concluído (progresso).
+    """
+    if not items:
+        return []
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _notify(index: int, result: Dict[str, Any]) -> None:
+        if on_result is None:
+            return
+        try:
+            await on_result(index, result)
+        except Exception as e:
+            print(f"[MEDIA] Erro no callback de progresso: {e}")
+
+    async def _one(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            result = await process_media(**item)
+        await _notify(index, result)
+        return result
+
+    image_indexes: List[int] = []
+    if VISION_BATCH_ENABLED:
+        image_indexes = [i for i, item in enumerate(items) if item.get("media_type") == "image"]
+        if len(image_indexes) < 2:
+            image_indexes = []
+    # Preenchido grupo a grupo: o que terminou antes do tempo limite é mantido
+    image_results: Dict[int, Dict[str, Any]] = {}
+
+    async def _group(indexes: List[int]) -> None:
+        async def _done(position: int, result: Dict[str, Any]) -> None:
+            image_results[indexes[position]] = result
+            await _notify(indexes[position], result)
+
+        await _process_image_group([items[i] for i in indexes], sem, _done)
+
+    tasks = {i: asyncio.create_task(_one(i, item)) for i, item in enumerate(items) if i not in image_indexes}
+    group_task = None
+    if image_indexes:
+        group_task = asyncio.create_task(_group(image_indexes))
+    all_tasks = list(tasks.values()) + ([group_task] if group_task else [])
+    _, pending = await asyncio.wait(all_tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        # Espera o cancelamento para os arquivos temporários serem fechados
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def _result(task: asyncio.Task) -> Any:
+        if task in pending:
+            return {"success": False, "error": "Tempo limite excedido ao processar a mídia"}
+        if task.exception() is not None:
+            return {"success": False, "error": str(task.exception())}
+        return task.result()
+
+    results: List[Dict[str, Any]] = [None] * len(items)
+    for i, task in tasks.items():
+        results[i] = _result(task)
+    if group_task is not None:
+        group_error = _result(group_task)
+        for i in image_indexes:
+            results[i] = image_results.get(i) or group_error or {"success": False, "error": "Imagem não processada"}
+    return results
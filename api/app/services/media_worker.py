@@ -0,0 +1,103 @@
+# api/app/services/media_worker.py
+"""
+Pool de workers para processar mídia fora do request do webhook.
+
+Baixar, transcrever e descrever anexos e depois rodar a LLM passava do
+timeout do webhook da Twilio, que reenviava a mensagem (processamento em
+dobro). Agora o webhook grava a mensagem com as referências da mídia, entrega
+o job para este pool e responde na hora; o handler (definido em main.py)
+processa a mídia, atualiza a mensagem e dispara a resposta.
+
+- `MEDIA_WORKERS` workers consomem uma fila em memória (até
+  `MEDIA_QUEUE_MAX` jobs; cheia, `submit` devolve False e quem chama decide).
+- Jobs da mesma thread rodam em ordem, um de cada vez.
+- A fila não sobrevive a reinícios: jobs pendentes ficam com a mensagem
+  marcada como "pending".
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from . import metrics
+from .keyed_lock import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "4"))
+MEDIA_QUEUE_MAX = int(os.getenv("MEDIA_QUEUE_MAX", "200"))
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class MediaWorkerPool:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # thread_id -> lock que serializa os jobs da mesma thread
+        self._locks = KeyedLocks()
+        self._busy = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.workers)]
+        logger.info(f"[MEDIA-WORKER] {self.workers} worker(s) iniciados")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queue is not None and self._queue.qsize():
+            logger.warning(f"[MEDIA-WORKER] {self._queue.qsize()} job(s) descartados no shutdown")
+        self._queue = None
+
+    def submit(self, job: Dict[str, Any], handler: JobHandler) -> bool:
+        """Enfileira o job (precisa de `thread_id`). False se a fila estiver cheia."""
+        if self._queue is None:
+            self.start()
+        try:
+            self._queue.put_nowait((job, handler, time.monotonic()))
+        except asyncio.QueueFull:
+            metrics.incr("media.worker.rejected")
+            return False
+        metrics.incr("media.worker.submitted")
+        return True
+
+    async def _run(self, index: int) -> None:
+        while True:
+            job, handler, queued_at = await self._queue.get()
+            metrics.observe("media.worker.queue_wait_ms", (time.monotonic() - queued_at) * 1000.0)
+            thread_id = job["thread_id"]
+            self._busy += 1
+            try:
+                async with self._locks.hold(thread_id):
+                    await handler(job)
+                metrics.incr("media.worker.done")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.incr("media.worker.failed")
+                logger.exception(f"[MEDIA-WORKER] Erro no job da thread {thread_id}")
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "busy": self._busy,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "done": int(metrics.counter("media.worker.done")),
+            "failed": int(metrics.counter("media.worker.failed")),
+            "rejected": int(metrics.counter("media.worker.rejected")),
+        }
+
+
+media_worker = MediaWorkerPool(MEDIA_WORKERS, MEDIA_QUEUE_MAX)
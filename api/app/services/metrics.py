@@ -0,0 +1,76 @@
+# api/app/services/metrics.py
+"""
+Métricas em memória do processo: contadores e amostras recentes (latências etc.).
+Sem dependência externa; expostas em GET /metrics.
+Os valores zeram quando o processo reinicia.
+"""
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional
+
+# Quantidade de amostras mantidas por série (janela deslizante)
+MAX_SAMPLES = 500
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_samples: Dict[str, Deque[float]] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Incrementa um contador."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """Registra uma amostra (ex: latência em ms)."""
+    with _lock:
+        series = _samples.get(name)
+        if series is None:
+            series = deque(maxlen=MAX_SAMPLES)
+            _samples[name] = series
+        series.append(float(value))
+
+
+def samples(name: str) -> List[float]:
+    """Cópia das amostras recentes de uma série."""
+    with _lock:
+        return list(_samples.get(name, ()))
+
+
+def counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil (0-100) por interpolação linear; None se não houver amostras."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    pos = (len(ordered) - 1) * (q / 100.0)
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def snapshot() -> dict:
+    """Resumo de todos os contadores e séries (count/avg/p50/p95/p99)."""
+    with _lock:
+        counters = dict(_counters)
+        series = {name: list(values) for name, values in _samples.items()}
+
+    summaries = {}
+    for name, values in series.items():
+        if not values:
+            continue
+        summaries[name] = {
+            "count": len(values),
+            "avg": round(sum(values) / len(values), 2),
+            "p50": round(percentile(values, 50), 2),
+            "p95": round(percentile(values, 95), 2),
+            "p99": round(percentile(values, 99), 2),
+        }
+    return {"counters": counters, "samples": summaries}
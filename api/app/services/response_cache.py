@@ -0,0 +1,109 @@
+# api/app/services/response_cache.py
+"""
+Cache de respostas para perguntas repetidas no primeiro turno da conversa
+("qual o prazo?", "aceita pix?", "onde fica a loja?").
+
+- Opt-in: `LLM_RESPONSE_CACHE_ENABLED=true`.
+- Só vale para o primeiro turno (sem histórico), em que a resposta depende
+  apenas do texto da pergunta.
+- Chave = texto normalizado + documentos RAG detectados + versão do conteúdo
+  (prompt do agente, arquivos RAG e catálogo). Se a versão muda, o cache
+  inteiro é descartado.
+- Entradas expiram por TTL; acima de `LLM_RESPONSE_CACHE_MAX_ENTRIES` sai a
+  menos usada recentemente.
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from . import metrics
+
+CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "86400"))  # segundos
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+
+def normalize_question(text: str) -> str:
+    """Minúsculas, sem acento, sem pontuação/emoji e com espaços colapsados."""
+    text = unicodedata.normalize("NFD", text or "")
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class ResponseCache:
+    def __init__(self, enabled: bool, ttl: float, max_entries: int):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, message: str, rag_docs: List[str], version: str) -> str:
+        self._check_version(version)
+        raw = f"{normalize_question(message)}|{','.join(sorted(rag_docs))}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] < time.time():
+                self._entries.pop(key, None)
+                entry = None
+            if not entry:
+                metrics.incr("llm.cache.miss")
+                return None
+            entry["hits"] += 1
+            self._entries.move_to_end(key)
+            metrics.incr("llm.cache.hit")
+            return entry["reply"]
+
+    def put(self, key: str, message: str, reply: str, rag_docs: List[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "key": key,
+                "question": normalize_question(message),
+                "rag_docs": sorted(rag_docs),
+                "reply": reply,
+                "hits": 0,
+                "created_at": now,
+                "expires_at": now + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        metrics.incr("llm.cache.store")
+
+    def list_entries(self) -> List[Dict]:
+        now = time.time()
+        with self._lock:
+            return [dict(e) for e in self._entries.values() if e["expires_at"] >= now]
+
+    def purge(self, key: Optional[str] = None, reason: str = "manual") -> int:
+        """Remove uma entrada (ou todas, se `key` for None). Retorna quantas saíram."""
+        with self._lock:
+            if key is not None:
+                removed = 1 if self._entries.pop(key, None) else 0
+            else:
+                removed = len(self._entries)
+                self._entries.clear()
+        if removed:
+            print(f"[CACHE] {removed} resposta(s) removida(s) ({reason})")
+            metrics.incr("llm.cache.purged", removed)
+        return removed
+
+    def _check_version(self, version: str) -> None:
+        # Prompt, documentos RAG ou catálogo mudaram: respostas antigas não valem mais
+        if self.version is not None and version != self.version:
+            self.purge(reason="content_changed")
+        self.version = version
+
+
+response_cache = ResponseCache(CACHE_ENABLED, CACHE_TTL, CACHE_MAX_ENTRIES)
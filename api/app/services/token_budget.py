@@ -0,0 +1,248 @@
+# api/app/services/token_budget.py
+"""
+Contabilidade e orçamento de tokens (base: `usage` das completions).
+
+- Por conversa: total acumulado em `threads.llm_prompt_tokens` /
+  `threads.llm_completion_tokens` (atualizado em segundo plano após cada resposta).
+- Por dia: soma de `llm_calls` do dia, relida a cada
+  `LLM_BUDGET_REFRESH_SECONDS`, mais o consumido localmente que a telemetria
+  ainda pode não ter gravado. "Dia" é o `current_date` do banco, o mesmo
+  relógio de `llm_calls.created_at`.
+- Limite soft (conversa ou dia): rota completa com histórico curto e sem RAG.
+- Limite hard da conversa: a IA não responde e a conversa passa para
+  `human_takeover`. Limite hard do dia: a IA não é chamada e cada conversa
+  recebe uma vez `LLM_BUDGET_DAILY_FALLBACK`; nada é gravado como takeover
+  (no dia seguinte o bot volta sozinho). As conversas pausadas no dia aparecem
+  em /metrics.
+
+Limites em tokens (entrada + saída); 0 = desligado (padrão).
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import date, datetime
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+from sqlalchemy import func, update
+
+from . import metrics
+from .llm_telemetry import FLUSH_SECONDS
+from ..db import SessionLocal
+from ..models import Thread, LLMCall
+
+logger = logging.getLogger(__name__)
+
+THREAD_SOFT_LIMIT = int(os.getenv("LLM_THREAD_TOKEN_SOFT_LIMIT", "0"))
+THREAD_HARD_LIMIT = int(os.getenv("LLM_THREAD_TOKEN_HARD_LIMIT", "0"))
+DAILY_SOFT_LIMIT = int(os.getenv("LLM_DAILY_TOKEN_SOFT_LIMIT", "0"))
+DAILY_HARD_LIMIT = int(os.getenv("LLM_DAILY_TOKEN_HARD_LIMIT", "0"))
+SOFT_MAX_HISTORY = int(os.getenv("LLM_BUDGET_SOFT_MAX_HISTORY", "4"))
+REFRESH_SECONDS = float(os.getenv("LLM_BUDGET_REFRESH_SECONDS", "30"))
+DAILY_FALLBACK = os.getenv(
+    "LLM_BUDGET_DAILY_FALLBACK", "Recebemos sua mensagem! Um atendente vai te responder em breve."
+)
+# Consumo local mais novo que isso pode ainda não estar em `llm_calls` (lote da telemetria)
+_UNFLUSHED_SECONDS = FLUSH_SECONDS + 5.0
+
+BUDGET_OK = "ok"
+BUDGET_SOFT = "soft"
+BUDGET_HARD = "hard"
+_SEVERITY = {BUDGET_OK: 0, BUDGET_SOFT: 1, BUDGET_HARD: 2}
+
+
+def _status(used: int, soft: int, hard: int) -> str:
+    if hard and used >= hard:
+        return BUDGET_HARD
+    if soft and used >= soft:
+        return BUDGET_SOFT
+    return BUDGET_OK
+
+
+def _read_thread_tokens(thread_id: int) -> int:
+    db = SessionLocal()
+    try:
+        row = db.query(Thread.llm_prompt_tokens, Thread.llm_completion_tokens).filter(Thread.id == thread_id).first()
+        return int((row[0] or 0) + (row[1] or 0)) if row else 0
+    finally:
+        db.close()
+
+
+def _read_daily_tokens() -> Tuple[Optional[date], int]:
+    """(dia, tokens do dia) pelo relógio do banco, o mesmo que grava `llm_calls.created_at`."""
+    db = SessionLocal()
+    try:
+        day = db.query(func.current_date()).scalar()
+        total = (
+            db.query(func.coalesce(func.sum(LLMCall.prompt_tokens + LLMCall.completion_tokens), 0))
+            .filter(LLMCall.created_at >= func.current_date())
+            .scalar()
+        )
+        if isinstance(day, str):  # SQLite devolve texto
+            day = date.fromisoformat(day)
+        return day, int(total or 0)
+    finally:
+        db.close()
+
+
+def _add_thread_usage(thread_id: int, prompt_tokens: int, completion_tokens: int) -> None:
+    db = SessionLocal()
+    try:
+        # Incremento atômico no banco (várias respostas da mesma thread podem terminar juntas)
+        db.execute(
+            update(Thread)
+            .where(Thread.id == thread_id)
+            .values(
+                llm_prompt_tokens=func.coalesce(Thread.llm_prompt_tokens, 0) + prompt_tokens,
+                llm_completion_tokens=func.coalesce(Thread.llm_completion_tokens, 0) + completion_tokens,
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _block_thread(thread_id: int, reason: str) -> None:
+    db = SessionLocal()
+    try:
+        t = db.get(Thread, thread_id)
+        if not t:
+            return
+        t.human_takeover = True
+        meta = dict(t.meta or {})
+        meta["budget"] = {"blocked": True, "reason": reason, "at": datetime.utcnow().isoformat()}
+        t.meta = meta
+        db.commit()
+    finally:
+        db.close()
+
+
+class TokenBudget:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._db_total = 0
+        # (monotonic, tokens) consumidos desde a última leitura ou ainda sem flush da telemetria
+        self._local: Deque[Tuple[float, int]] = deque()
+        self._refreshed_at = 0.0
+        self._pending: Set[asyncio.Task] = set()
+        # Conversas que já receberam o aviso do limite diário (zera quando o dia vira)
+        self._paused_day: Optional[date] = None
+        self._paused: Set[Optional[int]] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return any((THREAD_SOFT_LIMIT, THREAD_HARD_LIMIT, DAILY_SOFT_LIMIT, DAILY_HARD_LIMIT))
+
+    def daily_tokens(self) -> int:
+        """Tokens do dia (pode ler o banco; chamar fora do event loop)."""
+        now = time.monotonic()
+        with self._lock:
+            stale = self._day is None or now - self._refreshed_at > REFRESH_SECONDS
+        if stale:
+            day, total = _read_daily_tokens()
+            with self._lock:
+                self._day, self._db_total, self._refreshed_at = day, total, now
+                # A leitura já inclui o que a telemetria gravou; o mais recente pode
+                # ainda estar no lote dela, então continua contando localmente (na
+                # dúvida conta a mais, não a menos)
+                while self._local and self._local[0][0] < now - _UNFLUSHED_SECONDS:
+                    self._local.popleft()
+        with self._lock:
+            return self._db_total + self._local_total()
+
+    def _local_total(self) -> int:
+        return sum(tokens for _, tokens in self._local)
+
+    def check(self, thread_id: Optional[int]) -> Tuple[str, Optional[str]]:
+        """(status, motivo) para o próximo turno; o pior entre conversa e dia. Faz I/O."""
+        status, reason = BUDGET_OK, None
+        if DAILY_SOFT_LIMIT or DAILY_HARD_LIMIT:
+            daily = self.daily_tokens()
+            status = _status(daily, DAILY_SOFT_LIMIT, DAILY_HARD_LIMIT)
+            if status != BUDGET_OK:
+                reason = f"daily_{status}:{daily}"
+        if thread_id is not None and (THREAD_SOFT_LIMIT or THREAD_HARD_LIMIT):
+            used = _read_thread_tokens(thread_id)
+            thread_status = _status(used, THREAD_SOFT_LIMIT, THREAD_HARD_LIMIT)
+            if _SEVERITY[thread_status] > _SEVERITY[status]:
+                status, reason = thread_status, f"thread_{thread_status}:{used}"
+        return status, reason
+
+    def record(self, thread_id: Optional[int], prompt_tokens: int, completion_tokens: int) -> None:
+        """Soma o consumo de uma invocação (não bloqueia; gravação em segundo plano)."""
+        total = (prompt_tokens or 0) + (completion_tokens or 0)
+        if not total:
+            return
+        with self._lock:
+            self._local.append((time.monotonic(), total))
+        metrics.incr("llm.tokens.total", total)
+        if thread_id is not None:
+            self._spawn(asyncio.to_thread(_add_thread_usage, thread_id, prompt_tokens or 0, completion_tokens or 0))
+
+    def daily_fallback(self, thread_id: Optional[int]) -> Optional[str]:
+        """
+        Limite hard do dia: aviso fixo para a conversa, só na primeira mensagem
+        dela no dia (as seguintes ficam sem resposta até virar o dia).
+        """
+        with self._lock:
+            if self._paused_day != self._day:
+                self._paused_day, self._paused = self._day, set()
+            first = thread_id is None or thread_id not in self._paused
+            self._paused.add(thread_id)
+        metrics.incr("llm.budget.daily_skipped")
+        if first:
+            print(f"[BUDGET] ⏸️  Limite diário: thread {thread_id} recebe o aviso fixo")
+        return DAILY_FALLBACK if first and DAILY_FALLBACK else None
+
+    async def block(self, thread_id: int, reason: str) -> None:
+        """Passa a conversa para atendimento humano por estouro do orçamento da conversa."""
+        metrics.incr("llm.budget.blocked")
+        print(f"[BUDGET] 🚫 thread {thread_id} passou para humano ({reason})")
+        await asyncio.to_thread(_block_thread, thread_id, reason)
+
+    def thread_usage(self, t: Thread) -> Dict[str, Any]:
+        prompt = int(getattr(t, "llm_prompt_tokens", 0) or 0)
+        completion = int(getattr(t, "llm_completion_tokens", 0) or 0)
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "soft_limit": THREAD_SOFT_LIMIT or None,
+            "hard_limit": THREAD_HARD_LIMIT or None,
+            "status": _status(prompt + completion, THREAD_SOFT_LIMIT, THREAD_HARD_LIMIT),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado do dia sem I/O (valor da última leitura + consumo local)."""
+        with self._lock:
+            daily = self._db_total + self._local_total()
+            day = self._day
+            paused = len(self._paused) if self._paused_day == day else 0
+        return {
+            "day": day.isoformat() if day else None,
+            "daily_tokens": daily,
+            "daily_soft_limit": DAILY_SOFT_LIMIT or None,
+            "daily_hard_limit": DAILY_HARD_LIMIT or None,
+            "daily_status": _status(daily, DAILY_SOFT_LIMIT, DAILY_HARD_LIMIT),
+            "daily_paused_threads": paused,
+            "thread_soft_limit": THREAD_SOFT_LIMIT or None,
+            "thread_hard_limit": THREAD_HARD_LIMIT or None,
+        }
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(self._guard(coro))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    @staticmethod
+    async def _guard(coro) -> None:
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"[BUDGET] Falha ao gravar consumo de tokens: {e}")
+
+
+token_budget = TokenBudget()
@@ -0,0 +1,174 @@
+# api/app/services/turn_router.py
+"""
+Roteamento local (por regras) dos turnos do usuário antes da LLM.
+
+- full: pipeline completo (prompt do agente + RAG + tools). Padrão.
+- light: cumprimentos, agradecimentos e confirmações simples no meio da
+  conversa. Prompt curto, histórico curto e sem tools.
+- template: agradecimentos/despedidas respondidos com texto pronto, sem
+  chamar a LLM (opcional, `LLM_ROUTER_TEMPLATES=true`).
+
+Na dúvida a rota é sempre `full`: o roteador só desvia turnos que com
+certeza não precisam de catálogo nem de documentos.
+"""
+import os
+import re
+import random
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+ROUTE_FULL = "full"
+ROUTE_LIGHT = "light"
+ROUTE_TEMPLATE = "template"
+
+ROUTER_ENABLED = os.getenv("LLM_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+ROUTER_TEMPLATES = os.getenv("LLM_ROUTER_TEMPLATES", "false").lower() in ("1", "true", "yes")
+# Turnos maiores que isso nunca são considerados triviais
+TRIVIAL_MAX_CHARS = int(os.getenv("LLM_ROUTER_TRIVIAL_MAX_CHARS", "60"))
+
+# Vocabulário (já normalizado: minúsculas, sem acento) por intenção
+_INTENT_WORDS: Dict[str, set] = {
+    "greeting": {
+        "oi", "oii", "oiii", "ola", "olaa", "opa", "eai", "e", "ai", "hey", "hello",
+        "bom", "boa", "dia", "tarde", "noite", "tudo", "bem", "td", "blz",
+        "beleza", "como", "vai", "voce", "vc", "esta", "ta",
+    },
+    "thanks": {
+        "obrigado", "obrigada", "obg", "brigado", "brigada", "valeu", "vlw",
+        "agradeco", "muito", "mto", "mt", "grato", "grata", "show", "top", "otimo", "otima",
+        "perfeito", "perfeita", "massa", "legal", "demais",
+    },
+    "ack": {
+        "ok", "okay", "okk", "blz", "beleza", "certo", "entendi", "entendido", "combinado",
+        "fechado", "ta", "bom", "joia", "sim", "pode", "ser", "claro", "isso", "uhum",
+        "aham", "s", "show", "tranquilo", "de", "boa", "ah", "ata", "hum", "hmm",
+    },
+}
+
+# Despedida só com uma palavra de despedida de fato: "boa tarde" é cumprimento e
+# "mais um"/"depois" não são despedida. "mais", "logo"... só valem depois de "até";
+# "boa noite", "tenha um ótimo dia" só acompanhando a despedida ("tchau, boa noite").
+_BYE_CORE = {"tchau", "ate", "falou", "flw", "bjs", "beijos", "abraco", "abracos"}
+_BYE_AFTER_ATE = {"mais", "logo", "amanha", "depois", "breve", "a"}
+_BYE_COURTESY = {"tenha", "um", "uma", "otimo", "otima", "bom", "boa", "dia", "tarde", "noite", "semana", "fim", "de"}
+
+_THANKS_CORE = {"obrigado", "obrigada", "obg", "brigado", "brigada", "valeu", "vlw", "agradeco", "grato", "grata"}
+
+# Respostas afirmativas que, após uma pergunta da IA, pedem ação (ex: gerar link)
+_AFFIRMATIVE = {"sim", "pode", "pode ser", "isso", "claro", "quero", "s", "ok", "okay", "beleza", "blz", "fechado", "combinado"}
+
+# Turno da IA que oferece algo ou propõe uma ação: um "ok"/"sim" depois disso é
+# confirmação (precisa de tools/catálogo), não um simples "entendi"
+_OFFER_STEMS = (
+    "posso", "gostaria", "quer", "deseja", "prefere", "podemos", "vamos", "link", "pedido",
+    "carrinho", "comprar", "compra", "finalizar", "fechar", "reserv", "agend", "orcamento",
+    "oferta", "promoc", "desconto", "frete", "pagamento", "pix", "boleto", "parcel", "preco",
+    "valor", "envi", "mando", "separar", "confirm",
+)
+
+_MEDIA_MARKERS = ("[áudio transcrito]", "[descrição da imagem]", "[conteúdo do documento]", "[erro ao processar mídia")
+
+_TEMPLATES: Dict[str, List[str]] = {
+    "thanks": [
+        "Por nada! 😊 Se precisar de mais alguma coisa, é só chamar.",
+        "Imagina! Qualquer dúvida, estou por aqui. 😊",
+    ],
+    "bye": [
+        "Até mais! 👋 Quando precisar, é só mandar mensagem.",
+        "Combinado! Até logo. 😊",
+    ],
+}
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFD", text or "")
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    text = text.lower().strip()
+    # Remove emojis/pontuação, mantém letras, números e espaços
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _is_bye_word(words: List[str], i: int) -> bool:
+    w = words[i]
+    return w in _BYE_CORE or (w in _BYE_AFTER_ATE and i > 0 and words[i - 1] == "ate")
+
+
+def _detect_intent(words: List[str]) -> Optional[str]:
+    """Intenção trivial se TODAS as palavras pertencem ao vocabulário dela."""
+    if not words:
+        return None
+    if all(w in _INTENT_WORDS["thanks"] for w in words):
+        return "thanks"
+    if any(w in _BYE_CORE for w in words) and all(
+        _is_bye_word(words, i) or w in _BYE_COURTESY for i, w in enumerate(words)
+    ):
+        return "bye"
+    for intent in ("greeting", "ack"):
+        if all(w in _INTENT_WORDS[intent] for w in words):
+            return intent
+    # Mistura de cumprimento/agradecimento/ok/tchau ("ok, obrigado!") também é trivial
+    vocab = set().union(*_INTENT_WORDS.values())
+    if all(w in vocab or _is_bye_word(words, i) for i, w in enumerate(words)):
+        return "thanks" if any(w in _THANKS_CORE for w in words) else "ack"
+    return None
+
+
+def _offers_action(assistant_text: str) -> bool:
+    """A última mensagem da IA termina com uma oferta, proposta ou pergunta?"""
+    tail = assistant_text[-300:]
+    if "?" in tail:
+        return True
+    normalized = _normalize(tail)
+    return "r$" in tail.lower() or any(stem in normalized for stem in _OFFER_STEMS)
+
+
+def _last_assistant_message(history: Optional[List[Dict[str, str]]]) -> Optional[str]:
+    for m in reversed(history or []):
+        if m.get("role") == "assistant" and (m.get("content") or "").strip():
+            return m["content"].strip()
+    return None
+
+
+def classify_turn(message: str, history: Optional[List[Dict[str, str]]] = None) -> Tuple[str, str]:
+    """
+    Decide a rota do turno. Retorna (rota, motivo) — o motivo vai para o log.
+    """
+    if not ROUTER_ENABLED:
+        return ROUTE_FULL, "router_disabled"
+
+    raw = (message or "").strip()
+    if not raw:
+        return ROUTE_FULL, "empty"
+    if len(raw) > TRIVIAL_MAX_CHARS:
+        return ROUTE_FULL, "long"
+    if any(marker in raw.lower() for marker in _MEDIA_MARKERS):
+        return ROUTE_FULL, "media"
+    if "?" in raw and not raw.rstrip("?! ").lower().endswith(("tudo bem", "tudo bom", "td bem", "blz", "beleza")):
+        return ROUTE_FULL, "question"
+
+    normalized = _normalize(raw)
+    words = normalized.split()
+    if any(ch.isdigit() for ch in normalized):
+        return ROUTE_FULL, "has_numbers"
+
+    intent = _detect_intent(words)
+    if intent is None:
+        return ROUTE_FULL, "not_trivial"
+
+    last_assistant = _last_assistant_message(history)
+    # Primeiro contato: o agente precisa se apresentar com o prompt completo
+    if last_assistant is None:
+        return ROUTE_FULL, f"{intent}_first_contact"
+    # "sim"/"ok"/"pode ser" depois de uma pergunta ou oferta da IA costuma pedir
+    # ação (link, preço, pedido...): vai pelo pipeline completo, com tools
+    if (normalized in _AFFIRMATIVE or intent == "ack") and _offers_action(last_assistant):
+        return ROUTE_FULL, "answer_to_offer"
+
+    if ROUTER_TEMPLATES and intent in _TEMPLATES:
+        return ROUTE_TEMPLATE, intent
+    return ROUTE_LIGHT, intent
+
+
+def template_reply(intent: str) -> str:
+    return random.choice(_TEMPLATES.get(intent) or _TEMPLATES["thanks"])
@@ -3,9 +3,13 @@
 Módulo para consultar dados do WooCommerce do arquivo JSON
 """
 import json
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 
+from . import metrics
+
 # Caminho do arquivo JSON (tenta múltiplos caminhos)
 _base_path = Path(__file__).parent.parent.parent
 WC_DATA_FILE = _base_path / "arejano_wc_data.json"
@@ -19,6 +23,23 @@ if not WC_DATA_FILE.exists():
 # Cache do arquivo carregado
 _wc_data_cache: Optional[Dict[str, Any]] = None
 
+# Produtos já resolvidos na resposta em andamento (consulta normalizada -> produto).
+# Compartilhado entre as tools de uma mesma invocação do LLM, ver product_memo().
+_product_memo: ContextVar[Optional[Dict[str, Any]]] = ContextVar("wc_product_memo", default=None)
+
+
+@contextmanager
+def product_memo(memo: Dict[str, Any]):
+    """
+    Dentro do bloco, `lookup_product` (e todas as tools que resolvem produto
+    por ele) reaproveita os produtos já encontrados em `memo`.
+    """
+    token = _product_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _product_memo.reset(token)
+
 
 def _load_wc_data() -> Dict[str, Any]:
     """Carrega o arquivo JSON do WooCommerce (com cache)"""
@@ -92,6 +113,24 @@ def lookup_product(query: str) -> Optional[Dict[str, Any]]:
     Returns:
         Dicionário com dados do produto ou None se não encontrar
     """
+    memo = _product_memo.get()
+    if memo is None:
+        return _find_product(query)
+
+    key = _normalize_text(query)
+    if key in memo:
+        metrics.incr("wc.product_memo.hit")
+        return memo[key]
+    product = _find_product(query)
+    memo[key] = product
+    if product:
+        # Busca por nome também resolve as próximas chamadas pelo slug
+        memo.setdefault(_normalize_text(product.get("slug", "")), product)
+    return product
+
+
+def _find_product(query: str) -> Optional[Dict[str, Any]]:
+    """Busca sem memo (ver `lookup_product`)."""
     data = _load_wc_data()
     products = data.get("products", [])
     
@@ -0,0 +1,165 @@
+# api/bench/fake_openai.py
+"""
+Servidor local que imita a API da OpenAI para o benchmark de replay.
+
+- POST /v1/chat/completions: procura a última mensagem "user" nas
+  transcrições carregadas e devolve, rodada a rodada, as tool calls gravadas
+  e depois a resposta final. Mensagens desconhecidas recebem uma resposta
+  genérica (sem tools).
+- POST /v1/audio/transcriptions: devolve um texto fixo.
+- A latência de cada resposta segue uma lognormal ajustada por p50/p99.
+
+Uso isolado (o replay.py sobe este servidor sozinho):
+    python -m bench.fake_openai --transcripts bench/sample_transcripts.jsonl --port 8765
+"""
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+
+class LatencyModel:
+    """Lognormal com mediana `p50_ms` e percentil 99 `p99_ms`."""
+
+    def __init__(self, p50_ms: float, p99_ms: float, seed: Optional[int] = None):
+        self.mu = math.log(max(p50_ms, 1.0))
+        # z(0.99) ≈ 2.326
+        self.sigma = max(0.0, (math.log(max(p99_ms, p50_ms)) - self.mu) / 2.326)
+        self.rng = random.Random(seed)
+
+    def sample_seconds(self) -> float:
+        return self.rng.lognormvariate(self.mu, self.sigma) / 1000.0
+
+
+def load_transcripts(path: str) -> List[Dict[str, Any]]:
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                conversations.append(json.loads(line))
+    return conversations
+
+
+def _turn_index(conversations: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Texto do usuário -> roteiro do turno (tools por rodada + resposta)."""
+    index: Dict[str, Dict[str, Any]] = {}
+    for conv in conversations:
+        for turn in conv.get("turns", []):
+            index[(turn.get("user") or "").strip()] = turn
+    return index
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text or "") // 4)
+
+
+def create_app(conversations: List[Dict[str, Any]], latency: LatencyModel) -> FastAPI:
+    app = FastAPI(title="fake-openai")
+    turns = _turn_index(conversations)
+    app.state.requests = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(req: Request):
+        body = await req.json()
+        app.state.requests += 1
+        messages = body.get("messages", [])
+
+        # Última mensagem do usuário e quantas rodadas de tools já aconteceram depois dela
+        last_user_idx = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+        user_text = messages[last_user_idx].get("content", "") if last_user_idx >= 0 else ""
+        if isinstance(user_text, list):  # conteúdo multimodal
+            user_text = " ".join(p.get("text", "") for p in user_text if isinstance(p, dict))
+        rounds_done = sum(
+            1 for m in messages[last_user_idx + 1:] if m.get("role") == "assistant" and m.get("tool_calls")
+        )
+
+        turn = turns.get(user_text.strip())
+        tools_allowed = bool(body.get("tools")) and body.get("tool_choice") != "none"
+        tool_rounds = (turn or {}).get("tools") or []
+
+        await asyncio.sleep(latency.sample_seconds())
+
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        if tools_allowed and rounds_done < len(tool_rounds):
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": json.dumps(call.get("args") or {}, ensure_ascii=False)},
+                }
+                for call in tool_rounds[rounds_done]
+            ]
+            finish_reason = "tool_calls"
+        else:
+            message["content"] = (turn or {}).get("reply") or "Certo! Posso ajudar em mais alguma coisa?"
+
+        prompt_tokens = sum(_approx_tokens(m.get("content") if isinstance(m.get("content"), str) else "") for m in messages)
+        completion_tokens = _approx_tokens(message.get("content") or json.dumps(message.get("tool_calls")))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.post("/v1/audio/transcriptions")
+    async def audio_transcriptions():
+        await asyncio.sleep(latency.sample_seconds())
+        return {"text": "Olá, gostaria de saber o preço do cartão de visita."}
+
+    return app
+
+
+class FakeOpenAIServer:
+    """Sobe o servidor fake numa thread (uvicorn) e espera ficar pronto."""
+
+    def __init__(self, conversations: List[Dict[str, Any]], latency: LatencyModel, port: int = 8765):
+        self.port = port
+        self.app = create_app(conversations, latency)
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self, timeout: float = 10.0) -> None:
+        self.thread.start()
+        started = time.monotonic()
+        while not self.server.started:
+            if time.monotonic() - started > timeout:
+                raise RuntimeError("fake OpenAI não subiu a tempo")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor fake da OpenAI para benchmarks")
+    parser.add_argument("--transcripts", default="bench/sample_transcripts.jsonl")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-p50", type=float, default=800.0, help="ms")
+    parser.add_argument("--latency-p99", type=float, default=4000.0, help="ms")
+    args = parser.parse_args()
+
+    app = create_app(load_transcripts(args.transcripts), LatencyModel(args.latency_p50, args.latency_p99))
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,152 @@
+# api/bench/http_pool.py
+"""
+Micro-benchmark: cliente HTTP novo por chamada vs. cliente compartilhado com
+keep-alive (app/services/http_clients.py), contra um stub HTTPS local.
+
+O stub usa um certificado autoassinado gerado com o `openssl` da máquina e
+conta quantas conexões TLS foram abertas. Cada modo faz as mesmas N
+requisições (GET de um arquivo de `--size` KB, como um download de mídia).
+
+Uso (a partir de api/):
+    python -m bench.http_pool --requests 200 --concurrency 8 --size 200
+"""
+import os
+import ssl
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from app.services import http_clients  # noqa: E402
+
+
+def _make_cert(workdir: str) -> tuple:
+    cert = os.path.join(workdir, "cert.pem")
+    key = os.path.join(workdir, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+            "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+class _Stub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, payload: bytes, latency: float):
+        super().__init__(addr, _Handler)
+        self.payload = payload
+        self.latency = latency
+        self.connections = 0
+        self.lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(self.server.payload)))
+        self.end_headers()
+        self.wfile.write(self.server.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * q)))], 2)
+
+
+async def _run_mode(mode: str, url: str, verify: ssl.SSLContext, args) -> Dict[str, float]:
+    latencies: List[float] = []
+    sem = asyncio.Semaphore(args.concurrency)
+    shared = None
+    if mode == "shared":
+        shared = httpx.AsyncClient(
+            verify=verify,
+            limits=http_clients._limits(),
+            timeout=30.0,
+            http2=http_clients._http2(),
+        )
+
+    async def one():
+        async with sem:
+            started = time.perf_counter()
+            if shared is not None:
+                r = await shared.get(url)
+            else:
+                # Comportamento antigo: um cliente (e uma conexão TLS) por chamada
+                async with httpx.AsyncClient(verify=verify, timeout=30.0) as client:
+                    r = await client.get(url)
+            r.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    wall = time.perf_counter() - started
+    if shared is not None:
+        await shared.aclose()
+    return {
+        "wall_s": round(wall, 3),
+        "p50_ms": _percentile(latencies, 0.5),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+    }
+
+
+def main(args) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        cert, key = _make_cert(workdir)
+        server = _Stub(("127.0.0.1", 0), os.urandom(args.size * 1024), args.latency_ms / 1000.0)
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(cert, key)
+        # Handshake na thread de cada conexão, não no accept (não serializa os handshakes)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"https://localhost:{server.server_address[1]}/media"
+        verify = ssl.create_default_context(cafile=cert)
+
+        print(f"{args.requests} GETs de {args.size} KB, concorrência {args.concurrency}")
+        for mode in ("per_call", "shared"):
+            before = server.connections
+            result = asyncio.run(_run_mode(mode, url, verify, args))
+            result["connections"] = server.connections - before
+            print(
+                f"  {mode:9s} total={result['wall_s']}s  p50={result['p50_ms']}ms  "
+                f"p95={result['p95_ms']}ms  p99={result['p99_ms']}ms  conexões={result['connections']}"
+            )
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cliente por chamada vs. cliente compartilhado (HTTPS local)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size", type=int, default=200, help="tamanho da resposta em KB")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latência simulada do servidor")
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+# api/bench/media_loop_lag.py
+"""
+Verifica se o processamento de mídia trava o event loop.
+
+Sobe a OpenAI fake (bench/fake_openai.py) e um servidor HTTP local com um
+áudio e uma imagem, processa `--items` anexos com
+`media_processor.process_media_batch` e mede o atraso de um timer de 10ms
+durante todo o processamento. Sai com código 1 se o maior atraso passar de
+`--max-lag-ms` (serve como checagem de regressão no CI/local).
+
+Uso (a partir de api/):
+    python -m bench.media_loop_lag --items 6 --latency-p50 1500 --max-lag-ms 100
+"""
+import os
+import sys
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fake_openai import FakeOpenAIServer, LatencyModel  # noqa: E402
+from bench.replay import LoopMonitor  # noqa: E402
+
+_FILES = {
+    "/audio.ogg": ("audio/ogg", b"OggS" + os.urandom(256 * 1024)),
+    "/image.png": ("image/png", b"\x89PNG\r\n\x1a\n" + os.urandom(1024 * 1024)),
+}
+
+
+class _MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        content_type, payload = _FILES.get(self.path, ("application/octet-stream", b""))
+        self.send_response(200 if payload else 404)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+async def main(args) -> int:
+    fake = FakeOpenAIServer([], LatencyModel(args.latency_p50, args.latency_p50 * 2, seed=1), port=args.port)
+    fake.start()
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.pop("TWILIO_ACCOUNT_SID", None)  # servidor local não usa auth
+    os.environ["MEDIA_CACHE_ENABLED"] = "false"  # os anexos repetem os mesmos bytes
+
+    media_server = ThreadingHTTPServer(("127.0.0.1", 0), _MediaHandler)
+    media_server.daemon_threads = True
+    threading.Thread(target=media_server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{media_server.server_address[1]}"
+
+    # Importa depois de apontar OPENAI_BASE_URL para a fake
+    from app.services import media_processor, http_clients
+
+    items = []
+    for i in range(args.items):
+        if i % 2 == 0:
+            items.append({"media_url": f"{base}/audio.ogg", "media_type": "audio", "mime_type": "audio/ogg"})
+        else:
+            items.append({"media_url": f"{base}/image.png", "media_type": "image", "mime_type": "image/png"})
+
+    monitor = LoopMonitor(block_threshold_ms=args.max_lag_ms)
+    monitor.start()
+    results = await media_processor.process_media_batch(items, concurrency=args.concurrency)
+    await monitor.stop()
+    await http_clients.close()
+    media_server.shutdown()
+    fake.stop()
+
+    report = monitor.report()
+    lag = report["lag_ms"]
+    ok = sum(1 for r in results if r.get("success"))
+    print(f"{ok}/{len(results)} mídias processadas")
+    for r in results:
+        if not r.get("success"):
+            print(f"  erro: {r.get('error')}")
+    print(f"Event loop (lag ms): p50={lag['p50']}  p99={lag['p99']}  max={lag['max']}")
+    print(f"Bloqueios >= {args.max_lag_ms}ms: {report['blocked_events']} ({report['blocked_total_ms']} ms no total)")
+
+    if (lag["max"] or 0) > args.max_lag_ms:
+        print(f"FALHOU: event loop travou {lag['max']}ms (limite {args.max_lag_ms}ms)")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checa bloqueio do event loop durante o processamento de mídia")
+    parser.add_argument("--items", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--latency-p50", type=float, default=1500.0, help="latência fake da OpenAI (ms)")
+    parser.add_argument("--max-lag-ms", type=float, default=100.0)
+    parser.add_argument("--port", type=int, default=8766)
+    sys.exit(asyncio.run(main(parser.parse_args())))
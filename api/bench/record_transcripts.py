@@ -0,0 +1,102 @@
+# api/bench/record_transcripts.py
+"""
+Exporta conversas reais para o formato de replay (JSONL, uma conversa por linha).
+
+Cada mensagem do cliente vira um turno; a resposta do bot e as tool calls
+(agrupadas por rodada) vêm da tabela `llm_calls`. Telefones e nomes são
+anonimizados — o texto das mensagens NÃO é; revise antes de compartilhar.
+
+Uso (a partir de api/, apontando para o banco de produção/staging):
+    DB_URL=postgresql+psycopg2://... python -m bench.record_transcripts --days 7 --limit 200 \\
+        --out bench/transcripts.jsonl
+"""
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.db import SessionLocal  # noqa: E402
+from app.models import Thread, Message, LLMCall  # noqa: E402
+
+
+def _tool_rounds(call: LLMCall) -> List[List[Dict[str, Any]]]:
+    rounds: Dict[int, List[Dict[str, Any]]] = {}
+    for item in call.tool_calls or []:
+        rounds.setdefault(int(item.get("round") or 1), []).append(
+            {"name": item.get("name"), "args": item.get("args") or {}}
+        )
+    return [rounds[r] for r in sorted(rounds)]
+
+
+def export_thread(db, thread: Thread, index: int, channel: str) -> Dict[str, Any]:
+    messages = (
+        db.query(Message)
+        .filter(Message.thread_id == thread.id, Message.role.in_(["user", "assistant"]))
+        .order_by(Message.id.asc())
+        .all()
+    )
+    # Só chamadas que realmente passaram pelo modelo têm roteiro de tools
+    calls = (
+        db.query(LLMCall)
+        .filter(LLMCall.thread_id == thread.id)
+        .order_by(LLMCall.id.asc())
+        .all()
+    )
+
+    turns: List[Dict[str, Any]] = []
+    call_idx = 0
+    for msg in messages:
+        if msg.role == "user":
+            turns.append({"user": msg.content, "tools": [], "reply": None})
+        elif not msg.is_human and turns and turns[-1]["reply"] is None:
+            # Cada resposta do bot corresponde à próxima linha de llm_calls
+            turns[-1]["reply"] = msg.content
+            if call_idx < len(calls):
+                turns[-1]["tools"] = _tool_rounds(calls[call_idx])
+                call_idx += 1
+
+    return {
+        "id": f"t{index:05d}",
+        "channel": channel,
+        "phone": f"+5500900{index:06d}",
+        "profile_name": f"Cliente {index}",
+        "turns": turns,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    since = datetime.now() - timedelta(days=args.days)
+    db = SessionLocal()
+    written = 0
+    try:
+        threads = (
+            db.query(Thread)
+            .filter(Thread.created_at >= since)
+            .order_by(Thread.id.desc())
+            .limit(args.limit)
+            .all()
+        )
+        with open(args.out, "w", encoding="utf-8") as f:
+            for i, thread in enumerate(threads, start=1):
+                conv = export_thread(db, thread, i, args.channel)
+                if len(conv["turns"]) < args.min_turns:
+                    continue
+                f.write(json.dumps(conv, ensure_ascii=False) + "\n")
+                written += 1
+    finally:
+        db.close()
+    print(f"{written} conversa(s) exportada(s) para {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta conversas para o benchmark de replay")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--limit", type=int, default=200, help="máximo de threads lidas")
+    parser.add_argument("--min-turns", type=int, default=1)
+    parser.add_argument("--channel", choices=["twilio", "meta"], default="twilio")
+    parser.add_argument("--out", default="bench/transcripts.jsonl")
+    main(parser.parse_args())
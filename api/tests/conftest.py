@@ -0,0 +1,11 @@
+# api/tests/conftest.py
+import os
+import sys
+import tempfile
+
+# Os módulos criam o cliente OpenAI no import; nenhum teste chama a API de verdade
+os.environ.setdefault("OPENAI_API_KEY", "test")
+# Banco SQLite descartável (app.main cria as tabelas no import)
+os.environ.setdefault("DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
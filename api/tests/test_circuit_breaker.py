@@ -0,0 +1,56 @@
+# api/tests/test_circuit_breaker.py
+import asyncio
+import time
+
+from app.services import llm_service
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def _half_open(breaker: CircuitBreaker) -> None:
+    breaker.state = OPEN
+    breaker.opened_at = time.monotonic() - breaker.open_seconds - 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    breaker.release()
+
+
+def test_release_frees_half_open_probe():
+    breaker = CircuitBreaker("test", half_open_probes=1)
+    _half_open(breaker)
+
+    assert breaker.allow()
+    assert not breaker.allow()  # única vaga de probe ocupada
+    breaker.release()
+    assert breaker.allow()
+    breaker.record(True, 10.0)
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_does_not_stick_half_open(monkeypatch):
+    breaker = CircuitBreaker("test", half_open_probes=1)
+    _half_open(breaker)
+    monkeypatch.setattr(llm_service, "llm_breaker", breaker)
+
+    started = asyncio.Event()
+
+    async def _hang(kwargs, model, hedge):
+        started.set()
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(llm_service, "_create_completion", _hang)
+
+    async def _scenario():
+        task = asyncio.create_task(
+            llm_service._call_openai_with_retries([{"role": "user", "content": "oi"}], use_functions=False)
+        )
+        await started.wait()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(_scenario())
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()  # a vaga do probe cancelado foi devolvida
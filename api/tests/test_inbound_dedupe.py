@@ -0,0 +1,182 @@
+# api/tests/test_inbound_dedupe.py
+import asyncio
+
+import pytest
+
+from app import main
+from app.db import SessionLocal
+from app.models import Contact, InboundJob, InboundJobMessage, Message, Thread, User
+from app.services import metrics
+
+
+class _Request:
+    def __init__(self, data):
+        self._data = data
+
+    async def json(self):
+        return self._data
+
+
+def _delivery(phone, *ids):
+    return {"entry": [{"changes": [{"value": {
+        "contacts": [{"wa_id": phone, "profile": {"name": "Maria"}}],
+        "messages": [{"from": phone, "id": pid, "text": {"body": f"texto {pid}"}} for pid in ids],
+    }}]}]}
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    for model in (InboundJobMessage, InboundJob, Message, Contact, Thread):
+        session.query(model).delete()
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    calls = []
+
+    async def _reply(db, t, content, hist, channel, phone):
+        calls.append(content)
+        return {"status": "ok"}
+
+    async def _broadcast(thread_id, event):
+        return None
+
+    monkeypatch.setattr(main, "_reply_to_turn", _reply)
+    monkeypatch.setattr(main, "_broadcast", _broadcast)
+    monkeypatch.setattr(main.inbound_buffer, "window", 0)
+    return calls
+
+
+def _thread(db, phone, takeover=False):
+    owner = db.query(User).first() or User(email="dono@local", password_hash="x")
+    db.add(owner)
+    db.commit()
+    t = Thread(user_id=owner.id, title="Maria", external_user_phone=phone, human_takeover=takeover)
+    db.add(t)
+    db.commit()
+    return t
+
+
+def test_meta_retry_with_other_first_id_is_not_enqueued_again(db, monkeypatch):
+    monkeypatch.setattr(main.inbound_queue, "enabled", True)
+    first = asyncio.run(main.meta_webhook(_Request(_delivery("5561999990000", "wamid.A", "wamid.B")), db))
+    avoided = metrics.counter("llm.duplicate_calls_avoided")
+    retry = asyncio.run(main.meta_webhook(_Request(_delivery("5561999990000", "wamid.B")), db))
+
+    assert first == {"status": "ok", "queued": True}
+    assert retry == {"status": "ok", "duplicate": True}
+    assert db.query(InboundJob).count() == 1
+    assert {pid for (pid,) in db.query(InboundJobMessage.provider_message_id)} == {"wamid.A", "wamid.B"}
+    assert metrics.counter("llm.duplicate_calls_avoided") == avoided + 1
+
+
+def test_meta_retry_under_takeover_does_not_count_avoided_call(db, monkeypatch):
+    monkeypatch.setattr(main.inbound_queue, "enabled", True)
+    _thread(db, "+5561999990001", takeover=True)
+    asyncio.run(main.meta_webhook(_Request(_delivery("5561999990001", "wamid.C")), db))
+    avoided = metrics.counter("llm.duplicate_calls_avoided")
+    duplicates = metrics.counter("webhook.meta.duplicate")
+    asyncio.run(main.meta_webhook(_Request(_delivery("5561999990001", "wamid.C")), db))
+
+    assert metrics.counter("webhook.meta.duplicate") == duplicates + 1
+    assert metrics.counter("llm.duplicate_calls_avoided") == avoided
+
+
+def test_meta_job_resumes_only_unanswered_messages(db, replies):
+    t = _thread(db, "+5561999990002")
+    db.add_all([
+        Message(thread_id=t.id, role="user", content="respondida", provider_message_id="wamid.D"),
+        Message(thread_id=t.id, role="assistant", content="resposta"),
+        Message(thread_id=t.id, role="user", content="sem resposta", provider_message_id="wamid.E"),
+    ])
+    db.commit()
+    payload = {"from": "5561999990002", "profile_name": "Maria", "messages": [
+        {"id": "wamid.D", "text": "respondida"},
+        {"id": "wamid.E", "text": "sem resposta"},
+        {"id": "wamid.F", "text": "nova"},
+    ]}
+    asyncio.run(main._handle_meta_inbound(db, payload))
+
+    assert replies == ["sem resposta\nnova"]
+    assert db.query(Message).filter(Message.provider_message_id == "wamid.F").count() == 1
+
+
+def test_meta_job_does_not_resume_answered_or_buffered_messages(db, replies, monkeypatch):
+    t = _thread(db, "+5561999990003")
+    m = Message(thread_id=t.id, role="user", content="no buffer", provider_message_id="wamid.G")
+    db.add(m)
+    db.commit()
+    monkeypatch.setattr(main.inbound_buffer, "contains", lambda thread_id, message_id: message_id == m.id)
+    payload = {"from": "5561999990003", "profile_name": None, "messages": [{"id": "wamid.G", "text": "no buffer"}]}
+    result = asyncio.run(main._handle_meta_inbound(db, payload))
+
+    assert result == {"status": "ok", "duplicate": True}
+    assert replies == []
+
+
+def test_concurrent_retry_keeps_profile_and_contact_updates(db, replies, monkeypatch):
+    t = _thread(db, "+5561999990004")
+    t.title = "WhatsApp 0004"
+    db.add(Message(thread_id=t.id, role="user", content="já gravada", provider_message_id="wamid.H"))
+    db.commit()
+    # Simula o retry concorrente: a checagem inicial ainda não via wamid.H
+    monkeypatch.setattr(main, "_inbound_messages", lambda db, ids: {})
+    payload = {"from": "5561999990004", "profile_name": "Joana", "messages": [
+        {"id": "wamid.H", "text": "já gravada"},
+        {"id": "wamid.I", "text": "nova"},
+    ]}
+    asyncio.run(main._handle_meta_inbound(db, payload))
+    db.expire_all()
+
+    t = db.get(Thread, t.id)
+    assert t.title == "Joana"
+    assert t.meta["profile_name"] == "Joana"
+    assert db.query(Contact).filter(Contact.thread_id == t.id).one().name == "Joana"
+    assert [m.provider_message_id for m in db.query(Message).filter(Message.thread_id == t.id).order_by(Message.id)] == [
+        "wamid.H", "wamid.I",
+    ]
+    assert replies == ["nova"]
+
+
+def test_meta_inbound_batches_groups_by_sender_across_entries():
+    data = {"entry": [
+        {"changes": [
+            {"value": {
+                "contacts": [{"wa_id": "551", "profile": {"name": "Ana"}}],
+                "messages": [
+                    {"from": "551", "id": "w1", "text": {"body": "oi"}},
+                    {"from": "552", "id": "w2", "text": {"body": "olá"}},
+                ],
+            }},
+            {"value": {"statuses": [{"id": "w0", "status": "read"}]}},
+        ]},
+        {"changes": [{"value": {
+            "contacts": [{"wa_id": "552", "profile": {"name": "Bia"}}],
+            "messages": [
+                {"from": "551", "id": "w3", "text": {"body": "tudo bem?"}},
+                {"from": "552", "id": "w4", "text": {"body": "preço?"}},
+            ],
+        }}]},
+    ]}
+    assert main._meta_inbound_batches(data) == [
+        {"from": "551", "profile_name": "Ana", "messages": [{"id": "w1", "text": "oi"}, {"id": "w3", "text": "tudo bem?"}]},
+        {"from": "552", "profile_name": "Bia", "messages": [{"id": "w2", "text": "olá"}, {"id": "w4", "text": "preço?"}]},
+    ]
+
+
+def test_meta_inbound_batches_tolerates_missing_fields():
+    data = {"entry": [{"changes": [{"value": {"messages": [
+        {"from": "551", "type": "image", "image": {"id": "m1"}},  # sem id nem texto
+        {"id": "w9", "text": {"body": "sem remetente"}},
+        {"from": "551", "id": "w10", "text": None},
+    ]}}]}, {}]}
+    assert main._meta_inbound_batches(data) == [
+        {"from": "551", "profile_name": None, "messages": [{"id": None, "text": ""}, {"id": "w10", "text": ""}]},
+    ]
+    assert main._meta_inbound_batches({}) == []
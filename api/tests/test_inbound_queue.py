@@ -0,0 +1,31 @@
+# api/tests/test_inbound_queue.py
+import asyncio
+
+from app.services import inbound_queue as iq
+
+
+def test_running_job_keeps_heartbeat(monkeypatch):
+    beats = []
+    monkeypatch.setattr(iq, "INBOUND_JOB_TIMEOUT", 0.03)
+    monkeypatch.setattr(iq, "_heartbeat", lambda ids: beats.append(sorted(ids)))
+    monkeypatch.setattr(iq, "_finish", lambda job_id: None)
+
+    async def _slow(payload):
+        await asyncio.sleep(0.1)
+
+    async def _run():
+        queue = iq.InboundQueue(enabled=True, workers=1)
+        queue.handlers = {"twilio": _slow}
+        heartbeat = asyncio.create_task(queue._heartbeat_loop())
+        try:
+            await queue._run({"id": 7, "channel": "twilio", "payload": {}, "attempts": 1})
+            count = len(beats)
+            await asyncio.sleep(0.05)
+            return count
+        finally:
+            heartbeat.cancel()
+
+    during = asyncio.run(_run())
+    assert during >= 2
+    assert all(ids == [7] for ids in beats)
+    assert len(beats) == during  # terminado o job, não renova mais
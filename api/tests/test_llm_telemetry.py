@@ -0,0 +1,25 @@
+# api/tests/test_llm_telemetry.py
+import asyncio
+
+from app.services import llm_telemetry
+
+
+def test_stop_writes_in_flight_batch_and_whole_queue(monkeypatch):
+    written = []
+    monkeypatch.setattr(llm_telemetry, "_write_batch", lambda rows: written.extend(rows))
+    monkeypatch.setattr(llm_telemetry, "BATCH_SIZE", 5)
+    monkeypatch.setattr(llm_telemetry, "FLUSH_SECONDS", 3600)
+
+    async def _scenario():
+        writer = llm_telemetry.TelemetryWriter()
+        writer.start()
+        for i in range(3):
+            writer.record({"id": i})
+        await asyncio.sleep(0.01)  # _run tirou as 3 da fila e espera completar o lote
+        assert writer.queue.empty()
+        for i in range(3, 15):
+            writer.queue.put_nowait({"id": i})  # mais de um lote parado na fila
+        await writer.stop()
+
+    asyncio.run(_scenario())
+    assert sorted(row["id"] for row in written) == list(range(15))
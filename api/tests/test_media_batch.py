@@ -0,0 +1,61 @@
+# api/tests/test_media_batch.py
+import asyncio
+
+from app.services import media_processor as mp
+
+
+class _Cache:
+    async def get(self, *args):
+        return None
+
+    async def put(self, *args):
+        return None
+
+
+def _stub(monkeypatch, slow_urls=()):
+    state = {"active": 0, "peak": 0}
+
+    async def _download(url, auth=None):
+        media = mp.MediaFile()
+        media.write(url.encode())
+        return media
+
+    async def _part(media, filename):
+        return {"type": "image_url", "image_url": {"url": media.rewind().read().decode(), "detail": "low"}}
+
+    async def _describe(parts):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            if any(p["image_url"]["url"] in slow_urls for p in parts):
+                await asyncio.sleep(3600)
+            await asyncio.sleep(0.01)
+            return [f"desc {p['image_url']['url']}" for p in parts]
+        finally:
+            state["active"] -= 1
+
+    monkeypatch.setattr(mp, "download_media", _download)
+    monkeypatch.setattr(mp, "_image_part", _part)
+    monkeypatch.setattr(mp, "_vision_describe", _describe)
+    monkeypatch.setattr(mp, "media_cache", _Cache())
+    monkeypatch.setattr(mp, "VISION_BATCH_ENABLED", True)
+    monkeypatch.setattr(mp, "VISION_BATCH_MAX_IMAGES", 1)
+    return state
+
+
+def _items(n):
+    return [{"media_url": f"img{i}", "media_type": "image"} for i in range(n)]
+
+
+def test_vision_calls_respect_concurrency(monkeypatch):
+    state = _stub(monkeypatch)
+    results = asyncio.run(mp.process_media_batch(_items(6), concurrency=2, timeout=5))
+    assert [r["content"] for r in results] == [f"desc img{i}" for i in range(6)]
+    assert state["peak"] <= 2
+
+
+def test_slow_group_only_fails_its_own_images(monkeypatch):
+    _stub(monkeypatch, slow_urls={"img2"})
+    results = asyncio.run(mp.process_media_batch(_items(4), concurrency=4, timeout=0.3))
+    assert [r["success"] for r in results] == [True, True, False, True]
+    assert "Tempo limite" in results[2]["error"]
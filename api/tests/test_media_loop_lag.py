@@ -0,0 +1,122 @@
+# api/tests/test_media_loop_lag.py
+import io
+import os
+import asyncio
+from types import SimpleNamespace
+
+from PIL import Image
+
+from app.services import media_processor as mp
+
+OPENAI_DELAY = 0.3
+MAX_LAG_MS = 100.0
+
+
+class _FakeOpenAI:
+    """AsyncOpenAI fake: cada chamada demora OPENAI_DELAY segundos."""
+
+    def __init__(self):
+        self.calls = 0
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+
+    async def _transcribe(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(OPENAI_DELAY)
+        return SimpleNamespace(text="transcrição")
+
+    async def _complete(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(OPENAI_DELAY)
+        message = SimpleNamespace(content="descrição")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class _Cache:
+    async def get(self, *args):
+        return None
+
+    async def put(self, *args):
+        return None
+
+
+def _png(side: int) -> bytes:
+    out = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(out, format="PNG")
+    return out.getvalue()
+
+
+_FILES = {
+    "audio": b"OggS" + os.urandom(4 * 1024 * 1024),
+    "image": _png(2048),  # Pillow reduz/regrava (CPU)
+    "raw": b"\x89PNG\r\n\x1a\n" + os.urandom(8 * 1024 * 1024),  # não decodifica: vai em base64
+}
+
+
+async def _max_lag_ms(work) -> float:
+    loop = asyncio.get_running_loop()
+    lags = []
+
+    async def _monitor():
+        while True:
+            started = loop.time()
+            await asyncio.sleep(0.01)
+            lags.append((loop.time() - started - 0.01) * 1000.0)
+
+    monitor = asyncio.create_task(_monitor())
+    try:
+        await work
+    finally:
+        monitor.cancel()
+    return max(lags, default=0.0)
+
+
+def _stub(monkeypatch):
+    fake = _FakeOpenAI()
+
+    async def _download(url, auth=None):
+        # Em blocos, como o download real (streaming)
+        media = mp.MediaFile()
+        data = _FILES[url]
+        for start in range(0, len(data), 64 * 1024):
+            media.write(data[start:start + 64 * 1024])
+            await asyncio.sleep(0)
+        return media
+
+    monkeypatch.setattr(mp, "client", fake)
+    monkeypatch.setattr(mp, "download_media", _download)
+    monkeypatch.setattr(mp, "media_cache", _Cache())
+    return fake
+
+
+def test_transcribe_audio_does_not_block_loop(monkeypatch):
+    fake = _stub(monkeypatch)
+
+    async def _run():
+        media = await mp.download_media("audio")
+        try:
+            work = asyncio.gather(*(mp.transcribe_audio(media) for _ in range(4)))
+            lag = await _max_lag_ms(work)
+            return lag, work.result()
+        finally:
+            media.close()
+
+    lag, texts = asyncio.run(_run())
+    assert texts == ["transcrição"] * 4
+    assert fake.calls == 4
+    assert lag < MAX_LAG_MS
+
+
+def test_process_media_does_not_block_loop(monkeypatch):
+    fake = _stub(monkeypatch)
+    items = [("audio", "audio"), ("image", "image"), ("raw", "image")] * 2
+
+    async def _run():
+        work = asyncio.gather(*(mp.process_media(url, kind) for url, kind in items))
+        lag = await _max_lag_ms(work)
+        return lag, work.result()
+
+    lag, results = asyncio.run(_run())
+    assert all(r["success"] for r in results), results
+    assert fake.calls == len(items)
+    assert lag < MAX_LAG_MS
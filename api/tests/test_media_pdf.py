@@ -0,0 +1,32 @@
+# api/tests/test_media_pdf.py
+import asyncio
+
+from app.services import media_processor as mp
+
+
+def test_scanned_pages_described_even_when_truncated(monkeypatch):
+    async def _extract(f, max_chars=None, image_pages=0):
+        return {
+            "pages": 40,
+            "read_pages": 12,
+            "truncated": True,
+            "texts": [(2, "texto da página dois")],
+            "empty_pages": [1, 3],
+            "images": [(1, "p1.jpg", b"um"), (3, "p3.jpg", b"tres")],
+        }
+
+    async def _describe(data, name):
+        return f"descrição de {name}"
+
+    monkeypatch.setattr(mp.doc_extract, "extract_pdf", _extract)
+    monkeypatch.setattr(mp, "_describe_bytes", _describe)
+
+    media = mp.MediaFile()
+    try:
+        text = asyncio.run(mp._process_pdf(media, "scan.pdf"))
+    finally:
+        media.close()
+
+    assert "lidas 12 por limite de tamanho" in text
+    assert text.index("descrição de p1.jpg") < text.index("texto da página dois") < text.index("descrição de p3.jpg")
+    assert text.endswith("[... documento truncado]")
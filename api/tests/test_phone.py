@@ -0,0 +1,33 @@
+# api/tests/test_phone.py
+import pytest
+
+from app.models import Contact, Thread
+from app.phone import normalize_phone
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("whatsapp:+556184081114", "+556184081114"),
+    ("+556184081114", "+556184081114"),
+    ("556184081114", "+556184081114"),
+    (" +55 (61) 8408-1114 ", "+556184081114"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+def test_thread_phone_e164_follows_external_user_phone():
+    t = Thread(user_id=1, title="x", external_user_phone="whatsapp:+556184081114")
+    assert t.phone_e164 == "+556184081114"
+    t.external_user_phone = "5511999990000"
+    assert t.phone_e164 == "+5511999990000"
+    t.external_user_phone = None
+    assert t.phone_e164 is None
+
+
+def test_contact_phone_e164_follows_phone():
+    c = Contact(thread_id=1, user_id=1, phone="whatsapp:+55 61 8408-1114")
+    assert c.phone_e164 == "+556184081114"
+    c.phone = ""
+    assert c.phone_e164 is None
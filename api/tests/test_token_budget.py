@@ -0,0 +1,29 @@
+# api/tests/test_token_budget.py
+import time
+from datetime import date
+
+from app.services import token_budget as tb
+
+
+def test_refresh_keeps_tokens_telemetry_may_not_have_flushed(monkeypatch):
+    monkeypatch.setattr(tb, "_read_daily_tokens", lambda: (date(2026, 1, 1), 100))
+    budget = tb.TokenBudget()
+    budget._local.append((time.monotonic() - tb._UNFLUSHED_SECONDS - 1, 40))  # já gravado pela telemetria
+    budget._local.append((time.monotonic(), 7))  # pode estar no lote da telemetria
+
+    assert budget.daily_tokens() == 107
+    assert budget.snapshot()["day"] == "2026-01-01"
+
+
+def test_daily_fallback_once_per_thread_per_day(monkeypatch):
+    monkeypatch.setattr(tb, "DAILY_FALLBACK", "Já te respondemos em breve.")
+    budget = tb.TokenBudget()
+    budget._day = date(2026, 1, 1)
+
+    assert budget.daily_fallback(1) == "Já te respondemos em breve."
+    assert budget.daily_fallback(1) is None
+    assert budget.daily_fallback(2) == "Já te respondemos em breve."
+    assert budget.snapshot()["daily_paused_threads"] == 2
+
+    budget._day = date(2026, 1, 2)
+    assert budget.daily_fallback(1) == "Já te respondemos em breve."
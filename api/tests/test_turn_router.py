@@ -0,0 +1,59 @@
+# api/tests/test_turn_router.py
+import pytest
+
+from app.services import turn_router
+from app.services.turn_router import ROUTE_FULL, ROUTE_LIGHT, ROUTE_TEMPLATE, classify_turn
+
+HISTORY = [
+    {"role": "user", "content": "Quanto custa o cartão?"},
+    {"role": "assistant", "content": "O cartão custa R$ 10. Fico à disposição."},
+]
+
+
+@pytest.mark.parametrize("message", ["boa tarde", "Boa noite!", "bom dia", "Oi, boa tarde"])
+def test_greetings_are_not_bye(message):
+    assert classify_turn(message, HISTORY) == (ROUTE_LIGHT, "greeting")
+
+
+@pytest.mark.parametrize("message", ["mais um", "depois", "um", "mais"])
+def test_loose_bye_tokens_go_full(message):
+    assert classify_turn(message, HISTORY)[0] == ROUTE_FULL
+
+
+@pytest.mark.parametrize("message", ["tchau", "Até mais!", "até logo", "tchau, boa noite", "falou, tenha um ótimo dia"])
+def test_farewells_are_bye(message):
+    assert classify_turn(message, HISTORY) == (ROUTE_LIGHT, "bye")
+
+
+def test_mixed_thanks_and_farewell():
+    assert classify_turn("obrigado, até logo", HISTORY) == (ROUTE_LIGHT, "thanks")
+
+
+def test_templates_do_not_answer_greeting_with_goodbye(monkeypatch):
+    monkeypatch.setattr(turn_router, "ROUTER_TEMPLATES", True)
+    assert classify_turn("Boa tarde", HISTORY) == (ROUTE_LIGHT, "greeting")
+    assert classify_turn("tchau", HISTORY) == (ROUTE_TEMPLATE, "bye")
+
+
+def test_first_contact_goes_full():
+    assert classify_turn("boa tarde", []) == (ROUTE_FULL, "greeting_first_contact")
+
+
+@pytest.mark.parametrize("message", ["sim", "ok", "pode ser", "beleza"])
+@pytest.mark.parametrize(
+    "assistant",
+    [
+        "O kit sai por R$ 89,90 com frete grátis.",
+        "Posso gerar o link de pagamento para você.",
+        "Separei o tamanho M no seu carrinho.",
+        "Quer que eu finalize o pedido?",
+    ],
+)
+def test_ack_after_offer_goes_full(message, assistant):
+    history = [{"role": "user", "content": "Quero o kit"}, {"role": "assistant", "content": assistant}]
+    assert classify_turn(message, history) == (ROUTE_FULL, "answer_to_offer")
+
+
+def test_ack_after_plain_information_stays_light():
+    history = [{"role": "user", "content": "Vocês abrem sábado?"}, {"role": "assistant", "content": "Abrimos aos sábados das 9h às 13h."}]
+    assert classify_turn("ok", history) == (ROUTE_LIGHT, "ack")